@@ -11,12 +11,19 @@ A crazyflie server for communicating with several crazyflies
 
 import rclpy
 from rclpy.node import Node
+from rclpy.callback_groups import MutuallyExclusiveCallbackGroup, ReentrantCallbackGroup
+from rclpy.executors import MultiThreadedExecutor
 from rclpy.qos import QoSProfile, QoSReliabilityPolicy, QoSHistoryPolicy
 from rclpy.duration import Duration
 
 import time
+import struct
+import os
+import threading
+import hashlib
 
 import cflib.crtp
+from cflib.crtp.crtpstack import CRTPPacket, CRTPPort
 from cflib.crazyflie.swarm import CachedCfFactory
 from cflib.crazyflie.swarm import Swarm
 from cflib.crazyflie.log import LogConfig
@@ -27,7 +34,8 @@ from crazyflie_interfaces.srv import Takeoff, Land, GoTo, RemoveLogging, AddLogg
 from crazyflie_interfaces.srv import UploadTrajectory, StartTrajectory, NotifySetpointsStop
 from crazyflie_interfaces.srv import Arm
 from rcl_interfaces.msg import ParameterDescriptor, SetParametersResult, ParameterType
-from crazyflie_interfaces.msg import Status, Hover, LogDataGeneric, FullState
+from crazyflie_interfaces.msg import Status, Hover, LogDataGeneric, FullState, FullStateArray
+from crazyflie_interfaces.msg import SwarmState, ConnectionStatistics, ConnectionStatisticsArray
 from motion_capture_tracking_interfaces.msg import NamedPoseArray
 
 from std_srvs.srv import Empty
@@ -37,11 +45,12 @@ from geometry_msgs.msg import PoseStamped, TransformStamped
 from sensor_msgs.msg import LaserScan
 from nav_msgs.msg import Odometry
 
-import tf_transformations
+import numpy as np
 from tf2_ros import TransformBroadcaster
 
 from functools import partial
-from math import degrees, radians, pi, isnan
+from math import degrees, radians, pi, isnan, isfinite, sqrt, sin, cos
+import array
 
 type_cf_param_to_ros_param = {
     "uint8_t": ParameterType.PARAMETER_INTEGER,
@@ -69,6 +78,208 @@ type_cf_param_to_index = {
     'double': 0x07
 }
 
+# packed external position/pose packets (see localization_service.c in the firmware)
+EXT_POSITION_PACKED_CHANNEL = 2
+EXT_POSITION_PACKED_ITEM = struct.Struct("<Bhhh")  # id, x, y, z [mm]
+EXT_POSITION_PACKED_MAX_ITEMS = 4
+GENERIC_CHANNEL = 1
+EXT_POSE_PACKED_TYPE = 9
+EXT_POSE_PACKED_ITEM = struct.Struct("<BhhhI")  # id, x, y, z [mm], compressed quaternion
+EXT_POSE_PACKED_MAX_ITEMS = 2
+
+# full-state setpoint packets (see crtp_commander_generic.c in the firmware)
+FULL_STATE_SETPOINT_TYPE = 6
+FULL_STATE_SETPOINT_DTYPE = np.dtype([
+    ("type", "u1"),
+    ("pos", "<i2", 3),    # [mm]
+    ("vel", "<i2", 3),    # [mm/s]
+    ("acc", "<i2", 3),    # [mm/s^2]
+    ("quat", "<u4"),      # compressed quaternion
+    ("rates", "<i2", 3),  # roll, pitch, yaw rate [mrad/s]
+])
+
+# size of one Poly4D piece in the trajectory memory (4 x 8 coefficients + duration, float32)
+TRAJECTORY_PIECE_SIZE = 132
+# time to wait for a trajectory upload in progress
+TRAJECTORY_UPLOAD_TIMEOUT = 10.0  # s
+
+# link statistics of cflib collected by the monitor, columns of CrazyflieServer.link_sums etc.
+LINK_LATENCY = 0            # 95th percentile of the ping latency [ms]
+LINK_QUALITY = 1            # percentage of packets acknowledged without retries
+LINK_UPLINK_RATE = 2        # packets/s sent to the crazyflie
+LINK_DOWNLINK_RATE = 3      # packets/s received from the crazyflie
+LINK_UPLINK_CONGESTION = 4  # fraction of the sent packets that carry data (i.e., are not null packets)
+LINK_NUM_COLUMNS = 5
+
+# log blocks (see log.c in the firmware): the values of a block are sent in one CRTP packet
+LOG_BLOCK_MAX_SIZE = 26  # bytes, 30 bytes payload - block id - 24 bit timestamp
+LOG_PERIOD_UNIT = 10  # ms, the period of a block is a multiple of 10 ms (see LogConfig in cflib)
+LOG_TYPE_SIZE = {
+    "uint8_t": 1, "int8_t": 1,
+    "uint16_t": 2, "int16_t": 2, "FP16": 2,
+    "uint32_t": 4, "int32_t": 4, "float": 4,
+}
+# float variables whose range and noise allow FP16 (10 bit mantissa)
+LOG_FP16_VARS = {
+    "stabilizer.roll", "stabilizer.pitch", "stabilizer.yaw",  # < 0.13 deg resolution up to 180 deg
+    "kalman.statePX", "kalman.statePY", "kalman.statePZ",     # < 8 mm/s up to 8 m/s
+    "gyro.x", "gyro.y", "gyro.z",                             # < 1 deg/s up to 2000 deg/s
+}
+
+
+def quatcompress(qx, qy, qz, qw):
+    """
+    Compress a unit quaternion into 32 bit, see quatcompress.h in the firmware
+    """
+    q = (qx, qy, qz, qw)
+    i_largest = max(range(4), key=lambda i: abs(q[i]))
+    # -q is the same rotation as q, so make sure the largest element is positive
+    negate = q[i_largest] < 0
+    comp = i_largest
+    for i in range(4):
+        if i != i_largest:
+            negbit = (q[i] < 0) ^ negate
+            mag = int(((1 << 9) - 1) * (abs(q[i]) / sqrt(0.5)) + 0.5)
+            comp = (comp << 10) | (negbit << 9) | mag
+    return comp
+
+
+def quaternion_from_euler(roll, pitch, yaw):
+    """
+    Quaternion (qx, qy, qz, qw) of static xyz Euler angles [rad], like
+        tf_transformations.quaternion_from_euler but without numpy overhead
+    """
+    cr, sr = cos(roll / 2), sin(roll / 2)
+    cp, sp = cos(pitch / 2), sin(pitch / 2)
+    cy, sy = cos(yaw / 2), sin(yaw / 2)
+    return (sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy,
+            cr * cp * cy + sr * sp * sy)
+
+
+def quatcompress_array(q):
+    """
+    Vectorized quatcompress for an array of unit quaternions float[N, 4] (qx, qy, qz, qw)
+    """
+    rows = np.arange(len(q))
+    i_largest = np.argmax(np.abs(q), axis=1)
+    negate = q[rows, i_largest] < 0
+    comp = i_largest.astype(np.uint32)
+    for i in range(4):
+        negbit = ((q[:, i] < 0) ^ negate).astype(np.uint32)
+        mag = (((1 << 9) - 1) * (np.abs(q[:, i]) / sqrt(0.5)) + 0.5).astype(np.uint32)
+        comp = np.where(i_largest != i, (comp << 10) | (negbit << 9) | mag, comp)
+    return comp
+
+
+def broadcast_uri_from_unicast_uri(uri):
+    """
+    Turn radio://0/80/2M/E7E7E7E7E7 into radiobroadcast://0/80/2M
+    """
+    parts = uri.split("/")
+    if not uri.startswith("radio://") or len(parts) < 6:
+        return None
+    return "radiobroadcast://" + "/".join(parts[2:5])
+
+
+def id_from_uri(uri):
+    """
+    The id used in packed packets is the last byte of the radio address
+    """
+    try:
+        return int(uri.split("/")[-1], 16) & 0xFF
+    except ValueError:
+        return None
+
+
+def log_period(frequency):
+    """
+    Period of a log block at frequency [Hz] in units of LOG_PERIOD_UNIT, i.e.,
+        the block is sent at 1000 / (LOG_PERIOD_UNIT * period) Hz
+    """
+    return max(1, round(1000 / (LOG_PERIOD_UNIT * frequency)))
+
+
+def plan_log_blocks(topics, toc_types, max_size=LOG_BLOCK_MAX_SIZE):
+    """
+    Plan the log blocks of one crazyflie for all of its log topics
+
+        topics: dict of topic name -> (frequency, [(variable, type)]), where a type
+            of None is the type of the TOC, or FP16 for the variables in LOG_FP16_VARS
+        toc_types: dict of variable -> type in the TOC
+
+        Frequencies are rounded to the periods the firmware supports (log_period).
+        A variable used by several topics is logged once, at the shortest period
+        and with the largest type requested. A slower topic only shares it if its
+        own period is an integer multiple of that period, otherwise the variable is
+        also logged at the period of that topic, so that every topic keeps its
+        (rounded) rate. The variables of each period are packed into blocks of
+        max_size bytes (first-fit decreasing). Returns a list of blocks (frequency,
+        [(variable, type)]), sorted by frequency from high to low, and a dict of
+        topic name -> (index of the block that triggers the topic, decimation of
+        that block)
+    """
+    types = {}
+    var_periods = {}  # variable -> periods it is logged at
+    topic_periods = {}  # (topic, variable) -> period of the block used by the topic
+    for topic_name, (frequency, log_vars) in sorted(topics.items(), key=lambda item: log_period(item[1][0])):
+        period = log_period(frequency)
+        for name, log_type in log_vars:
+            if log_type is None:
+                log_type = toc_types[name]
+                if log_type == "float" and name in LOG_FP16_VARS:
+                    log_type = "FP16"
+            if name not in types or LOG_TYPE_SIZE[log_type] > LOG_TYPE_SIZE[types[name]]:
+                types[name] = log_type
+            for var_period in var_periods.setdefault(name, []):
+                if period % var_period == 0:
+                    break
+            else:
+                var_period = period
+                var_periods[name].append(period)
+            topic_periods[topic_name, name] = var_period
+
+    blocks = []
+    block_periods = []
+    block_index = {}  # (variable, period) -> index of the block
+    for period in sorted({p for ps in var_periods.values() for p in ps}):
+        names = sorted((name for name in var_periods if period in var_periods[name]),
+                       key=lambda name: LOG_TYPE_SIZE[types[name]], reverse=True)
+        first = len(blocks)
+        sizes = []
+        for name in names:
+            size = LOG_TYPE_SIZE[types[name]]
+            for i, used in enumerate(sizes):
+                if used + size <= max_size:
+                    break
+            else:
+                i = len(sizes)
+                sizes.append(0)
+                blocks.append((1000 / (LOG_PERIOD_UNIT * period), []))
+                block_periods.append(period)
+            sizes[i] += size
+            blocks[first + i][1].append((name, types[name]))
+            block_index[name, period] = first + i
+
+    triggers = {}
+    for topic_name, (frequency, log_vars) in topics.items():
+        indices = [block_index[name, topic_periods[topic_name, name]] for name, _ in log_vars]
+        if not indices:
+            continue
+        # blocks are started in order, so the last of the slowest blocks of a topic
+        # is received after the values of all other blocks have been updated
+        trigger = max(indices, key=lambda i: (block_periods[i], i))
+        triggers[topic_name] = (trigger, log_period(frequency) // block_periods[trigger])
+    return blocks, triggers
+
+
+def log_packet_rate(blocks):
+    """
+    Log packets per second of blocks (frequency, [(variable, type)]) as sent by the firmware
+    """
+    return sum(1000 / (LOG_PERIOD_UNIT * log_period(frequency)) for frequency, _ in blocks)
+
 
 class CrazyflieServer(Node):
     def __init__(self):
@@ -122,6 +333,17 @@ class CrazyflieServer(Node):
         # Init a transform broadcaster
         self.tfbr = TransformBroadcaster(self)
 
+        # Callback groups (same model as the C++ server): the node is spun by a
+        #   MultiThreadedExecutor, so that a slow service (e.g., waiting for a
+        #   trajectory upload) does not block the mocap forwarding, the setpoint
+        #   streaming or the services of other crazyflies.
+        #   Setpoints are streamed in a reentrant group, the mocap poses are
+        #   handled in order, and the services of each crazyflie (see below)
+        #   and of the entire swarm run one at a time.
+        self.callback_group_mocap = MutuallyExclusiveCallbackGroup()
+        self.callback_group_cmd = ReentrantCallbackGroup()
+        self.callback_group_all_srv = MutuallyExclusiveCallbackGroup()
+
         # Create easy lookup tables for uri, name and types
         for crazyflie in robot_data:
             if robot_data[crazyflie]["enabled"]:
@@ -136,8 +358,20 @@ class CrazyflieServer(Node):
                     self.uri_dict[crazyflie] = uri
                     self.type_dict[uri] = type_cf
 
+        # Lookup table for forwarding the motion capture poses: name -> (uri, id)
+        self.mocap_links = {name: (uri, id_from_uri(uri)) for name, uri in self.uri_dict.items()}
+
+        # Index of each crazyflie in the tables of logged states and link statistics
+        self.uri_index = {uri: i for i, uri in enumerate(self.uris)}
+
         # Setup Swarm class cflib with connection callbacks and open the links
-        factory = CachedCfFactory(rw_cache="./cache")
+        #   The TOCs are cached in a fixed location, one file per firmware TOC CRC,
+        #   so that they are shared between workspaces and working directories
+        self.startup_time = {"start": time.time()}
+        toc_cache_dir = os.path.expanduser(self._ros_parameters["firmware_params"].get(
+            "toc_cache_dir", os.path.join(os.environ.get("XDG_CACHE_HOME", "~/.cache"), "crazyflie_server", "toc")))
+        os.makedirs(toc_cache_dir, exist_ok=True)
+        factory = CachedCfFactory(rw_cache=toc_cache_dir)
         self.swarm = Swarm(self.uris, factory=factory)
         self.swarm.fully_connected_crazyflie_cnt = 0
         self.swarm.connected_crazyflie_cnt = 0
@@ -167,6 +401,8 @@ class CrazyflieServer(Node):
             self.swarm._cfs[link_uri].cf.link_statistics.uplink_rate_updated.add_callback(partial(self._uplink_rate_callback, uri=link_uri))
             self.swarm._cfs[link_uri].status["num_tx_unicast"] = 0.0
             self.swarm._cfs[link_uri].cf.link_statistics.downlink_rate_updated.add_callback(partial(self._downlink_rate_callback, uri=link_uri))
+            self.swarm._cfs[link_uri].cf.link_statistics.link_quality_updated.add_callback(partial(self._link_quality_callback, uri=link_uri))
+            self.swarm._cfs[link_uri].cf.link_statistics.uplink_congestion_updated.add_callback(partial(self._uplink_congestion_callback, uri=link_uri))
 
             # check if logging is enabled at startup
             self.swarm._cfs[link_uri].logging = {}
@@ -227,16 +463,10 @@ class CrazyflieServer(Node):
             # Setup log blocks for each custom log and ROS 2 publisher topics
             if custom_logging_enabled:
                 for log_group_name in custom_log_topics:
-                    frequency = custom_log_topics[log_group_name]["frequency"]
-                    lg_custom = LogConfig(
-                        name=log_group_name, period_in_ms=1000 / frequency)
-                    for log_name in custom_log_topics[log_group_name]["vars"]:
-                        lg_custom.add_variable(log_name)
-                        # Don't know which type this needs to be in until we get the full toc
+                    # the log blocks are planned once the TOC is known
                     self.swarm._cfs[link_uri].logging["custom_log_publisher"][log_group_name] = "empty publisher"
                     self.swarm._cfs[link_uri].logging["custom_log_groups"][log_group_name] = {
                     }
-                    self.swarm._cfs[link_uri].logging["custom_log_groups"][log_group_name]["log_config"] = lg_custom
                     self.swarm._cfs[link_uri].logging["custom_log_groups"][log_group_name]["vars"] = custom_log_topics[log_group_name]["vars"]
                     self.swarm._cfs[link_uri].logging["custom_log_groups"][log_group_name][
                         "frequency"] = custom_log_topics[log_group_name]["frequency"]
@@ -258,101 +488,467 @@ class CrazyflieServer(Node):
                     pass
             self.swarm._cfs[link_uri].reference_frame = reference_frame
 
+            # content hashes of the pieces in the trajectory memory, and uploads in progress
+            self.swarm._cfs[link_uri].trajectory_hashes = []
+            self.swarm._cfs[link_uri].trajectory_upload_done = threading.Event()
+            self.swarm._cfs[link_uri].trajectory_upload_done.set()
+            self.swarm._cfs[link_uri].trajectory_upload_ok = True
+            self.swarm._cfs[link_uri].trajectory_upload_lock = threading.Lock()
+
+            # log topics and the planned log blocks (LogConfig, data callback) serving them
+            self.swarm._cfs[link_uri].logging["topics"] = {}
+            self.swarm._cfs[link_uri].logging["log_blocks"] = []
+            self.swarm._cfs[link_uri].logging["values"] = {}
+            self.swarm._cfs[link_uri].log_plan_lock = threading.RLock()
+
+            # services of this crazyflie
+            self.swarm._cfs[link_uri].callback_group_srv = MutuallyExclusiveCallbackGroup()
+
+            # messages of the default log topics, reused for every sample
+            cf_handle = self.swarm._cfs[link_uri]
+            cf_handle.pose_msg = PoseStamped()
+            cf_handle.pose_msg.header.frame_id = reference_frame
+            cf_handle.odom_msg = Odometry()
+            cf_handle.odom_msg.header.frame_id = reference_frame
+            cf_handle.odom_msg.child_frame_id = cf_name
+            cf_handle.custom_log_msg = LogDataGeneric()
+
+        # Transforms of the logged poses: the log callbacks only store the latest
+        #   pose of each crazyflie, a timer sends the new ones of all crazyflies
+        #   in one message
+        self._init_log_transforms()
+
+        # Optionally, the logged states of all crazyflies in one message
+        self._init_swarm_state()
+
+        # Checks of the radio links and the motion capture rate
+        self._init_monitor()
+
+        # Parameters are declared while a Crazyflie connects, which should not
+        #   trigger setting them again on the Crazyflie
+        self._param_declaration = threading.local()
+        self.add_on_set_parameters_callback(self._parameters_callback)
+        self._connect_lock = threading.Lock()
+
         # Now all crazyflies are initialized, open links!
+        #   Crazyflies on different radios connect (and download their TOCs) in parallel,
+        #   Crazyflies on the same radio one after the other. Each Crazyflie gets its
+        #   services as soon as it is connected.
+        self.startup_time["open_links"] = time.time()
+        self.get_logger().info(
+            f"Initialization took {self.startup_time['open_links'] - self.startup_time['start']:.2f} s")
+        radios = {}
+        for link_uri in self.uris:
+            radios.setdefault(link_uri.split("/")[2] if link_uri.startswith("radio://") else link_uri, []).append(link_uri)
+        for radio_uris in radios.values():
+            threading.Thread(target=self._open_links, args=(radio_uris,), daemon=True).start()
+
+    def _init_log_transforms(self):
+        # latest logged state of each crazyflie, see SwarmState for the columns
+        self.log_state_lock = threading.Lock()
+        self.log_states = np.full((len(self.uris), SwarmState.NUM_COLUMNS), np.nan)
+        self.log_supervisor_info = np.zeros(len(self.uris), dtype=np.uint16)
+        self.tf_stamps = np.zeros(len(self.uris), dtype=np.int64)  # [ns]
+        self.tf_updated = np.zeros(len(self.uris), dtype=bool)
+        self.tf_msgs = []
+        for link_uri in self.uris:
+            t_base = TransformStamped()
+            t_base.header.frame_id = self.swarm._cfs[link_uri].reference_frame
+            t_base.child_frame_id = self.cf_dict[link_uri]
+            self.tf_msgs.append(t_base)
+
+        # the timer is created once pose or odom logs are planned, see _update_log_transforms_timer
+        self.tf_timer_lock = threading.Lock()
+        self.tf_timer = None
+        self.tf_frequency = None
+        self.callback_group_tf = MutuallyExclusiveCallbackGroup()
+
+    def _update_log_transforms_timer(self):
+        """
+        (Re)create the timer of the batched transforms with one cycle per
+            sample of the fastest pose or odom log of all crazyflies
+        """
+        frequencies = [topic["frequency"] for link_uri in self.uris
+                       for name, topic in list(self.swarm._cfs[link_uri].logging["topics"].items())
+                       if name in ("pose", "odom")]
+        frequency = max(frequencies, default=None)
+        with self.tf_timer_lock:
+            if frequency == self.tf_frequency:
+                return
+            if self.tf_timer is not None:
+                self.destroy_timer(self.tf_timer)
+                self.tf_timer = None
+            self.tf_frequency = frequency
+            if frequency is not None:
+                self.tf_timer = self.create_timer(1.0 / frequency, self._send_log_transforms,
+                                                  callback_group=self.callback_group_tf)
+
+    def _send_log_transforms(self):
+        with self.log_state_lock:
+            updated = np.flatnonzero(self.tf_updated)
+            if len(updated) == 0:
+                return
+            self.tf_updated[:] = False
+            poses = self.log_states[updated, 0:7].tolist()
+            stamps = self.tf_stamps[updated].tolist()
+
+        transforms = []
+        for i, pose, stamp in zip(updated.tolist(), poses, stamps):
+            t_base = self.tf_msgs[i]
+            t_base.header.stamp.sec, t_base.header.stamp.nanosec = divmod(stamp, 10**9)
+            translation = t_base.transform.translation
+            translation.x, translation.y, translation.z = pose[0:3]
+            rotation = t_base.transform.rotation
+            rotation.x, rotation.y, rotation.z, rotation.w = pose[3:7]
+            transforms.append(t_base)
         try:
-            self.time_open_link = self.get_clock().now().nanoseconds * 1e-9
-            self.swarm.open_links()
-        except Exception as e:
-            # Close node if one of the Crazyflies can not be found
-            self.get_logger().info("Error!: One or more Crazyflies can not be found. ")
-            self.get_logger().info("Check if you got the right URIs, if they are turned on" +
-                                   " or if your script have proper access to a Crazyradio PA")
-            exit()
-    
-    def _init_topics_and_services(self):
-
-        # Create services for the entire swarm and each individual crazyflie
-        for uri in self.cf_dict:
-            if uri == "all":
-                continue
+            self.tfbr.sendTransform(transforms)
+        except:
+            self.get_logger().info("Could not publish pose tf")
 
-            name = self.cf_dict[uri]
+    def _update_log_state(self, uri, stamp, x, y, z, q, velocity=None):
+        i = self.uri_index[uri]
+        with self.log_state_lock:
+            self.log_states[i, 0:7] = (x, y, z, *q)
+            if velocity is not None:
+                self.log_states[i, 7:10] = velocity
+            self.tf_stamps[i] = stamp
+            self.tf_updated[i] = True
+
+    def _init_swarm_state(self):
+        swarm_state = self._ros_parameters.get("swarm_state", {})
+        if not swarm_state.get("enabled", False):
+            return
+        self.swarm_state_publisher = self.create_publisher(SwarmState, "all/swarm_state", 1)
+        self.swarm_state_msg = SwarmState()
+        self.swarm_state_msg.header.frame_id = "world"
+        self.swarm_state_msg.names = [self.cf_dict[uri] for uri in self.uris]
+        self.create_timer(1.0 / swarm_state.get("frequency", 10.0), self._swarm_state_callback,
+                          callback_group=MutuallyExclusiveCallbackGroup())
+
+    def _swarm_state_callback(self):
+        """
+        Publish the latest logged state of all crazyflies in one message
+        """
+        with self.log_state_lock:
+            states = self.log_states.tobytes()
+            supervisor_info = self.log_supervisor_info.tobytes()
+        msg = self.swarm_state_msg
+        msg.header.stamp.sec, msg.header.stamp.nanosec = divmod(self.get_clock().now().nanoseconds, 10**9)
+        # array.array is assigned without per-element checks
+        msg.states = array.array('d', states)
+        msg.supervisor_info = array.array('H', supervisor_info)
+        self.swarm_state_publisher.publish(msg)
+
+    def _open_links(self, link_uris):
+        for link_uri in link_uris:
+            self.startup_time[link_uri] = {"open_link": time.time()}
+            try:
+                self.swarm._cfs[link_uri].open_link()
+            except Exception as e:
+                # Close node if one of the Crazyflies can not be found. This runs in a
+                #   thread of the radio, so shut down the context to stop the executor
+                self.get_logger().error(f"Error!: [{self.cf_dict[link_uri]}] can not be found ({e}). ")
+                self.get_logger().error("Check if you got the right URIs, if they are turned on" +
+                                        " or if your script have proper access to a Crazyradio PA")
+                self.swarm.close_links()
+                rclpy.try_shutdown()
+                return
+
+    def _init_topics_and_services(self, uri):
+
+        # Create services for each individual crazyflie
+        name = self.cf_dict[uri]
+
+        pub = self.create_publisher(String, name + '/robot_description',
+        rclpy.qos.QoSProfile(
+            depth=1,
+            durability=rclpy.qos.QoSDurabilityPolicy.TRANSIENT_LOCAL))
+
+        msg = String()
+        msg.data = self._ros_parameters['robot_description'].replace("$NAME", name)
+        pub.publish(msg)
+
+        # the emergency stop never waits for another service
+        callback_group_srv = self.swarm._cfs[uri].callback_group_srv
+        self.create_service(
+            Empty, name +
+            "/emergency", partial(self._emergency_callback, uri=uri),
+            callback_group=self.callback_group_cmd
+        )
+        self.create_service(
+            Arm, name +
+            "/arm", partial(self._arm_callback, uri=uri),
+            callback_group=callback_group_srv
+        )
+        self.create_service(
+            Takeoff, name +
+            "/takeoff", partial(self._takeoff_callback, uri=uri),
+            callback_group=callback_group_srv
+        )
+        self.create_service(
+            Land, name + "/land", partial(self._land_callback, uri=uri),
+            callback_group=callback_group_srv
+        )
+        self.create_service(
+            GoTo, name + "/go_to", partial(self._go_to_callback, uri=uri),
+            callback_group=callback_group_srv
+        )
+        self.create_service(
+            StartTrajectory, name +
+            "/start_trajectory", partial(
+                self._start_trajectory_callback, uri=uri),
+            callback_group=callback_group_srv
+        )
+        self.create_service(
+            UploadTrajectory, name +
+            "/upload_trajectory", partial(
+                self._upload_trajectory_callback, uri=uri),
+            callback_group=callback_group_srv
+        )
+        self.create_service(
+            NotifySetpointsStop, name +
+            "/notify_setpoints_stop", partial(
+                self._notify_setpoints_stop_callback, uri=uri),
+            callback_group=callback_group_srv
+        )
+        self.create_subscription(
+            Twist, name +
+            "/cmd_vel_legacy", partial(self._cmd_vel_legacy_changed,
+                                       uri=uri), 10,
+            callback_group=self.callback_group_cmd
+        )
+        self.create_subscription(
+            Hover, name +
+            "/cmd_hover", partial(self._cmd_hover_changed, uri=uri), 10,
+            callback_group=self.callback_group_cmd
+        )
 
-            pub = self.create_publisher(String, name + '/robot_description',
-            rclpy.qos.QoSProfile(
-                depth=1,
-                durability=rclpy.qos.QoSDurabilityPolicy.TRANSIENT_LOCAL))
+        self.create_subscription(
+            FullState, name +
+            "/cmd_full_state", partial(self._cmd_full_state_changed, uri=uri), 10,
+            callback_group=self.callback_group_cmd
+        )
 
-            msg = String()
-            msg.data = self._ros_parameters['robot_description'].replace("$NAME", name)
-            pub.publish(msg)
+    def _init_swarm_topics_and_services(self):
 
-            self.create_service(
-                Empty, name +
-                "/emergency", partial(self._emergency_callback, uri=uri)
-            )
-            self.create_service(
-                Arm, name +
-                "/arm", partial(self._arm_callback, uri=uri)
-            )
-            self.create_service(
-                Takeoff, name +
-                "/takeoff", partial(self._takeoff_callback, uri=uri)
-            )
-            self.create_service(
-                Land, name + "/land", partial(self._land_callback, uri=uri)
-            )
-            self.create_service(
-                GoTo, name + "/go_to", partial(self._go_to_callback, uri=uri)
-            )
-            self.create_service(
-                StartTrajectory, name +
-                "/start_trajectory", partial(
-                    self._start_trajectory_callback, uri=uri)
-            )
-            self.create_service(
-                UploadTrajectory, name +
-                "/upload_trajectory", partial(
-                    self._upload_trajectory_callback, uri=uri)
-            )
-            self.create_service(
-                NotifySetpointsStop, name +
-                "/notify_setpoints_stop", partial(
-                    self._notify_setpoints_stop_callback, uri=uri)
-            )
-            self.create_subscription(
-                Twist, name +
-                "/cmd_vel_legacy", partial(self._cmd_vel_legacy_changed,
-                                           uri=uri), 10
-            )
-            self.create_subscription(
-                Hover, name +
-                "/cmd_hover", partial(self._cmd_hover_changed, uri=uri), 10
-            )
+        # A single subscription for the poses of the entire swarm
+        self._init_mocap()
 
-            self.create_subscription(
-                FullState, name +
-                "/cmd_full_state", partial(self._cmd_full_state_changed, uri=uri), 10
-            )
-            qos_profile = QoSProfile(reliability =QoSReliabilityPolicy.BEST_EFFORT,
-                history=QoSHistoryPolicy.KEEP_LAST,
-                depth=1,
-                deadline = Duration(seconds=0, nanoseconds=1e9/100.0))
-
-            self.create_subscription(
-                NamedPoseArray, "/poses",
-                self._poses_changed, qos_profile
-            )
-
-        self.create_service(Arm, "all/arm", self._arm_callback)
-        self.create_service(Takeoff, "all/takeoff", self._takeoff_callback)
-        self.create_service(Land, "all/land", self._land_callback)
-        self.create_service(GoTo, "all/go_to", self._go_to_callback)
+        # Create services for the entire swarm
+        callback_group_srv = self.callback_group_all_srv
+        self.create_service(Arm, "all/arm", self._arm_callback, callback_group=callback_group_srv)
+        self.create_service(Takeoff, "all/takeoff", self._takeoff_callback, callback_group=callback_group_srv)
+        self.create_service(Land, "all/land", self._land_callback, callback_group=callback_group_srv)
+        self.create_service(GoTo, "all/go_to", self._go_to_callback, callback_group=callback_group_srv)
+        self.create_service(
+            StartTrajectory, "all/start_trajectory", self._start_trajectory_callback,
+            callback_group=callback_group_srv)
         self.create_service(
-            StartTrajectory, "all/start_trajectory", self._start_trajectory_callback)
+            UploadTrajectory, "all/upload_trajectory", self._upload_trajectory_callback,
+            callback_group=callback_group_srv)
+
+        # Individual full-state setpoints of many Crazyflies in one message
+        self.create_subscription(
+            FullStateArray, "all/cmd_full_state_array", self._cmd_full_state_array_changed, 10,
+            callback_group=self.callback_group_cmd
+        )
 
         # This is the last service to announce and can be used to check if the server is fully available
-        self.create_service(Empty, "all/emergency", self._emergency_callback)
+        self.create_service(Empty, "all/emergency", self._emergency_callback,
+                            callback_group=self.callback_group_cmd)
+
+    def _init_mocap(self):
+        """
+        Set up forwarding of the motion capture poses to the crazyflies.
+            Robots that share a radio channel get their poses as packed
+            broadcast packets (like the C++ server); if a broadcast link
+            can not be opened, the poses are sent by unicast instead.
+        """
+        self.broadcast_links = {}
+        self.mocap_unicast = set()
+        for name, (uri, cf_id) in self.mocap_links.items():
+            broadcast_uri = broadcast_uri_from_unicast_uri(uri)
+            if broadcast_uri is not None and cf_id is not None and broadcast_uri not in self.broadcast_links:
+                try:
+                    self.broadcast_links[broadcast_uri] = cflib.crtp.get_link_driver(broadcast_uri)
+                except Exception as e:
+                    self.get_logger().info(f"Could not open {broadcast_uri} ({e}), sending poses by unicast")
+                    self.broadcast_links[broadcast_uri] = None
+            if broadcast_uri is None or cf_id is None or self.broadcast_links[broadcast_uri] is None:
+                self.mocap_unicast.add(name)
+
+        qos_profile = QoSProfile(reliability =QoSReliabilityPolicy.BEST_EFFORT,
+            history=QoSHistoryPolicy.KEEP_LAST,
+            depth=1,
+            deadline = Duration(seconds=0, nanoseconds=1e9/100.0))
+
+        self.create_subscription(
+            NamedPoseArray, "/poses",
+            self._poses_changed, qos_profile,
+            callback_group=self.callback_group_mocap
+        )
+        self.mocap_subscribed = True
+
+    def _init_monitor(self):
+        """
+        Set up the checks of the radio links and of the motion capture rate
+            (see warnings in server.yaml). The cflib link statistics of each
+            crazyflie and the received poses are accumulated over one period
+            of warnings.frequency and checked at the end of the period.
+        """
+        warnings = self._ros_parameters["warnings"]
+        self.link_lock = threading.Lock()
+        self.link_connected = np.zeros(len(self.uris), dtype=bool)
+        self._reset_link_statistics()
+        self.monitor_time = time.monotonic()
+        self.monitor_warnings = {}  # key -> (time of the last warning, number of suppressed warnings)
+
+        # motion capture frames of this period, see _new_mocap_stats
+        self.mocap_rate_limits = warnings["motion_capture"]["warning_if_rate_outside"]
+        self.mocap_stats = self._new_mocap_stats()
+        self.mocap_last_frame = None
+        self.mocap_subscribed = False
+        self.mocap_tracked = [name for name, uri in self.uri_dict.items()
+                              if self._ros_parameters["robot_types"][self.type_dict[uri]].get(
+                                  "motion_capture", {}).get("enabled", False)]
+
+        if warnings["communication"].get("publish_stats", False):
+            self.connection_statistics_publisher = self.create_publisher(
+                ConnectionStatisticsArray, "all/connection_statistics", 10)
+        else:
+            self.connection_statistics_publisher = None
+
+        if warnings["frequency"] > 0:
+            # the motion capture statistics are only touched by callbacks of this group
+            self.create_timer(1.0 / warnings["frequency"], self._monitor_callback,
+                              callback_group=self.callback_group_mocap)
+
+    @staticmethod
+    def _new_mocap_stats():
+        """
+        Running statistics of the motion capture frames of one period: frame rate,
+            mocap to radio latency, time to forward the poses, and the number of
+            poses of each crazyflie. Fixed size, also if the monitor is disabled
+        """
+        return {"frames": 0, "dispatch_sum": 0.0, "dispatch_max": 0.0,
+                "latency_count": 0, "latency_sum": 0.0, "latency_max": 0.0,
+                "rate_count": 0, "rate_sum": 0.0, "rate_min": float("inf"), "rate_max": 0.0,
+                "rates_wrong": 0, "poses": {}}
+
+    def _reset_link_statistics(self):
+        self.link_sums = np.zeros((len(self.uris), LINK_NUM_COLUMNS))
+        self.link_counts = np.zeros((len(self.uris), LINK_NUM_COLUMNS), dtype=np.int64)
+        self.link_max = np.zeros((len(self.uris), LINK_NUM_COLUMNS))
+
+    def _link_sample(self, uri, column, value):
+        i = self.uri_index[uri]
+        with self.link_lock:
+            self.link_sums[i, column] += value
+            self.link_counts[i, column] += 1
+            if value > self.link_max[i, column]:
+                self.link_max[i, column] = value
+
+    def _monitor_warn(self, key, text):
+        """
+        Log a warning at most once per warnings.min_interval seconds for each key
+        """
+        now = time.monotonic()
+        last, suppressed = self.monitor_warnings.get(key, (None, 0))
+        if last is not None and now - last < self._ros_parameters["warnings"].get("min_interval", 5.0):
+            self.monitor_warnings[key] = (last, suppressed + 1)
+            return
+        if suppressed > 0:
+            text += f" ({suppressed} similar warnings suppressed)"
+        self.get_logger().warn(text)
+        self.monitor_warnings[key] = (now, 0)
+
+    def _monitor_callback(self):
+        """
+        Check the link statistics of each crazyflie and the motion capture
+            rate over the last period, warn if they are outside the limits
+            and optionally publish the link statistics
+        """
+        now = time.monotonic()
+        elapsed = now - self.monitor_time
+        self.monitor_time = now
+        with self.link_lock:
+            sums, counts, maxima = self.link_sums, self.link_counts, self.link_max
+            connected = self.link_connected.copy()
+            self._reset_link_statistics()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = sums / counts  # NaN without samples
+
+        limits = self._ros_parameters["warnings"]["communication"]
+        names = [self.cf_dict[uri] for uri in self.uris]
+        for i in np.flatnonzero(connected & (counts[:, LINK_LATENCY] == 0)):
+            self._monitor_warn((names[i], "latency"), f"[{names[i]}] No latency update for {elapsed:.1f} s")
+        for i in np.flatnonzero(maxima[:, LINK_LATENCY] > limits["max_unicast_latency"]):
+            self._monitor_warn((names[i], "latency"), f"[{names[i]}] High latency: {maxima[i, LINK_LATENCY]:.1f} ms")
+        for i in np.flatnonzero(means[:, LINK_QUALITY] < 100 * limits["min_unicast_ack_rate"]):
+            self._monitor_warn((names[i], "ack"), f"[{names[i]}] Ack rate: {means[i, LINK_QUALITY]:.1f} %")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            receive_rate = means[:, LINK_DOWNLINK_RATE] / means[:, LINK_UPLINK_RATE]
+        for i in np.flatnonzero(receive_rate < limits["min_unicast_receive_rate"]):
+            self._monitor_warn((names[i], "receive"),
+                f"[{names[i]}] Low unicast receive rate ({receive_rate[i]:.2f} < {limits['min_unicast_receive_rate']:.2f}). "
+                f"Sent: {means[i, LINK_UPLINK_RATE]:.0f}/s. Received: {means[i, LINK_DOWNLINK_RATE]:.0f}/s")
+        for i in np.flatnonzero(means[:, LINK_UPLINK_CONGESTION] > limits.get("max_uplink_congestion", 0.9)):
+            self._monitor_warn((names[i], "congestion"),
+                f"[{names[i]}] Radio link saturated: {100 * means[i, LINK_UPLINK_CONGESTION]:.0f} % of the "
+                f"{means[i, LINK_UPLINK_RATE]:.0f} packets/s carry data")
+
+        if self.connection_statistics_publisher is not None:
+            self._publish_connection_statistics(means, counts, elapsed)
+
+        # motion capture
+        stats = self.mocap_stats
+        self.mocap_stats = self._new_mocap_stats()
+        min_rate = self.mocap_rate_limits[0]
+        if stats["rate_count"] > 0:
+            if stats["rates_wrong"] > 0:
+                self._monitor_warn(("all", "mocap"),
+                    f"[all] Motion capture rate off (#: {stats['rates_wrong']}, "
+                    f"Avg: {stats['rate_sum'] / stats['rate_count']:.1f}, "
+                    f"Min: {stats['rate_min']:.1f}, Max: {stats['rate_max']:.1f})")
+            for name in self.mocap_tracked:
+                rate = stats["poses"].get(name, 0) / elapsed
+                if rate <= min_rate:
+                    self._monitor_warn((name, "mocap"), f"[{name}] Motion capture rate: {rate:.1f} Hz")
+        elif self.mocap_tracked and self.mocap_subscribed:
+            self._monitor_warn(("all", "mocap"), "[all] Motion capture did not receive data!")
+
+        if stats["frames"] > 0:
+            self.get_logger().debug(
+                f"mocap: {stats['frames']} frames, "
+                f"latency (stamp to radio) mean {1000 * stats['latency_sum'] / max(stats['latency_count'], 1):.1f} ms "
+                f"max {1000 * stats['latency_max']:.1f} ms, "
+                f"dispatch mean {1000 * stats['dispatch_sum'] / stats['frames']:.2f} ms "
+                f"max {1000 * stats['dispatch_max']:.2f} ms")
+
+    def _publish_connection_statistics(self, means, counts, elapsed):
+        """
+        Publish the link statistics of the last period. cflib only reports rates,
+            so the packet counts are derived from the mean rates
+        """
+        sent = np.nan_to_num(means[:, LINK_UPLINK_RATE] * elapsed)
+        received = np.nan_to_num(means[:, LINK_DOWNLINK_RATE] * elapsed)
+        acked = sent * np.nan_to_num(means[:, LINK_QUALITY] / 100)
+        enqueued = sent * np.nan_to_num(means[:, LINK_UPLINK_CONGESTION])
+
+        msg = ConnectionStatisticsArray()
+        msg.header.stamp = self.get_clock().now().to_msg()
+        msg.header.frame_id = "world"
+        for i, uri in enumerate(self.uris):
+            stats = ConnectionStatistics()
+            stats.uri = uri
+            stats.sent_count = int(round(sent[i]))
+            stats.sent_ping_count = int(counts[i, LINK_LATENCY])
+            stats.receive_count = int(round(received[i]))
+            stats.enqueued_count = int(round(enqueued[i]))
+            stats.ack_count = int(round(acked[i]))
+            msg.stats.append(stats)
+        self.connection_statistics_publisher.publish(msg)
 
     def _init_default_logblocks(self, prefix, link_uri, list_logvar, global_logging_enabled, topic_type):
         """
@@ -382,19 +978,14 @@ class CrazyflieServer(Node):
         except KeyError:
             pass
 
-        lg = LogConfig(
-            name=prefix, period_in_ms=1000 / logging_freq)
-        for logvar in list_logvar:
-            if prefix == "odom":
-                lg.add_variable(logvar, "FP16")
-            else:
-                lg.add_variable(logvar)
+        log_type = "FP16" if prefix == "odom" else None
 
         self.swarm._cfs[link_uri].logging[prefix +
                                           "_logging_enabled"] = logging_enabled
         self.swarm._cfs[link_uri].logging[prefix +
                                           "_logging_freq"] = logging_freq
-        self.swarm._cfs[link_uri].logging[prefix + "_log_config"] = lg
+        self.swarm._cfs[link_uri].logging[prefix + "_log_vars"] = [
+            (logvar, log_type) for logvar in list_logvar]
         if logging_enabled and global_logging_enabled:
             self.swarm._cfs[link_uri].logging[prefix + "_publisher"] = self.create_publisher(
                 topic_type, self.cf_dict[link_uri] + "/" + prefix, 10)
@@ -420,129 +1011,151 @@ class CrazyflieServer(Node):
         Called when the latency of the Crazyflie is updated
         """
         self.swarm._cfs[uri].status["latency"] = latency
+        self._link_sample(uri, LINK_LATENCY, latency)
 
     def _uplink_rate_callback(self, uplink_rate, uri=""):
         """
         Called when the uplink rate of the Crazyflie is updated
         """
         self.swarm._cfs[uri].status["num_rx_unicast"] = uplink_rate
+        self._link_sample(uri, LINK_UPLINK_RATE, uplink_rate)
 
     def _downlink_rate_callback(self, downlink_rate, uri=""):
         """
         Called when the uplink rate of the Crazyflie is updated
         """
         self.swarm._cfs[uri].status["num_tx_unicast"] = downlink_rate
+        self._link_sample(uri, LINK_DOWNLINK_RATE, downlink_rate)
+
+    def _link_quality_callback(self, link_quality, uri=""):
+        """
+        Called when the link quality (acks without retries) of the Crazyflie is updated
+        """
+        self._link_sample(uri, LINK_QUALITY, link_quality)
+
+    def _uplink_congestion_callback(self, uplink_congestion, uri=""):
+        """
+        Called when the uplink congestion of the Crazyflie is updated
+        """
+        self._link_sample(uri, LINK_UPLINK_CONGESTION, uplink_congestion)
 
     def _connected(self, link_uri):
         """
         Called when the toc of the parameters and
          logs has been received of the Crazyflie
         """
-        self.get_logger().info(f"[{self.cf_dict[link_uri]}] is connected!")
-        self.swarm.connected_crazyflie_cnt += 1
-
-        if self.swarm.connected_crazyflie_cnt == len(self.cf_dict) - 1:
-            self.time_all_crazyflie_connected = self.get_clock().now().nanoseconds * 1e-9
-            self.get_logger().info(f"All Crazyflies are connected! It took {self.time_all_crazyflie_connected - self.time_open_link} seconds")
-            self._init_topics_and_services()
-            self._init_logging()
-            if not self.swarm.query_all_values_on_connect:
-                self._init_parameters()
-                self.add_on_set_parameters_callback(self._parameters_callback)
+        times = self.startup_time[link_uri]
+        times["connected"] = time.time()
+        self.link_connected[self.uri_index[link_uri]] = True
+        # the trajectory memory is empty after a (re)boot
+        self.swarm._cfs[link_uri].trajectory_hashes = []
+
+        # services, logging and (if not waiting for the values) parameters of this Crazyflie
+        self._init_topics_and_services(link_uri)
+        self._init_logging(link_uri)
+        if not self.swarm.query_all_values_on_connect:
+            self._init_parameters(link_uri)
+        times["services"] = time.time()
+        self.get_logger().info(
+            f"[{self.cf_dict[link_uri]}] is connected! Connecting and TOC download took "
+            f"{times['connected'] - times['open_link']:.2f} s, services and logging "
+            f"{times['services'] - times['connected']:.2f} s")
 
-        else:
-            return
+        with self._connect_lock:
+            self.swarm.connected_crazyflie_cnt += 1
+            all_connected = self.swarm.connected_crazyflie_cnt == len(self.cf_dict) - 1
 
+        if all_connected:
+            self._init_swarm_topics_and_services()
+            self.startup_time["connected"] = time.time()
+            self.get_logger().info(f"All Crazyflies are connected! It took {self.startup_time['connected'] - self.startup_time['open_links']:.2f} seconds")
 
     def _fully_connected(self, link_uri):
         """
         Called the full log toc and parameter +  values
           has been received from the Crazyflie
         """
-        self.get_logger().info(f"[{self.cf_dict[link_uri]}] is fully connected!")
-
-        self.swarm.fully_connected_crazyflie_cnt += 1
+        times = self.startup_time[link_uri]
+        times["fully_connected"] = time.time()
+        if self.swarm.query_all_values_on_connect:
+            self._init_parameters(link_uri)
+        self.get_logger().info(
+            f"[{self.cf_dict[link_uri]}] is fully connected! Parameter values took "
+            f"{times['fully_connected'] - times['connected']:.2f} s")
 
         # use len(self.cf_dict) - 1, since cf_dict contains "all" as well
-        if self.swarm.fully_connected_crazyflie_cnt == len(self.cf_dict) - 1:
-            self.time_all_crazyflie_connected = self.get_clock().now().nanoseconds * 1e-9
-            self.get_logger().info(f"All Crazyflies are fully connected! It took {self.time_all_crazyflie_connected - self.time_open_link} seconds")
-            if self.swarm.query_all_values_on_connect:
-                self._init_parameters()
-                self.add_on_set_parameters_callback(self._parameters_callback)
+        with self._connect_lock:
+            self.swarm.fully_connected_crazyflie_cnt += 1
+            all_connected = self.swarm.fully_connected_crazyflie_cnt == len(self.cf_dict) - 1
 
-        else:
-            return
+        if all_connected:
+            self.startup_time["fully_connected"] = time.time()
+            self.get_logger().info(f"All Crazyflies are fully connected! It took {self.startup_time['fully_connected'] - self.startup_time['open_links']:.2f} seconds")
 
     def _disconnected(self, link_uri):
         self.get_logger().info(f"[{self.cf_dict[link_uri]}] is disconnected!")
+        self.link_connected[self.uri_index[link_uri]] = False
 
     def _connection_failed(self, link_uri, msg):
         self.get_logger().info(f"[{self.cf_dict[link_uri]}] connection Failed")
         self.swarm.close_links()
 
-    def _init_logging(self):
+    def _init_logging(self, link_uri):
         """
         Sets up all the log blocks for the crazyflie and
            all the ROS 2 publisher and parameters for logging
            at startup
         """
-        for link_uri in self.uris:
-            cf_handle = self.swarm._cfs[link_uri]
-            cf = cf_handle.cf
+        cf_handle = self.swarm._cfs[link_uri]
+        cf = cf_handle.cf
 
-            # Start logging for predefined logging
-            for default_log_name in self.default_log_type:
-                prefix = default_log_name
-                if cf_handle.logging[prefix + "_logging_enabled"] and cf_handle.logging["enabled"]:
-                    callback_fnc = self.default_log_fnc[prefix]
-                    self._init_default_logging(prefix, link_uri, callback_fnc)
+        # Log topics for predefined logging
+        for default_log_name in self.default_log_type:
+            prefix = default_log_name
+            if cf_handle.logging[prefix + "_logging_enabled"] and cf_handle.logging["enabled"]:
+                callback_fnc = self.default_log_fnc[prefix]
+                self._init_default_logging(prefix, link_uri, callback_fnc)
 
-            # Start logging for costum logging blocks
-            cf_handle.l_toc = cf.log.toc.toc
-            if len(cf_handle.logging["custom_log_groups"]) != 0 and cf_handle.logging["enabled"]:
+        # Log topics for costum logging blocks
+        cf_handle.l_toc = cf.log.toc.toc
+        if len(cf_handle.logging["custom_log_groups"]) != 0 and cf_handle.logging["enabled"]:
 
-                for log_group_name, log_group_dict in cf_handle.logging["custom_log_groups"].items():
+            for log_group_name, log_group_dict in cf_handle.logging["custom_log_groups"].items():
+                try:
+                    self._add_log_topic(
+                        link_uri, log_group_name, log_group_dict["frequency"],
+                        [(log_name, None) for log_name in log_group_dict["vars"]],
+                        partial(self._log_custom_data_callback, topic_name=log_group_name,
+                                log_names=tuple(log_group_dict["vars"])))
                     self.swarm._cfs[link_uri].logging["custom_log_publisher"][log_group_name] = self.create_publisher(
                         LogDataGeneric, self.cf_dict[link_uri] + "/" + log_group_name, 10)
-                    lg_custom = log_group_dict['log_config']
-                    try:
-                        cf.log.add_config(lg_custom)
-                        lg_custom.data_received_cb.add_callback(
-                            partial(self._log_custom_data_callback, uri=link_uri))
-                        lg_custom.error_cb.add_callback(
-                            self._log_error_callback)
-                        lg_custom.start()
-                    except KeyError as e:
-                        self.get_logger().info(f'[{self.cf_dict[link_uri]}] Could not start log configuration,'
-                                               '{} not found in TOC'.format(str(e)))
-                    except AttributeError:
-                        self.get_logger().info(
-                            f'[{self.cf_dict[link_uri]}] Could not add log config, bad configuration.')
+                except KeyError as e:
+                    self.get_logger().info(f'[{self.cf_dict[link_uri]}] Could not start log configuration,'
+                                           '{} not found in TOC'.format(str(e)))
+
+            self.get_logger().info(f"[{self.cf_dict[link_uri]}] setup custom logging")
 
-                self.get_logger().info(f"[{self.cf_dict[link_uri]}] setup custom logging")
+        # Log blocks for all topics together
+        self._plan_logging(link_uri)
 
-            self.create_service(
-                RemoveLogging, self.cf_dict[link_uri] + "/remove_logging", partial(self._remove_logging, uri=link_uri))
-            self.create_service(
-                AddLogging, self.cf_dict[link_uri] + "/add_logging", partial(self._add_logging, uri=link_uri))
+        self.create_service(
+            RemoveLogging, self.cf_dict[link_uri] + "/remove_logging", partial(self._remove_logging, uri=link_uri),
+            callback_group=cf_handle.callback_group_srv)
+        self.create_service(
+            AddLogging, self.cf_dict[link_uri] + "/add_logging", partial(self._add_logging, uri=link_uri),
+            callback_group=cf_handle.callback_group_srv)
 
-        self.get_logger().info("All Crazyflies logging are initialized.")
+        self.get_logger().info(f"[{self.cf_dict[link_uri]}] logging is initialized.")
 
     def _init_default_logging(self, prefix, link_uri, callback_fnc):
         """
-        Sets up all the default log blocks and ROS 2 publishers for the crazyflie
+        Sets up the log topic and ROS 2 parameters of a default log block for the crazyflie
         """
         cf_handle = self.swarm._cfs[link_uri]
-        cf = cf_handle.cf
-        lg = cf_handle.logging[prefix + "_log_config"]
+        frequency = cf_handle.logging[prefix + "_logging_freq"]
         try:
-            cf.log.add_config(lg)
-            lg.data_received_cb.add_callback(
-                partial(callback_fnc, uri=link_uri))
-            lg.error_cb.add_callback(self._log_error_callback)
-            lg.start()
-            frequency = cf_handle.logging[prefix + "_logging_freq"]
+            self._add_log_topic(
+                link_uri, prefix, frequency, cf_handle.logging[prefix + "_log_vars"], callback_fnc)
             self.declare_parameter(
                 self.cf_dict[link_uri] + ".logs." + prefix + ".frequency.", frequency)
             self.get_logger().info(
@@ -550,9 +1163,137 @@ class CrazyflieServer(Node):
         except KeyError as e:
             self.get_logger().error(f'[{self.cf_dict[link_uri]}] Could not start log configuration,'
                                    '{} not found in TOC'.format(str(e)))
-        except AttributeError:
-            self.get_logger().error(
-                f'[{self.cf_dict[link_uri]}] Could not add log config, bad configuration.')
+
+    def _add_log_topic(self, link_uri, topic_name, frequency, log_vars, callback_fnc):
+        """
+        Add a log topic with variables [(name, type or None)] to the log plan of
+            the crazyflie, raises KeyError if a variable is not in the TOC.
+            The log blocks are updated by _plan_logging
+        """
+        cf_handle = self.swarm._cfs[link_uri]
+        toc = cf_handle.cf.log.toc
+        for log_name, _ in log_vars:
+            if toc.get_element_by_complete_name(log_name) is None:
+                raise KeyError(log_name)
+        rate = 1000 / (LOG_PERIOD_UNIT * log_period(frequency))
+        if abs(rate - frequency) > 1e-6:
+            self.get_logger().warn(
+                f"[{self.cf_dict[link_uri]}] {topic_name} is logged at {rate:.2f} Hz instead of {frequency} Hz, "
+                f"the firmware only supports periods of multiples of {LOG_PERIOD_UNIT} ms")
+        with cf_handle.log_plan_lock:
+            cf_handle.logging["topics"][topic_name] = {
+                "frequency": frequency,
+                "vars": list(log_vars),
+                "callback": callback_fnc,
+            }
+
+    def _remove_log_topic(self, link_uri, topic_name):
+        """
+        Remove a log topic from the log plan of the crazyflie and update its log blocks
+        """
+        cf_handle = self.swarm._cfs[link_uri]
+        with cf_handle.log_plan_lock:
+            if cf_handle.logging["topics"].pop(topic_name, None) is None:
+                return False
+            self._plan_logging(link_uri)
+        return True
+
+    def _plan_logging(self, link_uri):
+        """
+        Replace the log blocks of the crazyflie by the packing of plan_log_blocks
+            for all of its log topics. The values of each block are fanned out to
+            the callbacks of the topics by _log_block_callback. Each plan has its own
+            values, so that packets of the old blocks still in flight are ignored
+        """
+        cf_handle = self.swarm._cfs[link_uri]
+        cf = cf_handle.cf
+        with cf_handle.log_plan_lock:
+            for lg, callback in cf_handle.logging["log_blocks"]:
+                lg.data_received_cb.remove_callback(callback)
+                lg.delete()
+            cf_handle.logging["log_blocks"] = []
+            values = {}
+            cf_handle.logging["values"] = values
+
+            topics = cf_handle.logging["topics"]
+            toc_types = {}
+            for topic in topics.values():
+                for log_name, _ in topic["vars"]:
+                    toc_types[log_name] = cf.log.toc.get_element_by_complete_name(log_name).ctype
+            blocks, triggers = plan_log_blocks(
+                {name: (topic["frequency"], topic["vars"]) for name, topic in topics.items()},
+                toc_types)
+
+            # topics triggered by each block, with their decimation counters
+            block_topics = [[] for _ in blocks]
+            for topic_name, (index, decimation) in triggers.items():
+                block_topics[index].append({
+                    "callback": topics[topic_name]["callback"],
+                    "decimation": decimation,
+                    "count": 0,
+                    "log_names": tuple(log_name for log_name, _ in topics[topic_name]["vars"]),
+                    "ready": False,
+                })
+
+            for (frequency, block_vars), fanout in zip(blocks, block_topics):
+                block_var_names = {log_name for log_name, _ in block_vars}
+                block_names = [name for name, topic in topics.items()
+                               if any(log_name in block_var_names for log_name, _ in topic["vars"])]
+                lg = LogConfig(name="+".join(block_names),
+                               period_in_ms=LOG_PERIOD_UNIT * log_period(frequency))
+                for log_name, log_type in block_vars:
+                    lg.add_variable(log_name, log_type)
+                callback = partial(self._log_block_callback, uri=link_uri, topics=fanout, values=values)
+                try:
+                    cf.log.add_config(lg)
+                    lg.data_received_cb.add_callback(callback)
+                    lg.error_cb.add_callback(self._log_error_callback)
+                    lg.start()
+                    cf_handle.logging["log_blocks"].append((lg, callback))
+                except KeyError as e:
+                    self.get_logger().error(f'[{self.cf_dict[link_uri]}] Could not start log configuration,'
+                                           '{} not found in TOC'.format(str(e)))
+                except AttributeError:
+                    self.get_logger().error(
+                        f'[{self.cf_dict[link_uri]}] Could not add log config, bad configuration.')
+
+        self._update_log_transforms_timer()
+        if not topics:
+            return
+
+        # packets per second compared to one block per topic
+        num_vars = sum(len(block_vars) for _, block_vars in blocks)
+        num_requested = sum(len(topic["vars"]) for topic in topics.values())
+        separate_rate = log_packet_rate(
+            block for topic in topics.values()
+            for block in plan_log_blocks({"": (topic["frequency"], topic["vars"])}, toc_types)[0])
+        cf_handle.logging["packet_rate"] = log_packet_rate(blocks)
+        self.get_logger().info(
+            f"[{self.cf_dict[link_uri]}] logging {num_vars} variables "
+            f"({num_requested - num_vars} duplicates removed) of {len(topics)} topics "
+            f"in {len(blocks)} log blocks: {cf_handle.logging['packet_rate']:.1f} packets/s "
+            f"(one block per topic: {separate_rate:.1f} packets/s)")
+
+    def _log_block_callback(self, timestamp, data, logconf, uri, topics, values):
+        """
+        Once a planned log block is retrieved from the Crazyflie, update the
+            latest values of its plan and call the callbacks of the topics it
+            triggers. A topic is only called once all of its blocks have been
+            received, and not at all once the blocks have been replanned
+        """
+        if values is not self.swarm._cfs[uri].logging["values"]:
+            return
+        values.update(data)
+        for topic in topics:
+            topic["count"] += 1
+            if topic["count"] < topic["decimation"]:
+                continue
+            topic["count"] = 0
+            if not topic["ready"]:
+                if not all(log_name in values for log_name in topic["log_names"]):
+                    continue
+                topic["ready"] = True
+            topic["callback"](timestamp, values, logconf, uri=uri)
 
     def _log_scan_data_callback(self, timestamp, data, logconf, uri):
         """
@@ -588,15 +1329,14 @@ class CrazyflieServer(Node):
             self.swarm._cfs[uri].logging["scan_publisher"].publish(msg)
         except:
             self.get_logger().info("Could not publish scan message, stopping scan log")
-            self.swarm._cfs[uri].logging["scan_log_config"].stop()
+            self._remove_log_topic(uri, "scan")
 
     def _log_pose_data_callback(self, timestamp, data, logconf, uri):
         """
         Once pose data is retrieved from the Crazyflie,
             send out the ROS 2 topic for Pose
         """
-
-        cf_name = self.cf_dict[uri]
+        cf_handle = self.swarm._cfs[uri]
 
         x = data.get('stateEstimate.x')
         y = data.get('stateEstimate.y')
@@ -604,46 +1344,29 @@ class CrazyflieServer(Node):
         roll = radians(data.get('stabilizer.roll'))
         pitch = radians(-1.0 * data.get('stabilizer.pitch'))
         yaw = radians(data.get('stabilizer.yaw'))
-        q = tf_transformations.quaternion_from_euler(roll, pitch, yaw)
-
-        msg = PoseStamped()
-        msg.header.stamp = self.get_clock().now().to_msg()
-        msg.header.frame_id = self.swarm._cfs[uri].reference_frame
-        msg.pose.position.x = x
-        msg.pose.position.y = y
-        msg.pose.position.z = z
-        msg.pose.orientation.x = q[0]
-        msg.pose.orientation.y = q[1]
-        msg.pose.orientation.z = q[2]
-        msg.pose.orientation.w = q[3]
+        q = quaternion_from_euler(roll, pitch, yaw)
+        stamp = self.get_clock().now().nanoseconds
+
+        msg = cf_handle.pose_msg
+        msg.header.stamp.sec, msg.header.stamp.nanosec = divmod(stamp, 10**9)
+        position = msg.pose.position
+        position.x, position.y, position.z = x, y, z
+        orientation = msg.pose.orientation
+        orientation.x, orientation.y, orientation.z, orientation.w = q
         try:
-            self.swarm._cfs[uri].logging["pose_publisher"].publish(msg)
+            cf_handle.logging["pose_publisher"].publish(msg)
         except:
             self.get_logger().info("Could not publish pose message, stopping pose log")
-            self.swarm._cfs[uri].logging["pose_log_config"].stop()
-
-        t_base = TransformStamped()
-        t_base.header.stamp = self.get_clock().now().to_msg()
-        t_base.header.frame_id = self.swarm._cfs[uri].reference_frame
-        t_base.child_frame_id = cf_name
-        t_base.transform.translation.x = x
-        t_base.transform.translation.y = y
-        t_base.transform.translation.z = z
-        t_base.transform.rotation.x = q[0]
-        t_base.transform.rotation.y = q[1]
-        t_base.transform.rotation.z = q[2]
-        t_base.transform.rotation.w = q[3]
-        try:
-            self.tfbr.sendTransform(t_base)
-        except:
-            self.get_logger().info("Could not publish pose tf")
+            self._remove_log_topic(uri, "pose")
+
+        self._update_log_state(uri, stamp, x, y, z, q)
 
     def _log_odom_data_callback(self, timestamp, data, logconf, uri):
         """
         Once pose and velocity data is retrieved from the Crazyflie,
             send out the ROS 2 topic for Odometry in 2D (no z-axis)
         """
-        cf_name = self.cf_dict[uri]
+        cf_handle = self.swarm._cfs[uri]
 
         x = data.get('stateEstimate.x')
         y = data.get('stateEstimate.y')
@@ -658,47 +1381,27 @@ class CrazyflieServer(Node):
         rollrate = data.get('gyro.x')
         pitchrate = data.get('gyro.y')
 
-        q = tf_transformations.quaternion_from_euler(roll, pitch, yaw)
-        msg = Odometry()
-        msg.child_frame_id = cf_name
-        msg.header.stamp = self.get_clock().now().to_msg()
-        msg.header.frame_id = self.swarm._cfs[uri].reference_frame
-        msg.pose.pose.position.x = x
-        msg.pose.pose.position.y = y
-        msg.pose.pose.position.z = z
-        msg.pose.pose.orientation.x = q[0]
-        msg.pose.pose.orientation.y = q[1]
-        msg.pose.pose.orientation.z = q[2]
-        msg.pose.pose.orientation.w = q[3]
-        msg.twist.twist.linear.x = vx
-        msg.twist.twist.linear.y = vy
-        msg.twist.twist.linear.z = vz
-        msg.twist.twist.angular.z = yawrate
-        msg.twist.twist.angular.y = pitchrate
-        msg.twist.twist.angular.x = rollrate
+        q = quaternion_from_euler(roll, pitch, yaw)
+        stamp = self.get_clock().now().nanoseconds
+
+        msg = cf_handle.odom_msg
+        msg.header.stamp.sec, msg.header.stamp.nanosec = divmod(stamp, 10**9)
+        position = msg.pose.pose.position
+        position.x, position.y, position.z = x, y, z
+        orientation = msg.pose.pose.orientation
+        orientation.x, orientation.y, orientation.z, orientation.w = q
+        linear = msg.twist.twist.linear
+        linear.x, linear.y, linear.z = vx, vy, vz
+        angular = msg.twist.twist.angular
+        angular.x, angular.y, angular.z = rollrate, pitchrate, yawrate
 
         try:
-            self.swarm._cfs[uri].logging["odom_publisher"].publish(msg)
+            cf_handle.logging["odom_publisher"].publish(msg)
         except:
             self.get_logger().info("Could not publish odom message, stopping odom log")
-            self.swarm._cfs[uri].logging["odom_log_config"].stop()
-
-        t_base = TransformStamped()
-        t_base.header.stamp = self.get_clock().now().to_msg()
-        t_base.header.frame_id = self.swarm._cfs[uri].reference_frame
-        t_base.child_frame_id = cf_name
-        t_base.transform.translation.x = x
-        t_base.transform.translation.y = y
-        t_base.transform.translation.z = z
-        t_base.transform.rotation.x = q[0]
-        t_base.transform.rotation.y = q[1]
-        t_base.transform.rotation.z = q[2]
-        t_base.transform.rotation.w = q[3]
+            self._remove_log_topic(uri, "odom")
 
-        try:
-            self.tfbr.sendTransform(t_base)
-        except:
-            self.get_logger().info("Could not publish odom tf")
+        self._update_log_state(uri, stamp, x, y, z, q, (vx, vy, vz))
 
     def _log_status_data_callback(self, timestamp, data, logconf, uri):
         """
@@ -711,6 +1414,7 @@ class CrazyflieServer(Node):
 
         # From logging statistics
         msg.supervisor_info = data.get('supervisor.info')
+        self.log_supervisor_info[self.uri_index[uri]] = msg.supervisor_info
         msg.battery_voltage = data.get('pm.vbatMV') / 1000.0
         msg.pm_state = data.get('pm.state')
         msg.rssi = data.get('radio.rssi')
@@ -724,36 +1428,37 @@ class CrazyflieServer(Node):
             self.swarm._cfs[uri].logging["status_publisher"].publish(msg)
         except:
             self.get_logger().info("Could not publish status message, stopping status log")
-            self.swarm._cfs[uri].logging["status_log_config"].stop()
+            self._remove_log_topic(uri, "status")
 
-    def _log_custom_data_callback(self, timestamp, data, logconf, uri):
+    def _log_custom_data_callback(self, timestamp, data, logconf, uri, topic_name="", log_names=()):
         """
-        Once custom log block is retrieved from the Crazyflie,
+        Once the values of a custom log topic are retrieved from the Crazyflie,
             send out the ROS 2 topic for that same type of log
         """
-        msg = LogDataGeneric()
-        msg.header.stamp = self.get_clock().now().to_msg()
+        cf_handle = self.swarm._cfs[uri]
+        msg = cf_handle.custom_log_msg
+        msg.header.stamp.sec, msg.header.stamp.nanosec = divmod(self.get_clock().now().nanoseconds, 10**9)
         msg.timestamp = timestamp
-        for log_name in data:
-            msg.values.append(data.get(log_name))
+        msg.values = array.array('f', [data[log_name] for log_name in log_names])
 
         try:
-            self.swarm._cfs[uri].logging["custom_log_publisher"][logconf.name].publish(
+            cf_handle.logging["custom_log_publisher"][topic_name].publish(
             msg)
         except:
-            self.get_logger().info("Could not publish custom {logconf.name} message, stopping custom log")
-            self.swarm._cfs[uri].logging["custom_log_groups"][logconf.name]["log_config"].stop()
+            self.get_logger().info(f"Could not publish custom {topic_name} message, stopping custom log")
+            self._remove_log_topic(uri, topic_name)
 
     def _log_error_callback(self, logconf, msg):
         print('Error when logging %s: %s' % (logconf.name, msg))
 
-    def _init_parameters(self):
+    def _init_parameters(self, link_uri):
         """
         Once custom log block is retrieved from the Crazyflie,
             send out the ROS 2 topic for that same type of log
         """
         set_param_to_ROS = self.swarm.query_all_values_on_connect
-        for link_uri in self.uris:
+        self._param_declaration.active = True
+        try:
             cf = self.swarm._cfs[link_uri].cf
 
             p_toc = cf.param.toc.toc
@@ -832,15 +1537,20 @@ class CrazyflieServer(Node):
                                     )
                             except Exception as e:
                                 continue
+        finally:
+            self._param_declaration.active = False
 
-
-        self.get_logger().info("All Crazyflies parameters are initialized.")
+        self.get_logger().info(f"[{self.cf_dict[link_uri]}] parameters are initialized.")
 
     def _parameters_callback(self, params):
         """
         Sets up all the parameters for the crazyflie and
            translates it to ROS 2 paraemeters at startup
         """
+        if getattr(self._param_declaration, "active", False):
+            # declared while connecting, the value is already set on the Crazyflie
+            return SetParametersResult(successful=True)
+
         for param in params:
             param_split = param.name.split(".")
 
@@ -1042,36 +1752,71 @@ class CrazyflieServer(Node):
             trajectory.append(Poly4D(duration, px, py, pz, pyaw))
             total_duration = total_duration + duration
 
-        if uri == "all":
-            upload_success_all = True
-            for link_uri in self.uris:
-                trajectory_mem = self.swarm._cfs[link_uri].cf.mem.get_mems(
-                    MemoryElement.TYPE_TRAJ)[0]
-                trajectory_mem.trajectory = trajectory
-                upload_result = trajectory_mem.write_data_sync()
-                if not upload_result:
-                    self.get_logger().info(f"[{self.cf_dict[uri]}] Upload failed")
-                    upload_success_all = False
-                else:
-                    self.swarm._cfs[link_uri].cf.high_level_commander.define_trajectory(
-                        id, offset, len(trajectory))
-            if upload_success_all is False:
-                response.success = False
-                return response
-        else:
-            trajectory_mem = self.swarm._cfs[uri].cf.mem.get_mems(
-                MemoryElement.TYPE_TRAJ)[0]
-            trajectory_mem.trajectory = trajectory
-            upload_result = trajectory_mem.write_data_sync()
-            if not upload_result:
-                self.get_logger().info(f"[{self.cf_dict[uri]}] Upload failed")
-                response.success = False
-                return response
-            self.swarm._cfs[uri].cf.high_level_commander.define_trajectory(
-                id, offset, len(trajectory))
+        hashes = [hashlib.sha1(struct.pack(
+            "<8f8f8f8ff", *piece.poly_x, *piece.poly_y, *piece.poly_z, *piece.poly_yaw,
+            trajectory_piece.duration)).digest()
+            for piece, trajectory_piece in zip(request.pieces, trajectory)]
+
+        # The uploads run asynchronously, i.e., concurrently for all crazyflies.
+        #   start_trajectory waits until they are finished.
+        link_uris = self.uris if uri == "all" else [uri]
+        for link_uri in link_uris:
+            self._upload_trajectory(link_uri, id, offset, trajectory, hashes)
 
         return response
 
+    def _upload_trajectory(self, link_uri, id, offset, trajectory, hashes):
+        """
+        Start the upload of a trajectory to the crazyflie. Pieces that are
+            already in the trajectory memory (same content hash) are skipped
+        """
+        cf_handle = self.swarm._cfs[link_uri]
+        name = self.cf_dict[link_uri]
+
+        # only one upload per crazyflie at a time (the crazyflie and the swarm
+        #   services can be called concurrently)
+        with cf_handle.trajectory_upload_lock:
+            if not cf_handle.trajectory_upload_done.wait(timeout=TRAJECTORY_UPLOAD_TIMEOUT):
+                # the memory content is unknown, so do not skip pieces of later uploads
+                cf_handle.trajectory_hashes = []
+                cf_handle.trajectory_upload_ok = False
+                self.get_logger().error(
+                    f"[{name}] Previous trajectory upload did not finish, upload failed")
+                return
+
+            old_hashes = cf_handle.trajectory_hashes
+            first = 0
+            while first < min(len(old_hashes), len(hashes)) and old_hashes[first] == hashes[first]:
+                first += 1
+            if first == len(hashes):
+                self.get_logger().info(f"[{name}] Trajectory already uploaded, skipping upload")
+                cf_handle.cf.high_level_commander.define_trajectory(id, offset, len(trajectory))
+                cf_handle.trajectory_upload_ok = True
+                return
+
+            start_time = time.time()
+            cf_handle.trajectory_upload_done.clear()
+
+        def finished(mem, addr):
+            cf_handle.trajectory_hashes = hashes + old_hashes[len(hashes):]
+            cf_handle.cf.high_level_commander.define_trajectory(id, offset, len(trajectory))
+            self.get_logger().info(
+                f"[{name}] Uploaded {len(hashes) - first} of {len(hashes)} pieces "
+                f"in {time.time() - start_time:.2f} s")
+            cf_handle.trajectory_upload_ok = True
+            cf_handle.trajectory_upload_done.set()
+
+        def failed(mem, addr):
+            cf_handle.trajectory_hashes = []
+            cf_handle.trajectory_upload_ok = False
+            self.get_logger().error(f"[{name}] Upload failed")
+            cf_handle.trajectory_upload_done.set()
+
+        trajectory_mem = cf_handle.cf.mem.get_mems(
+            MemoryElement.TYPE_TRAJ)[0]
+        trajectory_mem.trajectory = trajectory[first:]
+        trajectory_mem.write_data(finished, failed, start_addr=first * TRAJECTORY_PIECE_SIZE)
+
     def _start_trajectory_callback(self, request, response, uri="all"):
 
         id = request.trajectory_id
@@ -1088,6 +1833,22 @@ class CrazyflieServer(Node):
             rev,
             gm
         ))
+        # wait for trajectory uploads that are still in progress, and do not start
+        #   a stale or partially written trajectory (on any crazyflie for "all")
+        failed = False
+        deadline = time.monotonic() + TRAJECTORY_UPLOAD_TIMEOUT
+        for link_uri in (self.uris if uri == "all" else [uri]):
+            cf_handle = self.swarm._cfs[link_uri]
+            if not cf_handle.trajectory_upload_done.wait(timeout=max(0.0, deadline - time.monotonic())):
+                self.get_logger().error(f"[{self.cf_dict[link_uri]}] Trajectory upload did not finish")
+                failed = True
+            elif not cf_handle.trajectory_upload_ok:
+                self.get_logger().error(f"[{self.cf_dict[link_uri]}] Trajectory upload failed")
+                failed = True
+        if failed:
+            self.get_logger().error(f"[{self.cf_dict[uri]}] Trajectory not started")
+            return response
+
         if uri == "all":
             for link_uri in self.uris:
                 self.swarm._cfs[link_uri].cf.high_level_commander.start_trajectory(
@@ -1104,24 +1865,86 @@ class CrazyflieServer(Node):
            poses topic to send through the external position
            to the crazyflie
         """
-
-        poses = msg.poses
-        for pose in poses:
-            name = pose.name
-            x = pose.pose.position.x
-            y = pose.pose.position.y
-            z = pose.pose.position.z
+        t_start = time.perf_counter()
+
+        positions = {}
+        poses = {}
+        stats = self.mocap_stats
+        if self.mocap_last_frame is not None:
+            interval = t_start - self.mocap_last_frame
+            rate = 1.0 / interval if interval > 0 else float("inf")
+            stats["rate_count"] += 1
+            stats["rate_sum"] += rate
+            stats["rate_min"] = min(stats["rate_min"], rate)
+            stats["rate_max"] = max(stats["rate_max"], rate)
+            if rate <= self.mocap_rate_limits[0] or rate >= self.mocap_rate_limits[1]:
+                stats["rates_wrong"] += 1
+        self.mocap_last_frame = t_start
+        received = stats["poses"]
+
+        for pose in msg.poses:
+            link = self.mocap_links.get(pose.name)
+            if link is None:
+                continue
+            received[pose.name] = received.get(pose.name, 0) + 1
+            uri, cf_id = link
+            p = pose.pose.position
             quat = pose.pose.orientation
 
-            if name in self.uri_dict.keys():
-                uri = self.uri_dict[name]
+            if pose.name in self.mocap_unicast:
                 # self.get_logger().info(f"{uri}: send extpos {x}, {y}, {z} to {name}")
                 if isnan(quat.x):
                     self.swarm._cfs[uri].cf.extpos.send_extpos(
-                        x, y, z)
+                        p.x, p.y, p.z)
                 else:
                     self.swarm._cfs[uri].cf.extpos.send_extpose(
-                        x, y, z, quat.x, quat.y, quat.z, quat.w)
+                        p.x, p.y, p.z, quat.x, quat.y, quat.z, quat.w)
+                continue
+
+            # packed items are int16 [mm], so skip this robot if its pose does not fit
+            x, y, z = p.x * 1000, p.y * 1000, p.z * 1000
+            if not all(isfinite(v) and -32768 < v < 32768 for v in (x, y, z)):
+                self.get_logger().warn(
+                    f"[{self.cf_dict[uri]}] Invalid motion capture position ({p.x}, {p.y}, {p.z}), not sent",
+                    throttle_duration_sec=1.0)
+                continue
+            x, y, z = int(x), int(y), int(z)
+            broadcast_uri = broadcast_uri_from_unicast_uri(uri)
+            if isnan(quat.x) or not all(isfinite(v) for v in (quat.x, quat.y, quat.z, quat.w)):
+                positions.setdefault(broadcast_uri, []).append(
+                    EXT_POSITION_PACKED_ITEM.pack(cf_id, x, y, z))
+            else:
+                poses.setdefault(broadcast_uri, []).append(
+                    EXT_POSE_PACKED_ITEM.pack(cf_id, x, y, z,
+                                              quatcompress(quat.x, quat.y, quat.z, quat.w)))
+
+        # send the packed items of all robots on the same channel in as few packets as possible
+        for broadcast_uri, items in positions.items():
+            self._send_packed(broadcast_uri, EXT_POSITION_PACKED_CHANNEL, b"",
+                              items, EXT_POSITION_PACKED_MAX_ITEMS)
+        for broadcast_uri, items in poses.items():
+            self._send_packed(broadcast_uri, GENERIC_CHANNEL, bytes([EXT_POSE_PACKED_TYPE]),
+                              items, EXT_POSE_PACKED_MAX_ITEMS)
+
+        stamp = msg.header.stamp
+        dispatch = time.perf_counter() - t_start
+        stats["frames"] += 1
+        stats["dispatch_sum"] += dispatch
+        stats["dispatch_max"] = max(stats["dispatch_max"], dispatch)
+        if stamp.sec != 0 or stamp.nanosec != 0:
+            now = self.get_clock().now().nanoseconds
+            latency = (now - (stamp.sec * 10**9 + stamp.nanosec)) * 1e-9
+            stats["latency_count"] += 1
+            stats["latency_sum"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+
+    def _send_packed(self, broadcast_uri, channel, header, items, max_items):
+        link = self.broadcast_links[broadcast_uri]
+        for i in range(0, len(items), max_items):
+            pk = CRTPPacket()
+            pk.set_header(CRTPPort.LOCALIZATION, channel)
+            pk.data = header + b"".join(items[i:i + max_items])
+            link.send_packet(pk)
 
     def _cmd_vel_legacy_changed(self, msg, uri=""):
         """
@@ -1160,6 +1983,51 @@ class CrazyflieServer(Node):
         yaw_rate = msg.twist.angular.z
         self.swarm._cfs[uri].cf.commander.send_full_state_setpoint(pos, vel, acc, q, roll_rate, pitch_rate, yaw_rate)
 
+    def _cmd_full_state_array_changed(self, msg):
+        """
+        Topic update callback to the full state cmd topic of the swarm
+            The packets of all robots are built at once and sent
+            back to back on the links of the crazyflies
+        """
+        states = np.frombuffer(msg.states, dtype=np.float64)
+        if len(states) != len(msg.names) * FullStateArray.NUM_COLUMNS:
+            self.get_logger().warn(
+                f"Ignoring cmd_full_state_array with {len(msg.names)} names and {len(states)} values")
+            return
+        states = states.reshape(-1, FullStateArray.NUM_COLUMNS)
+        # robots with non-finite setpoints are skipped (their rows are zeroed for packing)
+        finite = np.isfinite(states).all(axis=1)
+        if not finite.all():
+            self.get_logger().warn(
+                "Ignoring non-finite cmd_full_state_array setpoints of "
+                f"{[msg.names[i] for i in np.flatnonzero(~finite)]}",
+                throttle_duration_sec=1.0)
+            states = np.where(finite[:, np.newaxis], states, 0.0)
+
+        packets = np.zeros(len(states), dtype=FULL_STATE_SETPOINT_DTYPE)
+        packets["type"] = FULL_STATE_SETPOINT_TYPE
+        # same truncation as int() in cflib, but saturated instead of failing
+        mm = np.clip(states * 1000, -32768, 32767).astype(np.int16)
+        packets["pos"] = mm[:, 0:3]
+        packets["vel"] = mm[:, 3:6]
+        packets["acc"] = mm[:, 6:9]
+        packets["rates"] = mm[:, 10:13]
+        q = np.zeros((len(states), 4))
+        q[:, 2] = np.sin(states[:, 9] / 2)
+        q[:, 3] = np.cos(states[:, 9] / 2)
+        packets["quat"] = quatcompress_array(q)
+
+        data = packets.tobytes()
+        size = FULL_STATE_SETPOINT_DTYPE.itemsize
+        for i, name in enumerate(msg.names):
+            uri = self.uri_dict.get(name)
+            if uri is None or not finite[i]:
+                continue
+            pk = CRTPPacket()
+            pk.port = CRTPPort.COMMANDER_GENERIC
+            pk.data = data[i * size:(i + 1) * size]
+            self.swarm._cfs[uri].cf.send_packet(pk)
+
     def _remove_logging(self, request, response, uri="all"):
         """
         Service callback to remove logging blocks of the crazyflie
@@ -1169,7 +2037,7 @@ class CrazyflieServer(Node):
             try:
                 self.undeclare_parameter(
                     self.cf_dict[uri] + ".logs." + topic_name + ".frequency.")
-                self.swarm._cfs[uri].logging[topic_name + "_log_config"].stop()
+                self._remove_log_topic(uri, topic_name)
                 self.destroy_publisher(
                     self.swarm._cfs[uri].logging[topic_name + "_publisher"])
                 self.get_logger().info(f"[{self.cf_dict[uri]}] Remove {topic_name} logging")
@@ -1179,18 +2047,14 @@ class CrazyflieServer(Node):
                 response.success = False
                 return response
         else:
-            try:
-                self.swarm._cfs[uri].logging["custom_log_groups"][topic_name]["log_config"].stop(
-                )
-                for log_name in self.swarm._cfs[uri].logging["custom_log_groups"][topic_name]["vars"]:
-                    self.destroy_publisher(
-                        self.swarm._cfs[uri].logging["custom_log_publisher"][topic_name])
-                self.get_logger().info(f"[{self.cf_dict[uri]}] Remove {topic_name} logging")
-            except rclpy.exceptions.ParameterNotDeclaredException:
+            if not self._remove_log_topic(uri, topic_name):
                 self.get_logger().info(
                     f"[{self.cf_dict[uri]}] No logblock of {topic_name} has been found ")
                 response.success = False
                 return response
+            self.destroy_publisher(
+                self.swarm._cfs[uri].logging["custom_log_publisher"][topic_name])
+            self.get_logger().info(f"[{self.cf_dict[uri]}] Remove {topic_name} logging")
 
         response.success = True
         return response
@@ -1208,11 +2072,21 @@ class CrazyflieServer(Node):
                     self.cf_dict[uri] + ".logs." + topic_name + ".frequency.", frequency)
                 self.swarm._cfs[uri].logging[topic_name + "_publisher"] = self.create_publisher(
                     self.default_log_type[topic_name], self.cf_dict[uri] + "/" + topic_name, 10)
-                self.swarm._cfs[uri].logging[topic_name +
-                                             "_log_config"].period_in_ms = 1000 / frequency
-                self.swarm._cfs[uri].logging[topic_name +
-                                             "_log_config"].start()
+                self._add_log_topic(
+                    uri, topic_name, frequency, self.swarm._cfs[uri].logging[topic_name + "_log_vars"],
+                    self.default_log_fnc[topic_name])
+                self._plan_logging(uri)
                 self.get_logger().info(f"[{self.cf_dict[uri]}] Add {topic_name} logging")
+            except KeyError as e:
+                self.get_logger().error(
+                    f"[{self.cf_dict[uri]}] Failed to add {topic_name} logging")
+                self.get_logger().error(str(e) + "is not in TOC")
+                self.undeclare_parameter(
+                    self.cf_dict[uri] + ".logs." + topic_name + ".frequency.")
+                self.destroy_publisher(
+                    self.swarm._cfs[uri].logging[topic_name + "_publisher"])
+                response.success = False
+                return response
             except rclpy.exceptions.ParameterAlreadyDeclaredException:
                 self.get_logger().info(
                     f"[{self.cf_dict[uri]}] The content the logging of {topic_name} has already started ")
@@ -1224,22 +2098,15 @@ class CrazyflieServer(Node):
                     self.cf_dict[uri] + ".logs." + topic_name + ".frequency.", frequency)
                 self.declare_parameter(
                     self.cf_dict[uri] + ".logs." + topic_name + ".vars.", variables)
-                lg_custom = LogConfig(
-                    name=topic_name, period_in_ms=1000 / frequency)
-                for log_name in variables:
-                    lg_custom.add_variable(log_name)
+                self._add_log_topic(
+                    uri, topic_name, frequency, [(log_name, None) for log_name in variables],
+                    partial(self._log_custom_data_callback, topic_name=topic_name,
+                            log_names=tuple(variables)))
                 self.swarm._cfs[uri].logging["custom_log_publisher"][topic_name] = self.create_publisher(
                     LogDataGeneric, self.cf_dict[uri] + "/" + topic_name, 10)
-
-                self.swarm._cfs[uri].cf.log.add_config(lg_custom)
-
-                lg_custom.data_received_cb.add_callback(
-                    partial(self._log_custom_data_callback, uri=uri))
-                lg_custom.error_cb.add_callback(self._log_error_callback)
-                lg_custom.start()
+                self._plan_logging(uri)
 
                 self.swarm._cfs[uri].logging["custom_log_groups"][topic_name] = {}
-                self.swarm._cfs[uri].logging["custom_log_groups"][topic_name]["log_config"] = lg_custom
                 self.swarm._cfs[uri].logging["custom_log_groups"][topic_name]["vars"] = variables
                 self.swarm._cfs[uri].logging["custom_log_groups"][topic_name]["frequency"] = frequency
 
@@ -1264,16 +2131,28 @@ class CrazyflieServer(Node):
         return response
 
 
+def create_executor(crazyflie_server):
+    """
+    Executor of the server (also used by setpoint_latency_benchmark.py):
+        callbacks of different callback groups run in parallel
+    """
+    executor = MultiThreadedExecutor()
+    executor.add_node(crazyflie_server)
+    return executor
+
+
 def main(args=None):
 
     cflib.crtp.init_drivers()
     rclpy.init(args=args)
     crazyflie_server = CrazyflieServer()
 
-    rclpy.spin(crazyflie_server)
+    executor = create_executor(crazyflie_server)
+    executor.spin()
 
     crazyflie_server.destroy_node()
-    rclpy.shutdown()
+    # the context is already shut down if a Crazyflie could not be found
+    rclpy.try_shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""
+Regression benchmark for the executor model of crazyflie_server.py
+
+    Runs the CrazyflieServer node of crazyflie_server.py (with its callback
+    groups and the executor of its main()) against a stub of the cflib swarm,
+    in which the trajectory memory write and the parameter reads block like
+    the synchronous calls of cflib. A client streams cmd_full_state setpoints
+    and requests one upload_trajectory. The latency from publishing a setpoint
+    until the server hands it to the (stub) commander is reported while the
+    upload is pending and otherwise. A SingleThreadedExecutor is the baseline.
+
+    Usage: ros2 run crazyflie setpoint_latency_benchmark.py [upload duration in s] [number of crazyflies]
+"""
+
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from ament_index_python.packages import get_package_share_directory
+import cflib.crtp
+from cflib.crazyflie.toc import Toc
+from cflib.utils.callbacks import Caller
+import numpy as np
+import rclpy
+from rclpy.executors import SingleThreadedExecutor
+from rclpy.node import Node
+from rclpy.parameter import Parameter
+import yaml
+
+from crazyflie_interfaces.msg import FullState, TrajectoryPolynomialPiece
+from crazyflie_interfaces.srv import UploadTrajectory
+
+# installed next to this script
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import crazyflie_server  # noqa: E402
+
+
+SETPOINT_RATE = 100  # Hz
+PARAM_READ_TIME = 0.005  # s, blocking time of one param.get_value
+NUM_PIECES = 10
+
+
+class _Ignore:
+    """Accepts any method call (high-level commander, localization, platform)"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class StubCommander(_Ignore):
+    """Records when the server sends each full-state setpoint"""
+
+    def __init__(self, received):
+        self.received = received
+
+    def send_full_state_setpoint(self, pos, vel, acc, orientation, rollrate, pitchrate, yawrate):
+        # the client encodes the sequence number of the setpoint in x
+        self.received.append((int(pos[0]), time.monotonic()))
+
+
+class StubTrajectoryMemory:
+    """Trajectory memory whose write blocks for the duration of an upload"""
+
+    def __init__(self, upload_duration):
+        self.upload_duration = upload_duration
+        self.trajectory = []
+
+    def write_data(self, write_finished_cb, write_failed_cb=None, start_addr=0):
+        time.sleep(self.upload_duration)
+        write_finished_cb(self, start_addr)
+
+
+class StubParam:
+    """Parameters whose reads block like a round trip to the crazyflie"""
+
+    def __init__(self):
+        self.toc = Toc()
+        for group, name, ctype in [("commander", "enHighLevel", "uint8_t"),
+                                   ("stabilizer", "estimator", "uint8_t"),
+                                   ("stabilizer", "controller", "uint8_t"),
+                                   ("kalman", "pNAcc_xy", "float"),
+                                   ("kalman", "pNAcc_z", "float")]:
+            self.toc.add_element(SimpleNamespace(group=group, name=name, ctype=ctype))
+
+    def get_value(self, complete_name):
+        time.sleep(PARAM_READ_TIME)
+        return "0"
+
+    def set_value(self, complete_name, value):
+        pass
+
+    def set_value_raw(self, complete_name, type, value):
+        pass
+
+
+class StubCrazyflie:
+    def __init__(self, upload_duration, received):
+        self.connected = Caller()
+        self.fully_connected = Caller()
+        self.disconnected = Caller()
+        self.connection_failed = Caller()
+        self.link_statistics = SimpleNamespace(
+            latency_updated=Caller(), uplink_rate_updated=Caller(), downlink_rate_updated=Caller(),
+            link_quality_updated=Caller(), uplink_congestion_updated=Caller())
+        self.log = SimpleNamespace(toc=Toc(), add_config=lambda logconf: None)
+        self.param = StubParam()
+        trajectory_memory = StubTrajectoryMemory(upload_duration)
+        self.mem = SimpleNamespace(get_mems=lambda type: [trajectory_memory])
+        self.commander = StubCommander(received)
+        self.high_level_commander = _Ignore()
+        self.extpos = _Ignore()
+        self.loc = _Ignore()
+        self.platform = _Ignore()
+
+    def send_packet(self, pk):
+        pass
+
+
+class StubSyncCrazyflie:
+    def __init__(self, uri, upload_duration, received):
+        self.uri = uri
+        self.cf = StubCrazyflie(upload_duration, received)
+
+    def open_link(self):
+        # like cflib, the connection callbacks are called from the link thread
+        self.cf.connected.call(self.uri)
+        self.cf.fully_connected.call(self.uri)
+
+
+class StubSwarm:
+    """Stands in for cflib.crazyflie.swarm.Swarm"""
+    upload_duration = 0.0
+    received = []
+
+    def __init__(self, uris, factory=None):
+        self._cfs = {uri: StubSyncCrazyflie(uri, self.upload_duration, self.received) for uri in uris}
+
+    def close_links(self):
+        pass
+
+
+def _flatten(prefix, value, parameters):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(prefix + [str(key)], item, parameters)
+    elif isinstance(value, list):
+        if value:
+            if any(isinstance(item, float) for item in value):
+                value = [float(item) for item in value]
+            parameters.append(Parameter(".".join(prefix), value=value))
+    elif value is not None:
+        parameters.append(Parameter(".".join(prefix), value=value))
+
+
+def server_parameters(num_crazyflies):
+    """Parameters of the server like launch.py sets them, for stub crazyflies cf1, cf2, ..."""
+    share = get_package_share_directory("crazyflie")
+    with open(os.path.join(share, "config", "crazyflies.yaml")) as f:
+        crazyflies = yaml.safe_load(f)
+    with open(os.path.join(share, "config", "server.yaml")) as f:
+        server = yaml.safe_load(f)["/crazyflie_server"]["ros__parameters"]
+    with open(os.path.join(share, "urdf", "crazyflie_description.urdf")) as f:
+        server["robot_description"] = f.read()
+    server["firmware_params"]["query_all_values_on_connect"] = True
+
+    robot_type = next(iter(crazyflies["robot_types"]))
+    crazyflies["robots"] = {
+        f"cf{i + 1}": {"enabled": True, "uri": f"radio://0/80/2M/E7E7E7E7{i + 1:02X}",
+                       "initial_position": [0.0, 0.0, 0.0], "type": robot_type}
+        for i in range(num_crazyflies)}
+    crazyflies.setdefault("all", {}).setdefault("firmware_logging", {})["enabled"] = False
+
+    parameters = []
+    _flatten([], crazyflies, parameters)
+    _flatten([], server, parameters)
+    return parameters
+
+
+class _ParameterOverrides(Node):
+    """Passes the benchmark parameters to the Node constructor of CrazyflieServer"""
+    parameters = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, parameter_overrides=self.parameters, **kwargs)
+
+
+class BenchmarkServer(crazyflie_server.CrazyflieServer, _ParameterOverrides):
+    pass
+
+
+class Client(Node):
+    """Streams setpoints to cf1 and requests one upload"""
+
+    def __init__(self):
+        super().__init__("setpoint_latency_client")
+        self.pub = self.create_publisher(FullState, "cf1/cmd_full_state", 10)
+        self.upload = self.create_client(UploadTrajectory, "cf1/upload_trajectory")
+        self.sent = []  # time of each setpoint, index is the sequence number
+        self.timer = None
+
+    def start_streaming(self):
+        self.timer = self.create_timer(1.0 / SETPOINT_RATE, self._timer_callback)
+
+    def _timer_callback(self):
+        msg = FullState()
+        msg.header.stamp = self.get_clock().now().to_msg()
+        msg.pose.position.x = float(len(self.sent))
+        self.sent.append(time.monotonic())
+        self.pub.publish(msg)
+
+    def upload_request(self):
+        request = UploadTrajectory.Request()
+        request.trajectory_id = 1
+        for i in range(NUM_PIECES):
+            piece = TrajectoryPolynomialPiece()
+            piece.poly_x = [float(i)] + [0.0] * 7
+            piece.poly_y = [0.0] * 8
+            piece.poly_z = [0.0] * 8
+            piece.poly_yaw = [0.0] * 8
+            piece.duration.sec = 1
+            request.pieces.append(piece)
+        return request
+
+
+def run(multi_threaded):
+    StubSwarm.received = []
+    server = BenchmarkServer()
+    if multi_threaded:
+        executor = crazyflie_server.create_executor(server)
+    else:
+        executor = SingleThreadedExecutor()
+        executor.add_node(server)
+    client = Client()
+    client_executor = SingleThreadedExecutor()
+    client_executor.add_node(client)
+    threads = [threading.Thread(target=executor.spin, daemon=True),
+               threading.Thread(target=client_executor.spin, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    client.upload.wait_for_service()
+    client.start_streaming()
+    time.sleep(1.0)
+    upload_start = time.monotonic()
+    future = client.upload.call_async(client.upload_request())
+    while not future.done():
+        time.sleep(0.01)
+    upload_end = time.monotonic()
+    time.sleep(1.0)
+
+    executor.shutdown()
+    client_executor.shutdown()
+    server.destroy_node()
+    client.destroy_node()
+
+    # setpoints sent while the upload was pending, and all others
+    sent = np.array(client.sent)
+    seq, received = np.array(StubSwarm.received).reshape(-1, 2).T
+    seq = seq.astype(int)
+    stamps = sent[seq]
+    latency = received - stamps
+    during_upload = (stamps >= upload_start) & (stamps <= upload_end)
+    return {True: latency[during_upload], False: latency[~during_upload]}, len(sent) - len(seq)
+
+
+def main():
+    upload_duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    num_crazyflies = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    # no radio: stub crazyflies and broadcast links
+    crazyflie_server.Swarm = StubSwarm
+    crazyflie_server.CachedCfFactory = lambda rw_cache=None: None
+    cflib.crtp.get_link_driver = lambda uri: _Ignore()
+    StubSwarm.upload_duration = upload_duration
+    _ParameterOverrides.parameters = server_parameters(num_crazyflies)
+
+    rclpy.init()
+    for executor_name, multi_threaded in [("SingleThreadedExecutor", False), ("server executor", True)]:
+        latency, lost = run(multi_threaded)
+        for upload_pending in [False, True]:
+            values = 1000 * latency[upload_pending]
+            print("{}, {:>16}: {:4d} setpoints, latency p50 {:7.2f} ms, p99 {:7.2f} ms, max {:7.2f} ms".format(
+                executor_name, "upload pending" if upload_pending else "no upload", len(values),
+                np.percentile(values, 50) if len(values) else np.nan,
+                np.percentile(values, 99) if len(values) else np.nan,
+                np.max(values) if len(values) else np.nan))
+        print(f"{executor_name}, {lost} setpoints not received")
+    rclpy.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,7 @@
 #include "crazyflie_interfaces/srv/upload_trajectory.hpp"
 #include "motion_capture_tracking_interfaces/msg/named_pose_array.hpp"
 #include "crazyflie_interfaces/msg/full_state.hpp"
+#include "crazyflie_interfaces/msg/full_state_array.hpp"
 #include "crazyflie_interfaces/msg/position.hpp"
 #include "crazyflie_interfaces/msg/status.hpp"
 #include "crazyflie_interfaces/msg/log_data_generic.hpp"
@@ -40,6 +41,7 @@ using std_srvs::srv::Empty;
 
 using motion_capture_tracking_interfaces::msg::NamedPoseArray;
 using crazyflie_interfaces::msg::FullState;
+using crazyflie_interfaces::msg::FullStateArray;
 
 #ifdef ROS_DISTRO_HUMBLE
 inline auto get_service_qos() { return rmw_qos_profile_services_default; }
@@ -523,6 +525,18 @@ public:
     return cf_.address() & 0xFF;
   }
 
+  // state is one row of a FullStateArray message
+  void sendFullStateSetpoint(const double* state)
+  {
+    float yaw = state[9];
+    cf_.sendFullStateSetpoint(
+      state[0], state[1], state[2],
+      state[3], state[4], state[5],
+      state[6], state[7], state[8],
+      0, 0, sinf(yaw / 2), cosf(yaw / 2),
+      state[10], state[11], state[12]);
+  }
+
   const Crazyflie::ParamTocEntry* paramTocEntry(const std::string& group, const std::string& name)
   {
     return cf_.getParamTocEntry(group, name);
@@ -1147,6 +1161,7 @@ public:
 
     // topics for "all"
     subscription_cmd_full_state_ = this->create_subscription<crazyflie_interfaces::msg::FullState>("all/cmd_full_state", rclcpp::SystemDefaultsQoS(), std::bind(&CrazyflieServer::cmd_full_state_changed, this, _1), sub_opt_all_cmd);
+    subscription_cmd_full_state_array_ = this->create_subscription<FullStateArray>("all/cmd_full_state_array", rclcpp::SystemDefaultsQoS(), std::bind(&CrazyflieServer::cmd_full_state_array_changed, this, _1), sub_opt_all_cmd);
 
     // services for "all"
     service_start_trajectory_ = this->create_service<StartTrajectory>("all/start_trajectory", std::bind(&CrazyflieServer::start_trajectory, this, _1, _2), get_service_qos(), callback_group_all_srv_);
@@ -1309,6 +1324,23 @@ private:
 
   }
 
+  // Individual setpoints for many CFs in one message; each row is sent to its CF by unicast
+  void cmd_full_state_array_changed(const FullStateArray::SharedPtr msg)
+  {
+    const size_t num_columns = FullStateArray::NUM_COLUMNS;
+    if (msg->states.size() != msg->names.size() * num_columns) {
+      RCLCPP_WARN(logger_, "[all] Ignoring cmd_full_state_array with %zu names and %zu values", msg->names.size(), msg->states.size());
+      return;
+    }
+
+    for (size_t i = 0; i < msg->names.size(); ++i) {
+      const auto iter = crazyflies_.find(msg->names[i]);
+      if (iter != crazyflies_.end()) {
+        iter->second->sendFullStateSetpoint(&msg->states[i * num_columns]);
+      }
+    }
+  }
+
   void posesChanged(const NamedPoseArray::SharedPtr msg)
   {
     mocap_data_received_timepoints_.emplace_back(std::chrono::steady_clock::now());
@@ -1509,6 +1541,7 @@ private:
 
     // subscribers
     rclcpp::Subscription<crazyflie_interfaces::msg::FullState>::SharedPtr subscription_cmd_full_state_;
+    rclcpp::Subscription<FullStateArray>::SharedPtr subscription_cmd_full_state_array_;
     rclcpp::Subscription<NamedPoseArray>::SharedPtr sub_poses_;
 
     // services
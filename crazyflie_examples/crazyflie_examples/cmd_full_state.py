@@ -10,6 +10,7 @@ import numpy as np
 def executeTrajectory(timeHelper, cf, trajpath, rate=100, offset=np.zeros(3)):
     traj = Trajectory()
     traj.loadcsv(trajpath)
+    traj = traj.compile()
 
     start_time = timeHelper.time()
     while not timeHelper.isShutdown():
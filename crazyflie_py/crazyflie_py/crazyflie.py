@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
+import array
 from collections import defaultdict
+import math
+import threading
+import time
 
 # import sys
 # import rospy
@@ -14,7 +18,8 @@ from collections import defaultdict
 # from .visualizer import visNull
 
 
-from crazyflie_interfaces.msg import FullState, Position, Status, TrajectoryPolynomialPiece
+from crazyflie_interfaces.msg import FullState, FullStateArray, Position, Status, SwarmState
+from crazyflie_interfaces.msg import TrajectoryPolynomialPiece
 from crazyflie_interfaces.srv import Arm, GoTo, Land, \
     NotifySetpointsStop, StartTrajectory, Takeoff, UploadTrajectory
 from geometry_msgs.msg import Point
@@ -23,6 +28,9 @@ from rcl_interfaces.msg import Parameter, ParameterType, ParameterValue
 from rcl_interfaces.srv import DescribeParameters, GetParameters, ListParameters, SetParameters
 
 import rclpy
+from rclpy.clock import JumpThreshold
+from rclpy.duration import Duration
+from rclpy.executors import SingleThreadedExecutor
 import rclpy.node
 import rowan
 from std_srvs.srv import Empty
@@ -36,6 +44,76 @@ def arrayToGeometryPoint(a):
     return result
 
 
+def parameterValueToArray(value):
+    """Convert an integer or double array ParameterValue to a numpy array."""
+    if value.type == ParameterType.PARAMETER_INTEGER_ARRAY:
+        return np.array(value.integer_array_value)
+    elif value.type == ParameterType.PARAMETER_DOUBLE_ARRAY:
+        return np.array(value.double_array_value)
+    else:
+        assert False
+
+
+def waitForFuture(node, future):
+    """Wait until the future is done; only spin the node if no TimeHelper spins it."""
+    if getattr(node, 'backgroundExecutor', None) is None:
+        rclpy.spin_until_future_complete(node, future)
+    else:
+        done = threading.Event()
+        future.add_done_callback(lambda _: done.set())
+        while rclpy.ok() and not done.wait(timeout=0.1):
+            pass
+
+
+def waitForServices(clients):
+    """Wait until all given service clients are ready (concurrently, not one by one)."""
+    while rclpy.ok() and not all(client.service_is_ready() for client in clients):
+        time.sleep(0.01)
+
+
+class LazyClient:
+    """
+    Service client of a :obj:`Crazyflie` that is created on first use.
+
+    Creating and discovering clients for all services of all robots is slow
+    for large swarms, while most scripts only use a few of them.
+    """
+
+    def __init__(self, srv_type, srv_name, wait=True):
+        """
+        Construct LazyClient.
+
+        Args:
+            srv_type: Service type.
+            srv_name (string): Service name, relative to the robot prefix
+                unless it starts with '/crazyflie_server'.
+            wait (bool): If true, wait for the service on first use. Use false
+                for services that not every server provides.
+
+        """
+        self.srv_type = srv_type
+        self.srv_name = srv_name
+        self.wait = wait
+
+    def __set_name__(self, owner, name):
+        self.attr = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        client = obj.__dict__.get(self.attr)
+        if client is None:
+            if self.srv_name.startswith('/crazyflie_server'):
+                name = self.srv_name
+            else:
+                name = obj.prefix + self.srv_name
+            client = obj.node.create_client(self.srv_type, name)
+            if self.wait:
+                client.wait_for_service()
+            obj.__dict__[self.attr] = client
+        return client
+
+
 class TimeHelper:
     """
     Object containing all time-related functionality.
@@ -43,7 +121,12 @@ class TimeHelper:
     This class mainly exists to support both real hardware and (potentially
     faster or slower than realtime) simulation with the same script.
     When running on real hardware, this class uses ROS time functions.
-    The simulation equivalent does not depend on ROS.
+    In simulation, the ROS time follows /clock (use_sim_time).
+
+    The node is spun by an executor in a background thread, so that waiting
+    does not consume any CPU: a sleeping script waits on a condition variable
+    that is notified on every update of the ROS time (in simulation) or times
+    out exactly (on real hardware).
 
     Attributes:
         visualizer: No-op object conforming to the Visualizer API used in
@@ -57,21 +140,45 @@ class TimeHelper:
         # self.rosRate = None
         self.rateHz = None
         self.nextTime = None
+        # running count, sum, sum of squares and maximum of the lateness
+        self.lateness = [0, 0.0, 0.0, 0.0]
         # self.visualizer = visNull.VisNull()
 
+        # wake up sleeping threads whenever the (simulated) time advances
+        self.clock = node.get_clock()
+        self.condition = threading.Condition()
+        self.wakeUpTime = None
+        self.jumpHandle = self.clock.create_jump_handle(
+            JumpThreshold(min_forward=Duration(nanoseconds=1),
+                          min_backward=Duration(nanoseconds=-1),
+                          on_clock_change=True),
+            post_callback=self._timeChanged)
+
+        # spin the node in the background
+        self.executor = SingleThreadedExecutor()
+        self.executor.add_node(node)
+        node.backgroundExecutor = self.executor
+        self.thread = threading.Thread(target=self.executor.spin, daemon=True)
+        self.thread.start()
+
     def time(self):
         """Return current time in seconds."""
-        return self.node.get_clock().now().nanoseconds / 1e9
+        return self.clock.now().nanoseconds / 1e9
 
     def sleep(self, duration):
         """Sleeps for the provided duration in seconds."""
         start = self.time()
         end = start + duration
-        while self.time() < end:
-            rclpy.spin_once(self.node, timeout_sec=0)
+        self._sleepUntil(end)
 
     def sleepForRate(self, rateHz):
-        """Sleep so that, if called in a loop, executes at specified rate."""
+        """
+        Sleep so that, if called in a loop, executes at specified rate.
+
+        The wake-up times are multiples of the period after the first call, i.e.,
+        timing errors do not accumulate. See :meth:`rateStatistics()` for the timing
+        errors.
+        """
         # Note: The following ROS 2 construct cannot easily be used, because in ROS 2
         #       there is no implicit threading anymore. Thus, the rosRate.sleep() call
         #       is blocking. Instead, we simulate the rate behavior ourselves.
@@ -82,10 +189,47 @@ class TimeHelper:
         if self.nextTime is None or self.rateHz != rateHz:
             self.rateHz = rateHz
             self.nextTime = self.time() + 1.0 / rateHz
-        while self.time() < self.nextTime:
-            rclpy.spin_once(self.node, timeout_sec=0)
+            self.lateness = [0, 0.0, 0.0, 0.0]
+        self._sleepUntil(self.nextTime)
+        lateness = self.time() - self.nextTime
+        count, total, totalSq, maximum = self.lateness
+        self.lateness = [count + 1, total + lateness, totalSq + lateness**2,
+                         lateness if count == 0 else max(maximum, lateness)]
         self.nextTime += 1.0 / rateHz
 
+    def rateStatistics(self):
+        """
+        Return the timing errors of the :meth:`sleepForRate()` loop.
+
+        Returns:
+            stats (dict): Number of iterations and mean, standard deviation and
+                maximum of the lateness of each wake-up. Seconds.
+
+        """
+        count, total, totalSq, maximum = self.lateness
+        if count == 0:
+            return {'count': 0, 'mean': 0.0, 'std': 0.0, 'max': 0.0}
+        mean = total / count
+        return {'count': count, 'mean': mean,
+                'std': math.sqrt(max(totalSq / count - mean**2, 0.0)), 'max': maximum}
+
+    def _sleepUntil(self, end):
+        with self.condition:
+            self.wakeUpTime = end
+            while rclpy.ok():
+                remaining = end - self.time()
+                if remaining <= 0:
+                    break
+                # In simulation, _timeChanged notifies us once the time is reached.
+                # The timeout is only exact for wall time; otherwise we simply wait again.
+                self.condition.wait(timeout=remaining)
+            self.wakeUpTime = None
+
+    def _timeChanged(self, time_jump):
+        with self.condition:
+            if self.wakeUpTime is not None and self.time() >= self.wakeUpTime:
+                self.condition.notify_all()
+
     def isShutdown(self):
         """Return True if the script should abort, e.g. from Ctrl-C."""
         return not rclpy.ok()
@@ -98,7 +242,22 @@ class Crazyflie:
     The bulk of the module's functionality is contained in this class.
     """
 
-    def __init__(self, node, cfname, paramTypeDict):
+    # service clients, created on first use
+    emergencyService = LazyClient(Empty, '/emergency')
+    takeoffService = LazyClient(Takeoff, '/takeoff')
+    landService = LazyClient(Land, '/land')
+    # # rospy.wait_for_service(prefix + '/stop')
+    # # self.stopService = rospy.ServiceProxy(prefix + '/stop', Stop)
+    goToService = LazyClient(GoTo, '/go_to')
+    uploadTrajectoryService = LazyClient(UploadTrajectory, '/upload_trajectory')
+    startTrajectoryService = LazyClient(StartTrajectory, '/start_trajectory')
+    notifySetpointsStopService = LazyClient(NotifySetpointsStop, '/notify_setpoints_stop')
+    # not provided by the sim backend
+    armService = LazyClient(Arm, '/arm', wait=False)
+    setParamsService = LazyClient(SetParameters, '/crazyflie_server/set_parameters')
+    getParamsService = LazyClient(GetParameters, '/crazyflie_server/get_parameters')
+
+    def __init__(self, node, cfname, paramTypeDict, initialPosition=None, uri=None):
         """
         Construct Crazyflie.
 
@@ -106,6 +265,9 @@ class Crazyflie:
             node: ROS node reference.
             cfname (string): Name of the robot names[ace].
             paramTypeDict: dictionary of the parameter types.
+            initialPosition (np.array[3]): Initial position, if already known.
+                Otherwise, it is queried from the server (together with the uri).
+            uri (string): Radio uri, if already known.
 
         """
         prefix = '/' + cfname
@@ -114,58 +276,23 @@ class Crazyflie:
 
         # self.tf = tf
 
-        self.emergencyService = node.create_client(Empty, prefix + '/emergency')
-        self.emergencyService.wait_for_service()
-        self.takeoffService = node.create_client(Takeoff, prefix + '/takeoff')
-        self.takeoffService.wait_for_service()
-        self.landService = node.create_client(Land, prefix + '/land')
-        self.landService.wait_for_service()
-        # # rospy.wait_for_service(prefix + '/stop')
-        # # self.stopService = rospy.ServiceProxy(prefix + '/stop', Stop)
-        self.goToService = node.create_client(GoTo, prefix + '/go_to')
-        self.goToService.wait_for_service()
-        self.uploadTrajectoryService = node.create_client(
-            UploadTrajectory, prefix + '/upload_trajectory')
-        self.uploadTrajectoryService.wait_for_service()
-        self.startTrajectoryService = node.create_client(
-            StartTrajectory, prefix + '/start_trajectory')
-        self.startTrajectoryService.wait_for_service()
-        self.notifySetpointsStopService = node.create_client(
-            NotifySetpointsStop, prefix + '/notify_setpoints_stop')
-        self.notifySetpointsStopService.wait_for_service()
-        self.armService = node.create_client(
-            Arm, prefix + '/arm')
-        # self.armService.wait_for_service()
-        self.setParamsService = node.create_client(
-            SetParameters, '/crazyflie_server/set_parameters')
-        self.setParamsService.wait_for_service()
         self.statusSubscriber = node.create_subscription(
             Status, f'{self.prefix}/status', self.status_topic_callback, 10)
         self.status = {}
 
         # Query some settings
-        self.getParamsService = node.create_client(
-            GetParameters, '/crazyflie_server/get_parameters')
-        self.getParamsService.wait_for_service()
-        req = GetParameters.Request()
-        req.names = ['robots.{}.initial_position'.format(cfname), 'robots.{}.uri'.format(cfname)]
-        future = self.getParamsService.call_async(req)
-        while rclpy.ok():
-            rclpy.spin_once(node)
-            if future.done():
-                response = future.result()
-                # extract initial position
-                if response.values[0].type == ParameterType.PARAMETER_INTEGER_ARRAY:
-                    self.initialPosition = np.array(response.values[0].integer_array_value)
-                elif response.values[0].type == ParameterType.PARAMETER_DOUBLE_ARRAY:
-                    self.initialPosition = np.array(response.values[0].double_array_value)
-                else:
-                    assert False
-
-                # extract uri
-                self.uri = response.values[1].string_value
-
-                break
+        if initialPosition is None or uri is None:
+            req = GetParameters.Request()
+            req.names = ['robots.{}.initial_position'.format(cfname),
+                         'robots.{}.uri'.format(cfname)]
+            future = self.getParamsService.call_async(req)
+            waitForFuture(node, future)
+            response = future.result()
+            # extract initial position and uri
+            initialPosition = parameterValueToArray(response.values[0])
+            uri = response.values[1].string_value
+        self.initialPosition = initialPosition
+        self.uri = uri
 
         self.paramTypeDict = paramTypeDict
 
@@ -403,10 +530,7 @@ class Crazyflie:
         req.piece_offset = pieceOffset
         req.pieces = pieces
         future = self.uploadTrajectoryService.call_async(req)
-        while rclpy.ok():
-            rclpy.spin_once(self.node)
-            if future.done():
-                break
+        waitForFuture(self.node, future)
 
     def startTrajectory(self, trajectoryId,
                         timescale=1.0, reverse=False,
@@ -529,7 +653,7 @@ class Crazyflie:
             req = GetParameters.Request()
             req.names = [param_name]
             future = self.getParamsService.call_async(req)
-            rclpy.spin_until_future_complete(self.node, future)
+            waitForFuture(self.node, future)
             param_type = self.paramTypeDict[name]
             if param_type == ParameterType.PARAMETER_INTEGER:
                 param_value = future.result().values[0].integer_value
@@ -796,26 +920,36 @@ class CrazyflieServer(rclpy.node.Node):
 
         # wait for server to be fully started
         self.emergencyService = self.create_client(Empty, 'all/emergency')
-        self.emergencyService.wait_for_service()
-
         self.takeoffService = self.create_client(Takeoff, 'all/takeoff')
-        self.takeoffService.wait_for_service()
         self.landService = self.create_client(Land, 'all/land')
-        self.landService.wait_for_service()
         self.goToService = self.create_client(GoTo, 'all/go_to')
-        self.goToService.wait_for_service()
         self.startTrajectoryService = self.create_client(StartTrajectory, 'all/start_trajectory')
-        self.startTrajectoryService.wait_for_service()
         self.armService = self.create_client(Arm, 'all/arm')
-        # self.armService.wait_for_service()
         self.setParamsService = self.create_client(
             SetParameters, '/crazyflie_server/set_parameters')
-        self.setParamsService.wait_for_service()
+        getParamsService = self.create_client(
+            GetParameters, '/crazyflie_server/get_parameters')
+        listParamsService = self.create_client(ListParameters, '/crazyflie_server/list_parameters')
+        describeParametersService = self.create_client(
+            DescribeParameters, '/crazyflie_server/describe_parameters')
+        waitForServices([
+            self.emergencyService, self.takeoffService, self.landService, self.goToService,
+            self.startTrajectoryService, self.setParamsService, getParamsService,
+            listParamsService, describeParametersService])
 
         self.cmdFullStatePublisher = self.create_publisher(
             FullState, 'all/cmd_full_state', 1)
         self.cmdFullStateMsg = FullState()
         self.cmdFullStateMsg.header.frame_id = '/world'
+        self.cmdFullStateArrayPublisher = self.create_publisher(
+            FullStateArray, 'all/cmd_full_state_array', 1)
+        self.cmdFullStateArrayMsg = FullStateArray()
+        self.cmdFullStateArrayMsg.header.frame_id = '/world'
+
+        # latest state of all robots, if published by the server (see swarmState())
+        self.swarmStateMsg = None
+        self.swarmStateSubscriber = self.create_subscription(
+            SwarmState, 'all/swarm_state', self._swarmStateCallback, 1)
 
         cfnames = []
         for srv_name, srv_types in self.get_service_names_and_types():
@@ -826,8 +960,6 @@ class CrazyflieServer(rclpy.node.Node):
                     cfnames.append(cfname)
 
         # Query all parameters
-        listParamsService = self.create_client(ListParameters, '/crazyflie_server/list_parameters')
-        listParamsService.wait_for_service()
         req = ListParameters.Request()
         req.depth = ListParameters.Request.DEPTH_RECURSIVE
         req.prefixes = []
@@ -844,9 +976,6 @@ class CrazyflieServer(rclpy.node.Node):
                 break
 
         # Find the types for the parameters and store them
-        describeParametersService = self.create_client(
-            DescribeParameters, '/crazyflie_server/describe_parameters')
-        describeParametersService.wait_for_service()
         req = DescribeParameters.Request()
         req.names = params
         future = describeParametersService.call_async(req)
@@ -868,11 +997,22 @@ class CrazyflieServer(rclpy.node.Node):
                 break
         self.paramTypeDict = allParamTypeDicts['all']
 
+        # Query the initial positions and uris of all robots at once
+        req = GetParameters.Request()
+        req.names = [name for cfname in cfnames
+                     for name in ['robots.{}.initial_position'.format(cfname),
+                                  'robots.{}.uri'.format(cfname)]]
+        future = getParamsService.call_async(req)
+        rclpy.spin_until_future_complete(self, future)
+        values = future.result().values
+
         self.crazyflies = []
         self.crazyfliesById = {}
         self.crazyfliesByName = {}
-        for cfname in cfnames:
-            cf = Crazyflie(self, cfname, allParamTypeDicts[cfname])
+        for k, cfname in enumerate(cfnames):
+            cf = Crazyflie(self, cfname, allParamTypeDicts[cfname],
+                           initialPosition=parameterValueToArray(values[2 * k]),
+                           uri=values[2 * k + 1].string_value)
             self.crazyflies.append(cf)
             self.crazyfliesByName[cfname] = cf
             # For legacy crazyswarm1 code, also provide crazyfliesById
@@ -1074,3 +1214,63 @@ class CrazyflieServer(rclpy.node.Node):
         self.cmdFullStateMsg.twist.angular.y = omega[1]
         self.cmdFullStateMsg.twist.angular.z = omega[2]
         self.cmdFullStatePublisher.publish(self.cmdFullStateMsg)
+
+    def cmdFullStateArray(self, states, names=None):
+        """
+        Send individual streaming full-state setpoints to many robots at once.
+
+        Swarm version of :meth:`Crazyflie.cmdFullState()`: all setpoints are
+        published in a single message, which the server turns into one radio
+        packet per robot. This avoids one message and one subscription
+        callback per robot and timestep for large swarms.
+
+        Args:
+            states (array-like of float[N, 13]): One row per robot with
+                position (3), velocity (3), acceleration (3), yaw angle (1), and
+                angular velocity in body frame (3). Meters, seconds, radians.
+            names (list of str): Names of the N robots. Defaults to the names of
+                :attr:`crazyflies`, in the same order.
+
+        """
+        states = np.ascontiguousarray(states, dtype=np.float64)
+        if names is None:
+            names = [cf.prefix[1:] for cf in self.crazyflies]
+        assert states.shape == (len(names), FullStateArray.NUM_COLUMNS)
+
+        msg = self.cmdFullStateArrayMsg
+        if list(msg.names) != list(names):
+            msg.names = list(names)
+        # array.array is assigned without per-element checks
+        msg.states = array.array('d', states.tobytes())
+        msg.header.stamp = self.get_clock().now().to_msg()
+        self.cmdFullStateArrayPublisher.publish(msg)
+
+    def _swarmStateCallback(self, msg):
+        self.swarmStateMsg = msg
+
+    def swarmState(self):
+        """
+        Return the latest state of all robots.
+
+        The server publishes the state of all robots in a single message on
+        all/swarm_state if swarm_state.enabled is set in server.yaml. This
+        avoids one subscription and one message per robot (e.g., on the pose
+        topics or /tf) for planners, GUIs, or safety monitors. The message is
+        received while the node is spun, e.g., by :obj:`TimeHelper`.
+
+        Returns:
+            None if no message was received yet, otherwise a tuple of
+            names (list of str): Names of the N robots.
+            states (np.array float[N, 10]): View of the message with one row
+                per robot: position (3), orientation quaternion (x, y, z, w),
+                and velocity (3). Meters, seconds. NaN if not known.
+            supervisorInfo (np.array uint16[N]): Supervisor bitfield, see
+                Status.SUPERVISOR_INFO_*.
+
+        """
+        msg = self.swarmStateMsg
+        if msg is None:
+            return None
+        states = np.frombuffer(msg.states, dtype=np.float64).reshape(-1, SwarmState.NUM_COLUMNS)
+        supervisorInfo = np.frombuffer(msg.supervisor_info, dtype=np.uint16)
+        return list(msg.names), states, supervisorInfo
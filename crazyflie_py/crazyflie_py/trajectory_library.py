@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Binary container for many piecewise polynomial trajectories.
+
+A library stores the trajectories of many robots in a single file that is
+memory-mapped when loaded, i.e., opening a library only reads its index and
+all processes that open the same file share its pages. Each trajectory is
+identified by a robot id and a trajectory id.
+
+File layout (little endian):
+    header:  magic (8 bytes), version (uint32), number of trajectories T (uint32),
+             number of pieces P (uint64)
+    index:   T entries of robot id (int32), trajectory id (int32),
+             first piece (uint64), number of pieces (uint64), duration (float64)
+    pieces:  P rows of 33 float64, in the same column order as the CSV files
+             (duration, x^0..x^7, y^0..y^7, z^0..z^7, yaw^0..yaw^7)
+
+Usage to convert CSV files:
+    python3 -m crazyflie_py.trajectory_library <output> <input_dir>
+
+If <input_dir> contains subdirectories, each subdirectory holds the
+trajectories of one robot (e.g. <input_dir>/<robot>/<trajectory>.csv).
+Otherwise, each CSV file is the trajectory of one robot with trajectory id 0.
+Ids are the numbers in the directory and file names (e.g. traj3.csv -> 3).
+"""
+
+import os
+import re
+
+import numpy as np
+
+from .uav_trajectory import Trajectory
+
+MAGIC = b'CFTRAJ\x00\x00'
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('num_trajectories', '<u4'),
+    ('num_pieces', '<u8')])
+
+INDEX_DTYPE = np.dtype([
+    ('robot', '<i4'),
+    ('trajectory', '<i4'),
+    ('first_piece', '<u8'),
+    ('num_pieces', '<u8'),
+    ('duration', '<f8')])
+
+PIECE_COLUMNS = 33
+
+
+class TrajectoryLibrary:
+    """Read-only, memory-mapped library of trajectories indexed by robot and trajectory id."""
+
+    def __init__(self, filename):
+        # plain ndarray view of the mapping, since slicing np.memmap objects is slow
+        self._data = np.memmap(filename, dtype=np.uint8, mode='r').view(np.ndarray)
+        header = self._data[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header['magic'] != MAGIC.rstrip(b'\x00') or header['version'] != VERSION:
+            raise ValueError('{} is not a trajectory library (version {})'.format(
+                filename, VERSION))
+
+        index_start = HEADER_DTYPE.itemsize
+        pieces_start = index_start + int(header['num_trajectories']) * INDEX_DTYPE.itemsize
+        self.index = self._data[index_start:pieces_start].view(INDEX_DTYPE)
+        self.pieces = self._data[pieces_start:].view('<f8').reshape(-1, PIECE_COLUMNS)
+
+        self._lookup = {
+            (int(robot), int(trajectory)): k
+            for k, (robot, trajectory) in enumerate(
+                zip(self.index['robot'], self.index['trajectory']))}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self._lookup
+
+    def keys(self):
+        """Return the (robot id, trajectory id) pairs of all stored trajectories."""
+        return list(self._lookup.keys())
+
+    def robots(self):
+        """Return the sorted ids of all robots in the library."""
+        return sorted({robot for robot, _ in self._lookup})
+
+    def duration(self, robot, trajectory=0):
+        return float(self.index['duration'][self._lookup[(robot, trajectory)]])
+
+    def data(self, robot, trajectory=0):
+        """Return the pieces of a trajectory as (read-only) view of shape (P, 33)."""
+        entry = self.index[self._lookup[(robot, trajectory)]]
+        first = int(entry['first_piece'])
+        return self.pieces[first:first + int(entry['num_pieces'])]
+
+    def trajectory(self, robot, trajectory=0):
+        """Return a trajectory, whose coefficients are views into the memory-mapped file."""
+        traj = Trajectory()
+        traj.loadarray(self.data(robot, trajectory))
+        return traj
+
+    def trajectories(self, robot):
+        """Return all trajectories of a robot, sorted by trajectory id."""
+        ids = sorted(trajectory for r, trajectory in self._lookup if r == robot)
+        return [self.trajectory(robot, trajectory) for trajectory in ids]
+
+
+def save_library(filename, trajectories):
+    """
+    Write trajectories to a library file.
+
+    Args:
+        filename (str): Output file.
+        trajectories (dict): Maps (robot id, trajectory id) to a Trajectory or
+            to an array float[P, 33] in the CSV column order.
+
+    """
+    keys = sorted(trajectories.keys())
+    arrays = [_to_array(trajectories[key]) for key in keys]
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['num_trajectories'] = len(keys)
+    header['num_pieces'] = sum(len(data) for data in arrays)
+
+    index = np.zeros(len(keys), dtype=INDEX_DTYPE)
+    index['robot'] = [robot for robot, _ in keys]
+    index['trajectory'] = [trajectory for _, trajectory in keys]
+    index['num_pieces'] = [len(data) for data in arrays]
+    index['first_piece'] = np.cumsum(index['num_pieces']) - index['num_pieces']
+    index['duration'] = [np.sum(data[:, 0]) for data in arrays]
+
+    with open(filename, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(index.tobytes())
+        for data in arrays:
+            f.write(data.astype('<f8').tobytes())
+
+
+def convert_csvs(filename, csvs):
+    """
+    Convert CSV files to a library file.
+
+    Args:
+        filename (str): Output file.
+        csvs (dict): Maps (robot id, trajectory id) to the path of a CSV file.
+
+    """
+    trajectories = {}
+    for key, path in csvs.items():
+        trajectories[key] = np.loadtxt(
+            path, delimiter=',', skiprows=1, usecols=range(PIECE_COLUMNS), ndmin=2)
+    save_library(filename, trajectories)
+
+
+def find_csvs(path):
+    """Return the CSV files in path by (robot id, trajectory id), see the module documentation."""
+    csvs = {}
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+        if entry.is_dir():
+            robot = _id_from_name(entry.name)
+            for f in os.scandir(entry.path):
+                if f.name.endswith('.csv'):
+                    csvs[(robot, _id_from_name(f.name))] = f.path
+        elif entry.name.endswith('.csv'):
+            csvs[(_id_from_name(entry.name), 0)] = entry.path
+    return csvs
+
+
+def _id_from_name(name):
+    match = re.search(r'(\d+)\D*$', name)
+    if match is None:
+        raise ValueError('No id in name {}'.format(name))
+    return int(match.group(1))
+
+
+def _to_array(trajectory):
+    if isinstance(trajectory, Trajectory):
+        return np.array([
+            np.concatenate(([p.duration], p.px.p, p.py.p, p.pz.p, p.pyaw.p))
+            for p in trajectory.polynomials])
+    data = np.asarray(trajectory, dtype=float)
+    assert data.ndim == 2 and data.shape[1] == PIECE_COLUMNS
+    return data
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Convert CSV trajectories to a library.')
+    parser.add_argument('output', help='library file to write')
+    parser.add_argument('input', help='directory with CSV files')
+    args = parser.parse_args()
+
+    csvs = find_csvs(args.input)
+    convert_csvs(args.output, csvs)
+
+    # compare the loading times
+    start = time.perf_counter()
+    for path in csvs.values():
+        Trajectory().loadcsv(path)
+    duration_csv = time.perf_counter() - start
+
+    start = time.perf_counter()
+    library = TrajectoryLibrary(args.output)
+    for robot, trajectory in library.keys():
+        library.trajectory(robot, trajectory)
+    duration_library = time.perf_counter() - start
+
+    print('Converted {} trajectories of {} robots ({} pieces).'.format(
+        len(library), len(library.robots()), len(library.pieces)))
+    print('Loading: {:.1f} ms (csv), {:.1f} ms (library)'.format(
+        duration_csv * 1e3, duration_library * 1e3))
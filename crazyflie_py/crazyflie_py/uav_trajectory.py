@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import bisect
+
 import numpy as np
 
 
@@ -9,6 +11,14 @@ def normalize(v):
     return v / norm
 
 
+# cross product along the last axis (np.cross has a large overhead for single vectors)
+def _cross(a, b):
+    return np.stack((
+        a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1],
+        a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2],
+        a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]), axis=-1)
+
+
 class Polynomial:
 
     def __init__(self, p):
@@ -106,6 +116,10 @@ class Trajectory:
 
     def loadcsv(self, filename):
         data = np.loadtxt(filename, delimiter=',', skiprows=1, usecols=range(33))
+        self.loadarray(data)
+
+    # data is an array of shape (pieces, 33) in the same column order as the csv files
+    def loadarray(self, data):
         self.polynomials = [Polynomial4D(row[0], row[1:9],
                                          row[9:17], row[17:25], row[25:33]) for row in data]
         self.duration = np.sum(data[:, 0])
@@ -119,3 +133,137 @@ class Trajectory:
             if t <= current_t + p.duration:
                 return p.eval(t - current_t)
             current_t = current_t + p.duration
+
+    def compile(self):  # noqa: A003
+        return CompiledTrajectory(self)
+
+
+class CompiledTrajectory:
+    """
+    Piecewise polynomial trajectory with precomputed coefficient arrays.
+
+    The coefficients of all pieces and of their first three derivatives are
+    stored in one array, so that the evaluation only requires a binary search
+    for the piece and a vectorized Horner's rule. Use eval_many() to evaluate
+    the trajectory at many timestamps at once.
+    """
+
+    def __init__(self, trajectory):
+        durations = np.array([p.duration for p in trajectory.polynomials], dtype=float)
+        degree = max(len(p) for poly in trajectory.polynomials
+                     for p in (poly.px.p, poly.py.p, poly.pz.p, poly.pyaw.p))
+
+        # coefficients[piece, derivative, axis (x, y, z, yaw), power]
+        self.coefficients = np.zeros((len(durations), 4, 4, degree))
+        for k, poly in enumerate(trajectory.polynomials):
+            for axis, p in enumerate((poly.px.p, poly.py.p, poly.pz.p, poly.pyaw.p)):
+                self.coefficients[k, 0, axis, :len(p)] = p
+        powers = np.arange(1, degree)
+        for d in range(1, 4):
+            self.coefficients[:, d, :, :-1] = self.coefficients[:, d - 1, :, 1:] * powers
+
+        # same accumulation as in Trajectory.eval
+        self.ends = np.cumsum(durations)
+        self.starts = np.concatenate(([0.0], self.ends[:-1]))
+        self.duration = trajectory.duration
+
+    def n_pieces(self):
+        return len(self.ends)
+
+    def eval_many(self, ts):
+        """
+        Evaluate the trajectory at the given timestamps.
+
+        Args:
+            ts (array float[T]): Timestamps in [0, duration] [s].
+
+        Returns:
+            TrajectoryOutput with arrays pos (T, 3), vel (T, 3), acc (T, 3),
+            omega (T, 3), and yaw (T,).
+
+        """
+        ts = np.asarray(ts, dtype=float)
+        assert np.all(ts >= 0)
+        assert np.all(ts <= self.duration)
+
+        # first piece that ends at or after t
+        pieces = np.minimum(np.searchsorted(self.ends, ts, side='left'), self.n_pieces() - 1)
+        local_ts = (ts - self.starts[pieces])[:, np.newaxis, np.newaxis]
+        return self._output(self._horner(self.coefficients[pieces], local_ts))
+
+    def eval(self, t):  # noqa: A003
+        assert t >= 0
+        assert t <= self.duration
+
+        piece = min(bisect.bisect_left(self.ends, t), self.n_pieces() - 1)
+        return self._output(self._horner(self.coefficients[piece], t - self.starts[piece]))
+
+    # horner's rule for all derivatives and axes at once
+    @staticmethod
+    def _horner(coefficients, t):
+        values = coefficients[..., -1]
+        for i in range(coefficients.shape[-1] - 2, -1, -1):
+            values = values * t + coefficients[..., i]
+        return values
+
+    # values[..., derivative, axis]; computes the angular velocity as in Polynomial4D.eval
+    @staticmethod
+    def _output(values):
+        result = TrajectoryOutput()
+        result.pos = values[..., 0, 0:3]
+        result.yaw = values[..., 0, 3]
+        result.vel = values[..., 1, 0:3]
+        dyaw = values[..., 1, 3]
+        result.acc = values[..., 2, 0:3]
+        jerk = values[..., 3, 0:3]
+
+        thrust = result.acc + np.array([0, 0, 9.81])  # add gravity
+        thrust_norm = np.linalg.norm(thrust, axis=-1, keepdims=True)
+        z_body = thrust / thrust_norm
+        x_world = np.stack(
+            (np.cos(result.yaw), np.sin(result.yaw), np.zeros_like(result.yaw)), axis=-1)
+        y_body = _cross(z_body, x_world)
+        y_body /= np.linalg.norm(y_body, axis=-1, keepdims=True)
+        x_body = _cross(y_body, z_body)
+
+        jerk_orth_zbody = jerk - np.sum(jerk * z_body, axis=-1, keepdims=True) * z_body
+        h_w = jerk_orth_zbody / thrust_norm
+
+        result.omega = np.stack((
+            -np.sum(h_w * y_body, axis=-1),
+            np.sum(h_w * x_body, axis=-1),
+            z_body[..., 2] * dyaw), axis=-1)
+        return result
+
+
+if __name__ == '__main__':
+    # benchmark: evaluation of a trajectory at many timestamps
+    import sys
+    import time
+
+    traj = Trajectory()
+    traj.loadcsv(sys.argv[1])
+    compiled = traj.compile()
+    ts = np.linspace(0, traj.duration, 10000)
+
+    start = time.perf_counter()
+    expected = [traj.eval(t) for t in ts]
+    duration_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [compiled.eval(t) for t in ts]
+    duration_single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = compiled.eval_many(ts)
+    duration_many = time.perf_counter() - start
+
+    for field in ['pos', 'vel', 'acc', 'omega', 'yaw']:
+        reference = np.array([getattr(e, field) for e in expected])
+        error_single = np.max(np.abs(np.array([getattr(e, field) for e in single]) - reference))
+        error_many = np.max(np.abs(getattr(result, field) - reference))
+        print('max. error {}: {:.2e} (eval), {:.2e} (eval_many)'.format(
+            field, error_single, error_many))
+    print('Trajectory.eval: {:.1f} ms, CompiledTrajectory.eval: {:.1f} ms, '
+          'CompiledTrajectory.eval_many: {:.1f} ms'.format(
+              duration_loop * 1e3, duration_single * 1e3, duration_many * 1e3))
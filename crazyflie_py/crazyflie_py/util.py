@@ -1,10 +1,111 @@
 """Useful functions for both pycrazyswarm internals and user scripts."""
 
+from collections import namedtuple
+
 import numpy as np
 import scipy as sp
 import scipy.spatial
 
 
+CollisionResult = namedtuple('CollisionResult', [
+    'pairs', 'distances', 'colliding', 'nearest', 'min_separation'])
+CollisionResult.__doc__ = """
+Result of :meth:`EllipsoidCollisionChecker.update()`.
+
+Distances are between the ellipsoid centers, in coordinates scaled by the
+radii, i.e., two ellipsoids touch at distance 2.
+
+Attributes:
+    pairs (array int[m, 2]): Indices (i, j), i < j, of the colliding pairs.
+    distances (array float[m]): Scaled distances of the colliding pairs.
+    colliding (array bool[n]): True at index i if the i'th ellipsoid
+        intersects any of the other ellipsoids.
+    nearest (array float[n]): Scaled distance of each ellipsoid to its
+        nearest neighbor, or inf if that is beyond the range covered by the
+        candidate pairs (which is at least the checker's threshold).
+    min_separation (float): Smallest scaled distance between two ellipsoids,
+        with the same cutoff as nearest.
+
+"""
+
+
+class EllipsoidCollisionChecker:
+    """
+    Collision checker for many ellipsoids that move only a little per call.
+
+    The positions are scaled by the radii, which turns the ellipsoids into
+    spheres. Candidate pairs closer than threshold + skin are found with a
+    KD-tree and reused until an ellipsoid moved by more than skin / 2 since,
+    so that most calls only compute the distances of the candidate pairs
+    instead of all n * (n - 1) / 2 of them.
+
+    Args:
+        radii (array float[3]): The radii of the axis-aligned ellipsoids.
+        threshold (float): Scaled distance below which two ellipsoids collide.
+        skin (float): Scaled margin of the candidate pairs. Larger values
+            cause fewer rebuilds of the KD-tree, but more candidate pairs.
+
+    """
+
+    def __init__(self, radii, threshold=1.97, skin=0.5):
+        self.radii = np.asarray(radii, dtype=float)
+        self.threshold = threshold
+        self.skin = skin
+        self.rebuilds = 0
+        self._reference = None  # scaled positions when the candidates were computed
+        self._candidates = None
+
+    def reset(self):
+        """Discard the candidate pairs, e.g., after the set of ellipsoids changed."""
+        self._reference = None
+        self._candidates = None
+
+    def update(self, positions):
+        """
+        Check for collisions between the ellipsoids at their new positions.
+
+        Args:
+            positions (array float[n, 3]): The ellipsoid centers, in the same
+                order as in the previous calls.
+
+        Returns:
+            result (CollisionResult): Colliding pairs and separations.
+
+        """
+        scaled = np.asarray(positions, dtype=float) / self.radii[None, :]
+        n = len(scaled)
+        if self._reference is not None and len(self._reference) == n:
+            displacement = np.max(
+                np.linalg.norm(scaled - self._reference, axis=1), initial=0.0)
+        else:
+            displacement = np.inf
+
+        if 2 * displacement > self.skin:
+            tree = sp.spatial.cKDTree(scaled)
+            self._candidates = tree.query_pairs(
+                self.threshold + self.skin, output_type='ndarray').reshape(-1, 2)
+            self._reference = scaled
+            displacement = 0.0
+            self.rebuilds += 1
+
+        i, j = self._candidates[:, 0], self._candidates[:, 1]
+        dists = np.linalg.norm(scaled[i] - scaled[j], axis=1)
+
+        # All pairs that are closer than this are candidates.
+        exact = dists < self.threshold + self.skin - 2 * displacement
+        nearest = np.full(n, np.inf)
+        np.minimum.at(nearest, i[exact], dists[exact])
+        np.minimum.at(nearest, j[exact], dists[exact])
+
+        colliding = dists < self.threshold
+        return CollisionResult(
+            pairs=self._candidates[colliding],
+            distances=dists[colliding],
+            colliding=nearest < self.threshold,
+            nearest=nearest,
+            min_separation=np.min(nearest, initial=np.inf))
+
+
 def check_ellipsoid_collisions(positions, radii):
     """
     Check for collisions between a set of ellipsoids at given positions.
@@ -18,45 +119,193 @@ def check_ellipsoid_collisions(positions, radii):
             intersects any of the other ellipsoids.
 
     """
-    scaled = positions / radii[None, :]
-    dists = sp.spatial.distance.pdist(scaled)
-    dists = sp.spatial.distance.squareform(dists)
-    # Do not consider 0 distance to self as a collision!
-    n, _ = positions.shape
-    dists[range(n), range(n)] = np.inf
-    colliding = np.any(dists < 1.97, axis=1)
-    return colliding
+    # Without skin, the candidates are exactly the colliding pairs.
+    checker = EllipsoidCollisionChecker(radii, skin=0.0)
+    return checker.update(positions).colliding
 
 
-def poisson_disk_sample(n, dim, mindist):
+def poisson_disk_sample(n, dim, mindist, bounds=None, seed=None):
     """
     Generate random points with guaranteed minimum pairwise distance.
 
-    Uses extremely naive and slow "dart throwing" algorithm.
-    TODO(jpreiss): find/implement a library with a fast algorithm.
+    Fills a box with points using Bridson's algorithm and returns a random
+    subset of n of them, so that the points are spread evenly over the box.
 
     Args:
         n (int): Number of points.
         dim (int): Dimensionality of points.
         mindist (float): Minimum Euclidean distance between any two points.
+        bounds (array float[2, dim]): Lower and upper corner of the box that
+            contains the points. Dimensions with equal bounds are constant.
+            By default, the box is centered at the origin and sized such that
+            the n points are not packed too tightly.
+        seed (int): Seed of the random number generator. Use to generate the
+            same points in every run.
 
     Returns:
         pts (array float[n, dim]): The sampled points.
 
+    Raises:
+        ValueError: If n points do not fit into the given bounds.
+
     """
-    # Select hypercube volume such that n points will not pack it too tightly.
-    # Note: Will be too sparse for dim >> 3, but reasonable for dim == 2 or 3.
-    measure_ratio = 1.25
-    std = (measure_ratio * n) ** (1.0 / dim) * mindist
-
-    def sample():
-        return std * np.random.uniform(-0.5, 0.5, size=dim)
-
-    # Sample the points using dart-throwing.
-    pts = sample()[None, :]
-    while len(pts) < n:
-        pt = sample()
-        dists = np.linalg.norm(pts - pt, axis=1)
-        if np.all(dists >= mindist):
-            pts = np.concatenate([pts, pt[None, :]], axis=0)
-    return pts
+    rng = np.random.default_rng(seed)
+    if bounds is not None:
+        lower, upper = np.asarray(bounds, dtype=float)
+        # e.g., a formation at a fixed height is sampled in 2D
+        free = upper > lower
+        pts = np.tile(lower, (1, 1))
+        if np.any(free):
+            sample = _bridson_sample(rng, lower[free], upper[free], mindist)
+            pts = np.tile(lower, (len(sample), 1))
+            pts[:, free] = sample
+        if len(pts) < n:
+            raise ValueError('Only {} points with distance {} fit into the bounds, not {}'.format(
+                len(pts), mindist, n))
+    else:
+        # Select hypercube volume such that n points will not pack it too tightly.
+        # Note: Will be too sparse for dim >> 3, but reasonable for dim == 2 or 3.
+        # A filled box has about 0.6 points per mindist ** dim for dim == 2 or 3.
+        measure_ratio = 2.0
+        while True:
+            std = (measure_ratio * n) ** (1.0 / dim) * mindist
+            pts = _bridson_sample(rng, np.full(dim, -0.5 * std), np.full(dim, 0.5 * std), mindist)
+            if len(pts) >= n:
+                break
+            # The box was packed too tightly for this random sample, enlarge it.
+            measure_ratio *= 1.5
+    return pts[rng.choice(len(pts), n, replace=False)]
+
+
+def _bridson_sample(rng, lower, upper, mindist, k=10):
+    # Fills the box [lower, upper) until no more points fit, following Bridson, "Fast
+    # Poisson disk sampling in arbitrary dimensions", SIGGRAPH 2007. Instead of one active
+    # point at a time, all active points spawn their k candidates at once. A background
+    # grid with at most one point per cell limits the distance checks to the neighboring
+    # cells, both against the accepted points and among the candidates. As active points
+    # stay active for several rounds, k can be smaller than the usual 30.
+    dim = len(lower)
+    cell = mindist / np.sqrt(dim)
+    shape = np.maximum(np.ceil((upper - lower) / cell).astype(int), 1)
+
+    # points closer than mindist are at most reach cells apart
+    reach = int(np.ceil(np.sqrt(dim)))
+    offsets = np.stack(np.meshgrid(*[np.arange(-reach, reach + 1)] * dim, indexing='ij'),
+                       axis=-1).reshape(-1, dim)
+    # skip the neighbors that are too far away even from the closest point of the cell
+    offsets = offsets[np.sum(np.maximum(np.abs(offsets) - 1, 0) ** 2, axis=1) < dim]
+
+    # the grids have an empty border, so that the neighbors of all cells are inside
+    padded_shape = tuple(shape + 2 * reach)
+    offsets = np.ravel_multi_index(tuple((offsets + reach).T), padded_shape) \
+        - np.ravel_multi_index((reach,) * dim, padded_shape)
+    grid = np.full(np.prod(padded_shape), -1, dtype=int)    # accepted points
+    claims = np.full(np.prod(padded_shape), -1, dtype=int)  # candidates of the current round
+    pts = np.empty((np.prod(shape), dim))
+
+    def flat_cells_of(p):
+        cells = np.minimum(((p - lower) / cell).astype(int), shape - 1) + reach
+        return np.ravel_multi_index(tuple(cells.T), padded_shape)
+
+    # pairs (i, id) of the points p[i] with the points of the table closer than mindist
+    def close_pairs(p, flat, table, table_pts):
+        ids = table[flat[:, None] + offsets[None, :]]
+        rows, cols = np.nonzero(ids >= 0)
+        ids = ids[rows, cols]
+        close = np.sum((table_pts[ids] - p[rows]) ** 2, axis=1) < mindist ** 2
+        return rows[close], ids[close]
+
+    pts[0] = rng.uniform(lower, upper)
+    grid[flat_cells_of(pts[:1])] = 0
+    count = 1
+    active = np.array([0])
+    while len(active) > 0:
+        # k candidates per active point in the spherical shell between mindist and 2 * mindist
+        directions = rng.normal(size=(len(active), k, dim))
+        directions /= np.linalg.norm(directions, axis=2, keepdims=True)
+        radii = rng.uniform(mindist, 2 * mindist, size=(len(active), k, 1))
+        candidates = (pts[active][:, None, :] + directions * radii).reshape(-1, dim)
+        parents = np.repeat(np.arange(len(active)), k)
+        inside = np.all((candidates >= lower) & (candidates < upper), axis=1)
+        candidates, parents = candidates[inside], parents[inside]
+
+        # at most one candidate per free cell, in random order
+        flat = flat_cells_of(candidates)
+        _, first = np.unique(flat, return_index=True)
+        first = rng.permutation(first[grid[flat[first]] < 0])
+        candidates, parents, flat = candidates[first], parents[first], flat[first]
+
+        # keep the candidates that are far enough from the accepted points
+        far = np.ones(len(candidates), dtype=bool)
+        far[close_pairs(candidates, flat, grid, pts)[0]] = False
+        candidates, parents, flat = candidates[far], parents[far], flat[far]
+
+        # accept the candidates that are far enough from all preceding candidates; the
+        # others are tried again in the next round, as their active point stays active
+        claims[flat] = np.arange(len(candidates))
+        rows, ids = close_pairs(candidates, flat, claims, candidates)
+        claims[flat] = -1
+        accepted = np.ones(len(candidates), dtype=bool)
+        accepted[rows[ids < rows]] = False
+
+        ids = np.arange(count, count + np.count_nonzero(accepted))
+        pts[ids] = candidates[accepted]
+        grid[flat[accepted]] = ids
+        count += len(ids)
+
+        # active points without any candidate far enough from the accepted points are done
+        spawned = np.zeros(len(active), dtype=bool)
+        spawned[parents] = True
+        active = np.concatenate((active[spawned], ids))
+    return pts[:count]
+
+
+if __name__ == '__main__':
+    # benchmarks: formation sampling, and collision checks of a swarm that moves a
+    # little per tick
+    import time
+
+    for n in [10, 100, 1000]:
+        start = time.perf_counter()
+        pts = poisson_disk_sample(n, 3, 0.5, seed=0)
+        duration = time.perf_counter() - start
+        dists = sp.spatial.distance.pdist(pts)
+        print('poisson_disk_sample: n = {:4d}: {:.1f} ms, min. distance {:.3f}'.format(
+            n, duration * 1e3, np.min(dists)))
+
+    radii = np.array([0.12, 0.12, 0.3])
+    ticks = 20
+    for n in [10, 100, 1000, 10000]:
+        # roughly 3 robot diameters between neighbors
+        positions = np.random.uniform(0, 6 * 0.12 * n ** (1.0 / 3.0), size=(n, 3))
+        velocities = np.random.normal(0, 0.1, size=(n, 3))
+
+        if n <= 1000:
+            start = time.perf_counter()
+            for _ in range(ticks):
+                scaled = positions / radii[None, :]
+                dists = sp.spatial.distance.squareform(sp.spatial.distance.pdist(scaled))
+                dists[range(n), range(n)] = np.inf
+                expected = np.any(dists < 1.97, axis=1)
+            duration_pdist = '{:.2f} ms'.format((time.perf_counter() - start) / ticks * 1e3)
+        else:
+            expected = None
+            duration_pdist = 'skipped'
+
+        start = time.perf_counter()
+        for _ in range(ticks):
+            colliding = check_ellipsoid_collisions(positions, radii)
+        duration_tree = (time.perf_counter() - start) / ticks
+        assert expected is None or np.array_equal(colliding, expected)
+
+        checker = EllipsoidCollisionChecker(radii)
+        start = time.perf_counter()
+        for _ in range(ticks):
+            positions = positions + velocities * 0.01  # 100 Hz
+            checker.update(positions)
+        duration_incremental = (time.perf_counter() - start) / ticks
+
+        print('n = {:5d}: pdist {}, KD-tree {:.2f} ms, incremental {:.2f} ms '
+              '({} rebuilds in {} ticks)'.format(
+                  n, duration_pdist, duration_tree * 1e3, duration_incremental * 1e3,
+                  checker.rebuilds, ticks))
@@ -2,9 +2,7 @@ from pathlib import Path
 
 import numpy as np
 from rclpy.node import Node
-from rclpy.time import Time
 import robot_python
-from rosgraph_msgs.msg import Clock
 
 # import sys
 # sys.path.append("/home/whoenig/projects/dynobench/build")
@@ -18,7 +16,6 @@ class Backend:
     def __init__(self, node: Node, names: list[str], states: list[State]):
         self.node = node
         self.names = names
-        self.clock_publisher = node.create_publisher(Clock, 'clock', 10)
         self.t = 0
         self.dt = 0.0005
 
@@ -40,12 +37,6 @@ class Backend:
             uav.step(action, self.dt)
             next_states.append(uav.state)
 
-        # print(states_desired, actions, next_states)
-        # publish the current clock
-        clock_message = Clock()
-        clock_message.clock = Time(seconds=self.time()).to_msg()
-        self.clock_publisher.publish(clock_message)
-
         return next_states
 
     def shutdown(self):
@@ -10,13 +10,11 @@ from pathlib import Path
 
 import numpy as np
 from rclpy.node import Node
-from rclpy.time import Time
-from rosgraph_msgs.msg import Clock
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from .np import Quadrotor
+from .np_batched import QuadrotorSwarm
 from ..sim_data_types import Action, State
 
 
@@ -99,6 +97,75 @@ class NeuralSwarm:
 
         return np.array([0, 0, faz[0].item()])
 
+    @torch.no_grad()
+    def compute_Fa_batched(self, cftypes, x, n=None):
+        """
+        Compute the interaction forces of all robots at once.
+
+        Same model as compute_Fa, but only pairs within the interaction box are
+        considered, and each network is evaluated once on all of its inputs.
+
+        Args:
+            cftypes (list of str): Type of each robot.
+            x (array float[N, 6]): Position and velocity of each robot.
+            n (int): Only compute the forces of the first n robots; the others
+                only act as neighbors. Defaults to N.
+
+        Returns:
+            array float[n, 3]: Interaction force of each robot [g].
+
+        """
+        x = np.asarray(x, dtype=np.float64)
+        n = len(x) if n is None else n
+        small, large = self._cftype_masks(cftypes)
+
+        # pairwise interactions
+        i, j = self._neighbor_pairs(x)
+        x_12 = torch.from_numpy(x[j] - x[i]).float()
+        keep = (i < n) & ((x_12[:, 1].abs() < 0.2) & (x_12[:, 3].abs() < 1.5)).numpy()
+        i, j, x_12 = i[keep], j[keep], x_12[keep]
+        rho_input = torch.zeros((n, self.H))
+        for mask, phi_net in ((small[j], self.phi_S_net), (large[j], self.phi_L_net)):
+            if mask.any():
+                rho_input.index_add_(0, torch.from_numpy(i[mask]), phi_net(x_12[mask]))
+
+        # interaction with the ground
+        x_12 = -torch.from_numpy(x[0:n, 2:6]).float()
+        rho_input += self.phi_G_net(x_12)
+
+        faz = np.zeros(n)
+        for mask, rho_net in ((small[0:n], self.rho_S_net), (large[0:n], self.rho_L_net)):
+            if mask.any():
+                faz[mask] = rho_net(rho_input[mask])[:, 0].numpy()
+
+        f_a = np.zeros((n, 3))
+        f_a[:, 2] = faz
+        return f_a
+
+    @staticmethod
+    def _cftype_masks(cftypes):
+        cftypes = np.asarray(cftypes)
+        small = (cftypes == 'small') | (cftypes == 'small_powerful_motors')
+        large = cftypes == 'large'
+        if not np.all(small | large):
+            raise Exception('Unknown cftype!')
+        return small, large
+
+    @staticmethod
+    def _neighbor_pairs(x):
+        """Return all pairs (i, j), i != j, with |x_j - x_i| < 0.2 (sweep along x)."""
+        order = np.argsort(x[:, 0], kind='stable')
+        xs = x[order, 0]
+        # window [lo, hi) of robots (in sorted order) within 0.2 m along x
+        lo = np.searchsorted(xs, xs - 0.2, side='right')
+        hi = np.searchsorted(xs, xs + 0.2, side='left')
+        counts = hi - lo
+        starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        i = np.repeat(order, counts)
+        j = order[starts + np.arange(counts.sum())]
+        keep = (i != j) & (np.abs(x[j, 0] - x[i, 0]) < 0.2)
+        return i[keep], j[keep]
+
 
 class Backend:
     """Backend that is based on the one defined in np.py."""
@@ -106,46 +173,38 @@ class Backend:
     def __init__(self, node: Node, names: list[str], states: list[State]):
         self.node = node
         self.names = names
-        self.clock_publisher = node.create_publisher(Clock, 'clock', 10)
         self.t = 0
         self.dt = 0.0005
 
-        self.uavs = []
-        for state in states:
-            uav = Quadrotor(state)
-            self.uavs.append(uav)
+        self.swarm = QuadrotorSwarm(states)
+        self.cftypes = ['small'] * len(states)
+        # robots that are simulated elsewhere (e.g., by other workers)
+        self.neighbors = np.empty((0, 6))
         self.neuralswarm = NeuralSwarm(Path(__file__).parent / 'data/neuralswarm2')
 
     def time(self) -> float:
         return self.t
 
+    def set_neighbor_states(self, x: np.ndarray):
+        """Set position and velocity (array float[M, 6]) of robots simulated elsewhere."""
+        self.neighbors = np.array(x, dtype=float).reshape(-1, 6)
+
     def step(self, states_desired: list[State], actions: list[Action]) -> list[State]:
         # advance the time
         self.t += self.dt
 
-        fa_data = []
-        for uav in self.uavs:
-            fa_data.append(('small', torch.hstack(
-                (torch.tensor(uav.state.pos), torch.tensor(uav.state.vel)))))
-
-        next_states = []
-        for k, (uav, action) in enumerate(zip(self.uavs, actions)):
-            # estimate F_a
-            # print(k, fa_data[k], fa_data[0:k] + fa_data[k+1:])
-            f_a = self.neuralswarm.compute_Fa(fa_data[k], fa_data[0:k] + fa_data[k+1:])
-            # convert grams to Newtons
-            f_a = f_a / 1000 * 9.81
-            # print(f_a)
-            uav.step(action, self.dt, f_a)
-            next_states.append(uav.state)
-
-        # print(states_desired, actions, next_states)
-        # publish the current clock
-        clock_message = Clock()
-        clock_message.clock = Time(seconds=self.time()).to_msg()
-        self.clock_publisher.publish(clock_message)
-
-        return next_states
+        # estimate F_a
+        f_a = self.neuralswarm.compute_Fa_batched(
+            self.cftypes + ['small'] * len(self.neighbors),
+            np.vstack((self.swarm.x[:, 0:6], self.neighbors)),
+            len(self.cftypes))
+        # convert grams to Newtons
+        f_a = f_a / 1000 * 9.81
+
+        rpm = np.array([action.rpm for action in actions], dtype=float).reshape(-1, 4)
+        self.swarm.step(rpm, self.dt, f_a)
+
+        return self.swarm.states
 
     def shutdown(self):
         pass
@@ -168,3 +227,23 @@ if __name__ == '__main__':
                         [('small', states[0]),
                         ('small', states[1]),
                         ('small', states[2])]))
+    print(ns.compute_Fa_batched(['small'] * 4, states.numpy())[3])
+
+    # benchmark: random swarms in a 1 x 1 x 1 m^3 volume
+    import time
+
+    rng = np.random.default_rng(0)
+    print('{:>6} {:>12} {:>12} {:>10}'.format('N', 'loop [ms]', 'batched', 'max error'))
+    for n in [2, 10, 50, 200]:
+        x = np.hstack((rng.uniform(0, 1, (n, 3)), rng.uniform(-0.5, 0.5, (n, 3))))
+        data = [('small', torch.tensor(x[k])) for k in range(n)]
+        start = time.perf_counter()
+        with torch.no_grad():
+            f_loop = np.array([ns.compute_Fa(data[k], data[0:k] + data[k+1:])
+                               for k in range(n)])
+        t_loop = time.perf_counter() - start
+        start = time.perf_counter()
+        f_batched = ns.compute_Fa_batched(['small'] * n, x)
+        t_batched = time.perf_counter() - start
+        print('{:>6} {:>12.2f} {:>12.2f} {:>10.2e}'.format(
+            n, t_loop * 1e3, t_batched * 1e3, np.max(np.abs(f_loop - f_batched))))
@@ -1,8 +1,6 @@
 from __future__ import annotations
 
 from rclpy.node import Node
-from rclpy.time import Time
-from rosgraph_msgs.msg import Clock
 
 from ..sim_data_types import Action, State
 
@@ -13,7 +11,6 @@ class Backend:
     def __init__(self, node: Node, names: list[str], states: list[State]):
         self.node = node
         self.names = names
-        self.clock_publisher = node.create_publisher(Clock, 'clock', 10)
         self.t = 0
         self.dt = 0.1
 
@@ -24,11 +21,6 @@ class Backend:
         # advance the time
         self.t += self.dt
 
-        # publish the current clock
-        clock_message = Clock()
-        clock_message.clock = Time(seconds=self.time()).to_msg()
-        self.clock_publisher.publish(clock_message)
-
         # pretend we were able to follow desired states perfectly
         return states_desired
 
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import numpy as np
+from rclpy.node import Node
+import rowan
+
+from ..sim_data_types import Action, State
+
+
+class Backend:
+    """Backend that integrates the rigid-body dynamics of all robots at once (numpy)."""
+
+    def __init__(self, node: Node, names: list[str], states: list[State]):
+        self.node = node
+        self.names = names
+        self.t = 0
+        self.dt = 0.0005
+
+        self.swarm = QuadrotorSwarm(states)
+
+    def time(self) -> float:
+        return self.t
+
+    def step(self, states_desired: list[State], actions: list[Action]) -> list[State]:
+        # advance the time
+        self.t += self.dt
+
+        rpm = np.array([action.rpm for action in actions], dtype=float).reshape(-1, 4)
+        self.swarm.step(rpm, self.dt)
+
+        return self.swarm.states
+
+    def shutdown(self):
+        pass
+
+
+# convert RPM -> Force
+def rpm_to_force(rpm):
+    # polyfit using data and scripts from https://github.com/IMRCLab/crazyflie-system-id
+    p = [2.55077341e-08, -4.92422570e-05, -1.51910248e-01]
+    force_in_grams = np.polyval(p, rpm)
+    force_in_newton = force_in_grams * 9.81 / 1000.0
+    return np.maximum(force_in_newton, 0)
+
+
+class QuadrotorSwarm:
+    """
+    Rigid body quadrotor model (no drag) for N robots, vectorized over robots.
+
+    Same dynamics as Quadrotor in np.py. The state of all robots is stored in a
+    single (N, 13) array (pos, vel, quat, omega per row). The returned State objects
+    are views into the rows of that array and are updated in place by step().
+    """
+
+    def __init__(self, states: list[State]):
+        # parameters (Crazyflie 2.0 quadrotor)
+        self.mass = 0.034  # kg
+        self.J = np.array([16.571710e-6, 16.655602e-6, 29.261652e-6])
+        self.inv_J = 1 / self.J
+
+        # Note: we assume here that our control is forces
+        arm_length = 0.046  # m
+        arm = 0.707106781 * arm_length
+        t2t = 0.006  # thrust-to-torque ratio
+        self.B0 = np.array([
+            [1, 1, 1, 1],
+            [-arm, -arm, arm, arm],
+            [-arm, arm, arm, -arm],
+            [-t2t, t2t, -t2t, t2t]
+            ])
+        self.g = 9.81  # not signed
+
+        self.x = np.empty((len(states), 13))
+        self.states = []
+        for k, state in enumerate(states):
+            self.x[k] = np.concatenate((state.pos, state.vel, state.quat, state.omega))
+            self.states.append(State.from_array(self.x[k]))
+
+    def step(self, rpm: np.ndarray, dt: float, f_a: np.ndarray | None = None):
+        """
+        Integrate the dynamics of all robots for one time step.
+
+        Args:
+            rpm (array float[N, 4]): Motor speeds of all robots [rpm].
+            dt (float): Time step [s].
+            f_a (array float[N, 3]): Optional external forces [N; world frame].
+
+        """
+        pos = self.x[:, 0:3]
+        vel = self.x[:, 3:6]
+        quat = self.x[:, 6:10]
+        omega = self.x[:, 10:13]
+
+        force = rpm_to_force(rpm)
+
+        # compute next state
+        eta = force @ self.B0.T
+        f_u = np.zeros((len(self.x), 3))
+        f_u[:, 2] = eta[:, 0]
+        tau_u = eta[:, 1:4]
+
+        # dynamics
+        # dot{p} = v
+        pos_next = pos + vel * dt
+        # mv = mg + R f_u + f_a
+        f = rowan.rotate(quat, f_u)
+        if f_a is not None:
+            f += f_a
+        vel_next = vel + (np.array([0, 0, -self.g]) + f / self.mass) * dt
+
+        # dot{R} = R S(w), see np.py for references
+        omega_global = rowan.rotate(quat, omega)
+        q_next = rowan.normalize(
+            rowan.calculus.integrate(quat, omega_global, dt))
+
+        # mJ = Jw x w + tau_u
+        omega_next = omega + (
+            self.inv_J * (np.cross(self.J * omega, omega) + tau_u)) * dt
+
+        self.x[:, 0:3] = pos_next
+        self.x[:, 3:6] = vel_next
+        self.x[:, 6:10] = q_next
+        self.x[:, 10:13] = omega_next
+
+        # if we fall below the ground, set velocities to 0
+        below = self.x[:, 2] < 0
+        self.x[below, 2] = 0
+        self.x[below, 3:6] = 0
+        self.x[below, 10:13] = 0
+
+
+if __name__ == '__main__':
+    # benchmark: simulated steps per second vs. swarm size
+    import time
+
+    from .np import Quadrotor
+
+    hover_rpm = 14000
+    duration = 1.0  # s (wall time per measurement)
+    dt = 0.0005
+
+    print('{:>6} {:>14} {:>14} {:>8}'.format('N', 'np [steps/s]', 'batched', 'speedup'))
+    for n in [1, 10, 50, 100, 500, 1000]:
+        initial_states = [State([0.1 * k, 0, 0.5]) for k in range(n)]
+        actions = [Action(np.full(4, hover_rpm, dtype=float)) for _ in range(n)]
+        rates = []
+
+        uavs = [Quadrotor(State(s.pos)) for s in initial_states]
+        steps = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            for uav, action in zip(uavs, actions):
+                uav.step(action, dt)
+            steps += 1
+        rates.append(steps / (time.perf_counter() - start))
+
+        swarm = QuadrotorSwarm(initial_states)
+        rpm = np.array([action.rpm for action in actions])
+        steps = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            swarm.step(rpm, dt)
+            steps += 1
+        rates.append(steps / (time.perf_counter() - start))
+
+        print('{:>6} {:>14.0f} {:>14.0f} {:>7.1f}x'.format(
+            n, rates[0], rates[1], rates[1] / rates[0]))
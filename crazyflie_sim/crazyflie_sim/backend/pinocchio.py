@@ -3,8 +3,6 @@ from pathlib import Path
 import numpy as np
 import pinocchio as pin
 from rclpy.node import Node
-from rclpy.time import Time
-from rosgraph_msgs.msg import Clock
 
 from ..sim_data_types import Action, State
 
@@ -15,7 +13,6 @@ class Backend:
     def __init__(self, node: Node, names: list[str], states: list[State]):
         self.node = node
         self.names = names
-        self.clock_publisher = node.create_publisher(Clock, 'clock', 10)
         self.t = 0
         self.dt = 0.0005
 
@@ -37,12 +34,6 @@ class Backend:
             uav.step(action, self.dt)
             next_states.append(uav.state)
 
-        # print(states_desired, actions, next_states)
-        # publish the current clock
-        clock_message = Clock()
-        clock_message.clock = Time(seconds=self.time()).to_msg()
-        self.clock_publisher.publish(clock_message)
-
         return next_states
 
     def shutdown(self):
@@ -7,15 +7,19 @@ A crazyflie server for simulation.
     2025 - Updated by Kimberly N. McGuire (Independent)
 """
 
+import array
 from functools import partial
 import importlib
 
-from crazyflie_interfaces.msg import FullState, Hover
+from crazyflie_interfaces.msg import FullState, FullStateArray, Hover, SwarmState
 from crazyflie_interfaces.srv import GoTo, Land, Takeoff
 from crazyflie_interfaces.srv import NotifySetpointsStop, StartTrajectory, UploadTrajectory
 from geometry_msgs.msg import Twist
+import numpy as np
 import rclpy
 from rclpy.node import Node
+from rclpy.time import Time
+from rosgraph_msgs.msg import Clock
 import rowan
 from std_msgs.msg import String
 from std_srvs.srv import Empty
@@ -24,7 +28,9 @@ from std_srvs.srv import Empty
 # import BackendRviz from .backend_rviz
 # from .backend import *
 # from .backend.none import BackendNone
-from .crazyflie_sil import CrazyflieSIL, TrajectoryPolynomialPiece
+from .crazyflie_sil import CrazyflieSIL, CrazyflieSILSwarm, Decimator
+from .crazyflie_sil import TrajectoryPolynomialPiece
+from .sharding import ShardedSimulation
 from .sim_data_types import State
 
 
@@ -84,13 +90,26 @@ class CrazyflieServer(Node):
                             pass
                     reference_frames.append(reference_frame)
 
-        # initialize backend by dynamically loading the module
         backend_name = self._ros_parameters['sim']['backend']
-        module = importlib.import_module(
-            '.backend.' + backend_name, package='crazyflie_sim'
-        )
-        class_ = getattr(module, 'Backend')
-        self.backend = class_(self, names, initial_states)
+        controller_name = self._ros_parameters['sim']['controller']
+        rates = self._ros_parameters['sim'].get('rates', {})
+        num_workers = self._ros_parameters['sim'].get('workers', 1)
+
+        if num_workers > 1 and names:
+            # firmware and physics of the robots run in worker processes
+            self.shards = ShardedSimulation(
+                names, initial_states, backend_name, controller_name,
+                rates.get('controller', 0), rates.get('clock', 0), num_workers)
+            self.backend = self.shards
+            self.cfs = self.shards.cfs
+        else:
+            self.shards = None
+            # initialize backend by dynamically loading the module
+            module = importlib.import_module(
+                '.backend.' + backend_name, package='crazyflie_sim'
+            )
+            class_ = getattr(module, 'Backend')
+            self.backend = class_(self, names, initial_states)
 
         # initialize visualizations by dynamically loading the modules
         self.visualizations = []
@@ -118,15 +137,39 @@ class CrazyflieServer(Node):
                     )
                 self.visualizations.append(vis)
 
-        controller_name = backend_name = self._ros_parameters['sim']['controller']
-
-        # create robot SIL objects
-        for name, initial_state in zip(names, initial_states):
-            self.cfs[name] = CrazyflieSIL(
-                name,
-                initial_state.pos,
-                controller_name,
-                self.backend.time)
+        if self.shards is None:
+            # create robot SIL objects
+            for name, initial_state in zip(names, initial_states):
+                self.cfs[name] = CrazyflieSIL(
+                    name,
+                    initial_state.pos,
+                    controller_name,
+                    self.backend.time)
+            # steps the firmware of all robots at once
+            self.sil = CrazyflieSILSwarm(list(self.cfs.values()), self.backend.time)
+        self.states = initial_states
+        self.states_desired = initial_states
+        self.actions = None
+
+        # Physics runs at the native rate of the backend (backend.dt). The firmware
+        # (planner and controller) as well as the outputs to ROS are decimated to
+        # their own rates, given in Hz w.r.t. the simulation time.
+        self.controller_due = Decimator(rates.get('controller', 0))
+        self.clock_due = Decimator(rates.get('clock', 0))
+        self.visualization_due = Decimator(rates.get('visualization', 0))
+        self.clock_publisher = self.create_publisher(Clock, 'clock', 10)
+
+        # optionally, the states of all robots in one message
+        swarm_state = self._ros_parameters.get('swarm_state', {})
+        self.swarm_state_due = None
+        if swarm_state.get('enabled', False):
+            self.swarm_state_due = Decimator(swarm_state.get('frequency', 10.0))
+            self.swarm_state_publisher = self.create_publisher(SwarmState, 'all/swarm_state', 1)
+            self.swarm_state_msg = SwarmState()
+            self.swarm_state_msg.header.frame_id = world_tf_name
+            self.swarm_state_msg.names = list(self.cfs.keys())
+            # the simulation has no supervisor
+            self.swarm_state_msg.supervisor_info = array.array('H', bytes(2 * len(self.cfs)))
 
         for name, _ in self.cfs.items():
             pub = self.create_publisher(
@@ -201,13 +244,24 @@ class CrazyflieServer(Node):
         self.create_service(StartTrajectory,
                             'all/start_trajectory',
                             self._start_trajectory_callback)
+        self.create_subscription(
+            FullStateArray,
+            'all/cmd_full_state_array',
+            self._cmd_full_state_array_changed,
+            10
+        )
 
         # This is the last service to announce.
         # Can be used to check if the server is fully available.
         self.create_service(Empty, 'all/emergency', self._emergency_callback)
 
+        # In lockstep mode, each timer callback advances the simulation by one full /clock
+        # period, so services and topics are only handled between two clock ticks. The
+        # timer is not limited, i.e., the simulation runs as fast as the CPU allows.
+        self.lockstep = self._ros_parameters['sim'].get('lockstep', False)
+
         # step as fast as possible
-        max_dt = 0.0 if 'max_dt' not in self._ros_parameters['sim'] \
+        max_dt = 0.0 if 'max_dt' not in self._ros_parameters['sim'] or self.lockstep \
             else self._ros_parameters['sim']['max_dt']
         self.timer = self.create_timer(max_dt, self._timer_callback)
         self.is_shutdown = False
@@ -221,21 +275,65 @@ class CrazyflieServer(Node):
             self.is_shutdown = True
 
     def _timer_callback(self):
-        # update setpoint
-        states_desired = [cf.getSetpoint() for _, cf in self.cfs.items()]
-
-        # execute the control loop
-        actions = [cf.executeController() for _, cf in self.cfs.items()]
+        if self.shards is not None:
+            # the workers always advance by one /clock period
+            self.states, self.states_desired, self.actions = self.shards.step()
+            self._publish(self.backend.time())
+        elif self.lockstep:
+            while not self._step():
+                pass
+        else:
+            self._step()
+
+    def _step(self):
+        """Execute one physics step and return True if /clock was published."""
+        if self.controller_due(self.backend.time()):
+            # update the state estimate of the firmware
+            self.sil.setStates(self.states)
+
+            # update setpoint
+            self.states_desired = self.sil.getSetpoints()
+
+            # execute the control loop
+            self.actions = self.sil.executeControllers()
 
         # execute the physics simulator
-        states_next = self.backend.step(states_desired, actions)
-
-        # update the resulting state
-        for state, (_, cf) in zip(states_next, self.cfs.items()):
-            cf.setState(state)
-
-        for vis in self.visualizations:
-            vis.step(self.backend.time(), states_next, states_desired, actions)
+        self.states = self.backend.step(self.states_desired, self.actions)
+
+        return self._publish(self.backend.time())
+
+    def _publish(self, t):
+        """Update the visualizations and /clock if due; return True if /clock was published."""
+        if self.visualization_due(t):
+            for vis in self.visualizations:
+                vis.step(t, self.states, self.states_desired, self.actions)
+
+        if self.swarm_state_due is not None and self.swarm_state_due(t):
+            self._publish_swarm_state(t)
+
+        if self.clock_due(t):
+            # publish the current clock
+            clock_message = Clock()
+            clock_message.clock = Time(seconds=t).to_msg()
+            self.clock_publisher.publish(clock_message)
+            return True
+        return False
+
+    def _publish_swarm_state(self, t):
+        """Publish the states of all robots in one message, see SwarmState for the columns."""
+        states = np.empty((len(self.states), SwarmState.NUM_COLUMNS))
+        states[:, 0:3] = [state.pos for state in self.states]
+        # rowan quaternions are (w, x, y, z)
+        quats = np.array([state.quat for state in self.states])
+        states[:, 3:6] = quats[:, 1:4]
+        states[:, 6] = quats[:, 0]
+        states[:, 7:10] = [state.vel for state in self.states]
+
+        msg = self.swarm_state_msg
+        msg.header.stamp = Time(seconds=t).to_msg()
+        # array.array is assigned without per-element checks
+        msg.states = array.array('d', states.tobytes())
+        self.swarm_state_publisher.publish(msg)
 
     def _param_to_dict(self, param_ros):
         """Turn ROS 2 parameters from the node into a dict."""
@@ -393,6 +491,18 @@ class CrazyflieServer(Node):
             rpy[2],
             [msg.twist.angular.x, msg.twist.angular.y, msg.twist.angular.z])
 
+    def _cmd_full_state_array_changed(self, msg):
+        states = np.frombuffer(msg.states, dtype=np.float64)
+        if len(states) != len(msg.names) * FullStateArray.NUM_COLUMNS:
+            self.get_logger().warn('Ignoring cmd_full_state_array with {} names and {} values'
+                                   .format(len(msg.names), len(states)))
+            return
+        states = states.reshape(-1, FullStateArray.NUM_COLUMNS)
+        for name, state in zip(msg.names, states):
+            if name in self.cfs:
+                self.cfs[name].cmdFullState(
+                    state[0:3], state[3:6], state[6:9], state[9], state[10:13])
+
 
 def main(args=None):
 
@@ -28,6 +28,59 @@ def copy_svec(v):
     return firm.mkvec(v.x, v.y, v.z)
 
 
+def pwm_to_rpm(pwm):
+    # polyfit using data and scripts from https://github.com/IMRCLab/crazyflie-system-id
+    p = [3.26535711e-01, 3.37495115e+03]
+    return np.where(pwm < 10000, 0, np.polyval(p, pwm))
+
+
+def pwm_to_force(pwm):
+    # polyfit using data and scripts from https://github.com/IMRCLab/crazyflie-system-id
+    p = [1.71479058e-09,  8.80284482e-05, -2.21152097e-01]
+    force_in_grams = np.polyval(p, pwm)
+    force_in_newton = force_in_grams * 9.81 / 1000.0
+    return np.maximum(force_in_newton, 0)
+
+
+def flat_to_quat(acc, yaw):
+    """
+    Compute the attitude from acceleration and yaw based on differential flatness.
+
+    Works on a single robot (acc float[3], yaw float) or on several robots at
+    once (acc float[N, 3], yaw float[N]). Yaw is in radians.
+    """
+    thrust = acc + np.array([0, 0, 9.81])
+    z_body = thrust / np.linalg.norm(thrust, axis=-1, keepdims=True)
+    x_world = np.stack([np.cos(yaw), np.sin(yaw), np.zeros_like(yaw)], axis=-1)
+    y_body = np.cross(z_body, x_world)
+    # Mathematically not needed. This addresses numerical issues to ensure R is orthogonal
+    y_body /= np.linalg.norm(y_body, axis=-1, keepdims=True)
+    x_body = np.cross(y_body, z_body)
+    # Mathematically not needed. This addresses numerical issues to ensure R is orthogonal
+    x_body /= np.linalg.norm(x_body, axis=-1, keepdims=True)
+    R = np.stack([x_body, y_body, z_body], axis=-1)
+    return rowan.from_matrix(R)
+
+
+class Decimator:
+    """Triggers at a fixed rate w.r.t. the simulation time (rate 0: trigger on every call)."""
+
+    def __init__(self, rate: float):
+        self.period = 1.0 / rate if rate > 0 else 0.0
+        self.next_t = None
+
+    def __call__(self, t: float) -> bool:
+        # small tolerance, since t is accumulated from floating point time steps
+        if self.next_t is not None and t < self.next_t - 1e-9:
+            return False
+        if self.next_t is None or t >= self.next_t + self.period:
+            # first call or we fell behind: re-synchronize
+            self.next_t = t + self.period
+        else:
+            self.next_t += self.period
+        return True
+
+
 class CrazyflieSIL:
 
     # Flight modes.
@@ -233,6 +286,32 @@ class CrazyflieSIL:
     #     pass
 
     def getSetpoint(self):
+        self._updateSetpoint()
+        return self._fwsetpoint_to_sim_data_types_state(self.setpoint)
+
+    def setState(self, state: sim_data_types.State):
+        rpy = np.degrees(rowan.to_euler(state.quat, convention='xyz'))
+        self._setFwState(
+            state.pos, state.vel, rpy, state.quat, np.degrees(state.omega))
+
+    def executeController(self):
+        if self.controller is None:
+            return None
+
+        if self.mode == CrazyflieSIL.MODE_IDLE:
+            return sim_data_types.Action([0, 0, 0, 0])
+
+        time_in_seconds = self.time_func()
+        # ticks is essentially the time in milliseconds as an integer
+        tick = int(time_in_seconds * 1000)
+        self._runController(tick)
+        return self._fwcontrol_to_sim_data_types_action()
+
+    # 'private' methods
+    def _isGroup(self, groupMask):
+        return groupMask == 0 or (self.groupMask & groupMask) > 0
+
+    def _updateSetpoint(self):
         if self.mode == CrazyflieSIL.MODE_HIGH_POLY:
             # See logic in crtp_commander_high_level.c
             ev = firm.plan_current_goal(self.planner, self.time_func())
@@ -262,57 +341,34 @@ class CrazyflieSIL:
                 self.cmdHl_vel = copy_svec(ev.vel)
                 self.cmdHl_yaw = ev.yaw
 
-        return self._fwsetpoint_to_sim_data_types_state(self.setpoint)
-
-        # # else:
-        #     # return self._fwstate_to_sim_data_types_state(self.setState)
-        # setState = firm.traj_eval(self.setState)
-        # if not firm.is_traj_eval_valid(setState):
-        #     return self._fwstate_to_sim_data_types_state(self.state)
-
-        # if self.mode == CrazyflieSIL.MODE_IDLE:
-        #     return self._fwstate_to_sim_data_types_state(self.state)
-
-        # self.state = setState
-        # return self._fwstate_to_sim_data_types_state(setState)
+    def _setFwState(self, pos, vel, rpy, quat, gyro):
+        # rpy and gyro are in degrees
+        self.state.position.x = pos[0]
+        self.state.position.y = pos[1]
+        self.state.position.z = pos[2]
 
-    def setState(self, state: sim_data_types.State):
-        self.state.position.x = state.pos[0]
-        self.state.position.y = state.pos[1]
-        self.state.position.z = state.pos[2]
-
-        self.state.velocity.x = state.vel[0]
-        self.state.velocity.y = state.vel[1]
-        self.state.velocity.z = state.vel[2]
+        self.state.velocity.x = vel[0]
+        self.state.velocity.y = vel[1]
+        self.state.velocity.z = vel[2]
 
-        rpy = np.degrees(rowan.to_euler(state.quat, convention='xyz'))
         # Note, legacy coordinate system, so invert pitch
         self.state.attitude.roll = rpy[0]
         self.state.attitude.pitch = -rpy[1]
         self.state.attitude.yaw = rpy[2]
 
-        self.state.attitudeQuaternion.w = state.quat[0]
-        self.state.attitudeQuaternion.x = state.quat[1]
-        self.state.attitudeQuaternion.y = state.quat[2]
-        self.state.attitudeQuaternion.z = state.quat[3]
+        self.state.attitudeQuaternion.w = quat[0]
+        self.state.attitudeQuaternion.x = quat[1]
+        self.state.attitudeQuaternion.y = quat[2]
+        self.state.attitudeQuaternion.z = quat[3]
 
         # omega is part of sensors, not of the state
-        self.sensors.gyro.x = np.degrees(state.omega[0])
-        self.sensors.gyro.y = np.degrees(state.omega[1])
-        self.sensors.gyro.z = np.degrees(state.omega[2])
+        self.sensors.gyro.x = gyro[0]
+        self.sensors.gyro.y = gyro[1]
+        self.sensors.gyro.z = gyro[2]
 
         # TODO: state technically also has acceleration, but sim_data_types does not
 
-    def executeController(self):
-        if self.controller is None:
-            return None
-
-        if self.mode == CrazyflieSIL.MODE_IDLE:
-            return sim_data_types.Action([0, 0, 0, 0])
-
-        time_in_seconds = self.time_func()
-        # ticks is essentially the time in milliseconds as an integer
-        tick = int(time_in_seconds * 1000)
+    def _runController(self, tick):
         if self.controller_name != 'mellinger':
             self.controller(self.control, self.setpoint, self.sensors, self.state, tick)
         else:
@@ -323,38 +379,15 @@ class CrazyflieSIL:
                 self.sensors,
                 self.state,
                 tick)
-        return self._fwcontrol_to_sim_data_types_action()
-
-    # 'private' methods
-    def _isGroup(self, groupMask):
-        return groupMask == 0 or (self.groupMask & groupMask) > 0
-
-    def _fwcontrol_to_sim_data_types_action(self):
 
         firm.powerDistribution(self.control, self.motors_thrust_uncapped)
         firm.powerDistributionCap(self.motors_thrust_uncapped, self.motors_thrust_pwm)
 
+    def _fwcontrol_to_sim_data_types_action(self):
         # self.motors_thrust_pwm.motors.m{1,4} contain the PWM
-        # convert PWM -> RPM
-        def pwm_to_rpm(pwm):
-            # polyfit using data and scripts from https://github.com/IMRCLab/crazyflie-system-id
-            if pwm < 10000:
-                return 0
-            p = [3.26535711e-01, 3.37495115e+03]
-            return np.polyval(p, pwm)
-
-        def pwm_to_force(pwm):
-            # polyfit using data and scripts from https://github.com/IMRCLab/crazyflie-system-id
-            p = [1.71479058e-09,  8.80284482e-05, -2.21152097e-01]
-            force_in_grams = np.polyval(p, pwm)
-            force_in_newton = force_in_grams * 9.81 / 1000.0
-            return np.maximum(force_in_newton, 0)
-
+        motors = self.motors_thrust_pwm.motors
         return sim_data_types.Action(
-            [pwm_to_rpm(self.motors_thrust_pwm.motors.m1),
-             pwm_to_rpm(self.motors_thrust_pwm.motors.m2),
-             pwm_to_rpm(self.motors_thrust_pwm.motors.m3),
-             pwm_to_rpm(self.motors_thrust_pwm.motors.m4)])
+            pwm_to_rpm(np.array([motors.m1, motors.m2, motors.m3, motors.m4])))
 
     @staticmethod
     def _fwsetpoint_to_sim_data_types_state(fwsetpoint):
@@ -371,19 +404,90 @@ class CrazyflieSIL:
 
         if fwsetpoint.mode.quat == firm.modeDisable:
             # compute rotation based on differential flatness
-            thrust = acc + np.array([0, 0, 9.81])
-            z_body = thrust / np.linalg.norm(thrust)
-            yaw = np.radians(fwsetpoint.attitude.yaw)
-            x_world = np.array([np.cos(yaw), np.sin(yaw), 0])
-            y_body = np.cross(z_body, x_world)
-            # Mathematically not needed. This addresses numerical issues to ensure R is orthogonal
-            y_body /= np.linalg.norm(y_body)
-            x_body = np.cross(y_body, z_body)
-            # Mathematically not needed. This addresses numerical issues to ensure R is orthogonal
-            x_body /= np.linalg.norm(x_body)
-            R = np.column_stack([x_body, y_body, z_body])
-            quat = rowan.from_matrix(R)
+            quat = flat_to_quat(acc, np.radians(fwsetpoint.attitude.yaw))
         else:
-            quat = fwsetpoint.attitudeQuaternion
+            q = fwsetpoint.attitudeQuaternion
+            quat = np.array([q.w, q.x, q.y, q.z])
 
         return sim_data_types.State(pos, vel, quat, omega)
+
+
+class CrazyflieSILSwarm:
+    """
+    Steps the firmware of several CrazyflieSIL instances in one pass.
+
+    Setpoints, states, and motor commands of all robots are kept in numpy
+    buffers, so that all unit conversions, the differential-flatness attitude
+    computation, and the PWM to RPM mapping are evaluated once for the whole
+    swarm rather than once per robot. Only the planner, controller, and raw
+    firmware struct accesses remain per robot.
+    """
+
+    def __init__(self, cfs: list[CrazyflieSIL], time_func):
+        self.cfs = cfs
+        self.time_func = time_func
+        n = len(cfs)
+
+        # pos (3), vel (3), acc (3), yaw (1) [deg], attitudeRate (3) [deg/s]
+        self._setpoints = np.zeros((n, 13))
+        # setpoints as sim_data_types.State (pos, vel, quat, omega)
+        self._states_desired = np.zeros((n, 13))
+        self._states_desired[:, 6] = 1
+        self.states_desired = [
+            sim_data_types.State.from_array(row) for row in self._states_desired]
+
+        # motor commands
+        self._pwm = np.zeros((n, 4))
+        self._rpm = np.zeros((n, 4))
+        self._actions = [sim_data_types.Action(row) for row in self._rpm]
+
+    def getSetpoints(self) -> list[sim_data_types.State]:
+        explicit_quat = []
+        for k, cf in enumerate(self.cfs):
+            cf._updateSetpoint()
+            sp = cf.setpoint
+            pos, vel, acc = sp.position, sp.velocity, sp.acceleration
+            rate = sp.attitudeRate
+            self._setpoints[k] = (
+                pos.x, pos.y, pos.z,
+                vel.x, vel.y, vel.z,
+                acc.x, acc.y, acc.z,
+                sp.attitude.yaw,
+                rate.roll, rate.pitch, rate.yaw)
+            if sp.mode.quat != firm.modeDisable:
+                q = sp.attitudeQuaternion
+                explicit_quat.append((k, (q.w, q.x, q.y, q.z)))
+
+        self._states_desired[:, 0:6] = self._setpoints[:, 0:6]
+        self._states_desired[:, 6:10] = flat_to_quat(
+            self._setpoints[:, 6:9], np.radians(self._setpoints[:, 9]))
+        self._states_desired[:, 10:13] = np.radians(self._setpoints[:, 10:13])
+        for k, q in explicit_quat:
+            self._states_desired[k, 6:10] = q
+
+        return self.states_desired
+
+    def executeControllers(self) -> list[sim_data_types.Action]:
+        # ticks is essentially the time in milliseconds as an integer
+        tick = int(self.time_func() * 1000)
+        active = np.zeros(len(self.cfs), dtype=bool)
+        for k, cf in enumerate(self.cfs):
+            if cf.controller is None or cf.mode == CrazyflieSIL.MODE_IDLE:
+                continue
+            cf._runController(tick)
+            motors = cf.motors_thrust_pwm.motors
+            self._pwm[k] = (motors.m1, motors.m2, motors.m3, motors.m4)
+            active[k] = True
+
+        self._rpm[:] = np.where(active[:, None], pwm_to_rpm(self._pwm), 0)
+
+        return [None if cf.controller is None else action
+                for cf, action in zip(self.cfs, self._actions)]
+
+    def setStates(self, states: list[sim_data_types.State]):
+        x = np.array([state._state for state in states]).reshape(-1, 13)
+        rpy = np.degrees(rowan.to_euler(x[:, 6:10], convention='xyz'))
+        gyro = np.degrees(x[:, 10:13])
+        for cf, row, rpy_row, gyro_row in zip(
+                self.cfs, x.tolist(), rpy.tolist(), gyro.tolist()):
+            cf._setFwState(row[0:3], row[3:6], rpy_row, row[6:10], gyro_row)
@@ -0,0 +1,217 @@
+"""
+Sharded simulation that distributes the robots over several worker processes.
+
+Each worker owns a contiguous slice of the robots: their CrazyflieSIL objects
+(firmware) and an instance of the physics backend. The coordinator (the sim
+server) advances all workers in lockstep by a fixed number of physics steps per
+synchronization and exchanges the resulting states through shared memory.
+Calls to the firmware of a robot (takeoff, goTo, ...) are forwarded to the
+worker that owns it.
+
+For backends that model interactions between robots (i.e., backends that
+implement set_neighbor_states), each worker receives the states of all robots
+of the other workers at the beginning of each synchronization. Within one
+synchronization period, those neighbor states are held constant.
+"""
+
+from functools import partial
+import importlib
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import traceback
+
+import numpy as np
+
+from .crazyflie_sil import CrazyflieSIL, CrazyflieSILSwarm, Decimator
+from .sim_data_types import Action, State
+
+# columns per robot in the shared buffer: state (13), desired state (13), rpm (4)
+_STATE = slice(0, 13)
+_STATE_DESIRED = slice(13, 26)
+_RPM = slice(26, 30)
+_NUM_COLUMNS = 30
+
+# interval to check whether a worker is still alive while waiting for its reply [s]
+_POLL_INTERVAL = 1.0
+
+
+class CrazyflieSILProxy:
+    """Forwards the calls to a CrazyflieSIL object that lives in a worker process."""
+
+    def __init__(self, conn, name):
+        self._conn = conn
+        self._name = name
+
+    def __getattr__(self, method):
+        return partial(self._call, method)
+
+    def _call(self, method, *args):
+        self._conn.send(('call', self._name, method, args))
+
+
+class ShardedSimulation:
+    """
+    Coordinator for the worker processes of a sharded simulation.
+
+    Provides time() and shutdown() like a backend, and a step() that advances
+    the firmware and physics of all robots by one synchronization period.
+    """
+
+    def __init__(self, names: list[str], states: list[State], backend_name: str,
+                 controller_name: str, controller_rate: float, clock_rate: float,
+                 num_workers: int):
+        n = len(names)
+        if n == 0:
+            raise ValueError('ShardedSimulation needs at least one robot')
+        num_workers = max(1, min(num_workers, n))
+
+        # Double-buffered, so that workers can read the neighbor states of the
+        # previous synchronization while others already write the next one.
+        self._shm = SharedMemory(create=True, size=2 * n * _NUM_COLUMNS * 8)
+        self._buffers = np.ndarray((2, n, _NUM_COLUMNS), buffer=self._shm.buf)
+        for state, row in zip(states, self._buffers[1]):
+            row[_STATE] = state._state
+            row[_STATE_DESIRED] = state._state
+        self._buffers[0] = self._buffers[1]
+        self._sync = 0
+
+        # local copy that is handed to the visualizations
+        self._x = self._buffers[1].copy()
+        self.states = [State.from_array(row[_STATE]) for row in self._x]
+        self.states_desired = [State.from_array(row[_STATE_DESIRED]) for row in self._x]
+        if controller_name == 'none':
+            self.actions = [None] * n
+        else:
+            self.actions = [Action(row[_RPM]) for row in self._x]
+
+        # use spawn, since forking a process with an initialized ROS context is unsafe
+        ctx = multiprocessing.get_context('spawn')
+        self._workers = []
+        self.cfs = {}
+        for indices in np.array_split(np.arange(n), num_workers):
+            start, stop = int(indices[0]), int(indices[-1]) + 1
+            conn, worker_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker_main,
+                args=(worker_conn, self._shm.name, n, start, stop, names[start:stop],
+                      [state.pos.tolist() for state in states[start:stop]],
+                      backend_name, controller_name, controller_rate),
+                daemon=True)
+            process.start()
+            # only the worker holds this end, so that recv() fails if the worker exits
+            worker_conn.close()
+            self._workers.append((process, conn))
+            for name in names[start:stop]:
+                self.cfs[name] = CrazyflieSILProxy(conn, name)
+
+        # all workers use the same backend, i.e., the same dt
+        self.dt = [self._recv(process, conn) for process, conn in self._workers][0]
+        self.t = 0.0
+
+        # physics steps per synchronization: one /clock period
+        if clock_rate > 0:
+            self.steps_per_sync = max(1, round(1.0 / (clock_rate * self.dt)))
+        else:
+            self.steps_per_sync = 1
+
+    def time(self) -> float:
+        return self.t
+
+    def step(self):
+        """Advance all robots by one synchronization period (steps_per_sync physics steps)."""
+        self._sync += 1
+        for _, conn in self._workers:
+            conn.send(('step', self.steps_per_sync, self._sync % 2))
+        times = [self._recv(process, conn) for process, conn in self._workers]
+        self.t = times[0]
+        self._x[:] = self._buffers[self._sync % 2]
+        return self.states, self.states_desired, self.actions
+
+    def _recv(self, process, conn):
+        """Return the reply of a worker, raise RuntimeError if it failed or exited."""
+        while not conn.poll(_POLL_INTERVAL):
+            if not process.is_alive():
+                break
+        try:
+            status, value = conn.recv()
+        except EOFError:
+            process.join(timeout=_POLL_INTERVAL)
+            raise RuntimeError(
+                f'Simulation worker {process.name} exited (exit code {process.exitcode})')
+        if status == 'error':
+            raise RuntimeError(f'Simulation worker {process.name} failed:\n{value}')
+        return value
+
+    def shutdown(self):
+        for process, conn in self._workers:
+            try:
+                conn.send(('shutdown',))
+            except OSError:
+                pass  # the worker already exited
+        for process, conn in self._workers:
+            process.join(timeout=5.0)
+        self._workers = []
+        del self._buffers
+        self._shm.close()
+        self._shm.unlink()
+
+
+def _worker_main(conn, shm_name, n, start, stop, names, positions,
+                 backend_name, controller_name, controller_rate):
+    # send exceptions to the coordinator instead of exiting silently
+    try:
+        _worker_loop(conn, shm_name, n, start, stop, names, positions,
+                     backend_name, controller_name, controller_rate)
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+
+
+def _worker_loop(conn, shm_name, n, start, stop, names, positions,
+                 backend_name, controller_name, controller_rate):
+
+    shm = SharedMemory(name=shm_name)
+    buffers = np.ndarray((2, n, _NUM_COLUMNS), buffer=shm.buf)
+    others = np.r_[0:start, stop:n]
+
+    module = importlib.import_module('.backend.' + backend_name, package='crazyflie_sim')
+    states = [State(pos) for pos in positions]
+    backend = module.Backend(None, names, states)
+    coupled = hasattr(backend, 'set_neighbor_states')
+
+    cfs = {
+        name: CrazyflieSIL(name, pos, controller_name, backend.time)
+        for name, pos in zip(names, positions)}
+    sil = CrazyflieSILSwarm(list(cfs.values()), backend.time)
+    controller_due = Decimator(controller_rate)
+    states_desired = states
+    actions = None
+
+    conn.send(('ok', backend.dt))
+    while True:
+        msg = conn.recv()
+        if msg[0] == 'call':
+            _, name, method, args = msg
+            getattr(cfs[name], method)(*args)
+        elif msg[0] == 'step':
+            _, num_steps, buffer = msg
+            if coupled:
+                backend.set_neighbor_states(buffers[1 - buffer, others, 0:6])
+            for _ in range(num_steps):
+                if controller_due(backend.time()):
+                    sil.setStates(states)
+                    states_desired = sil.getSetpoints()
+                    actions = sil.executeControllers()
+                states = backend.step(states_desired, actions)
+
+            rows = buffers[buffer, start:stop]
+            rows[:, _STATE] = [state._state for state in states]
+            rows[:, _STATE_DESIRED] = [state._state for state in states_desired]
+            if actions is not None and actions[0] is not None:
+                rows[:, _RPM] = [action.rpm for action in actions]
+            conn.send(('ok', backend.time()))
+        elif msg[0] == 'shutdown':
+            backend.shutdown()
+            break
+
+    del buffers
+    shm.close()
@@ -13,6 +13,13 @@ class State:
         self.quat = quat
         self.omega = omega
 
+    @classmethod
+    def from_array(cls, array):
+        """Create a state that shares its memory with the given 13-dim array."""
+        state = cls.__new__(cls)
+        state._state = array
+        return state
+
     @property
     def pos(self):
         """Position [m; world frame]."""
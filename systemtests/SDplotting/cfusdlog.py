@@ -27,10 +27,26 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import argparse
+import mmap
 from zlib import crc32
 import struct
 import numpy as np
 
+# numpy types of the struct format characters: (type in the file, type of the decoded array)
+# The decoded types are those that np.array() infers from the values of struct.unpack.
+NUMPY_TYPES = {
+    'b': ('i1', np.int64), 'B': ('u1', np.int64),
+    'h': ('<i2', np.int64), 'H': ('<u2', np.int64),
+    'i': ('<i4', np.int64), 'I': ('<u4', np.int64),
+    'l': ('<i4', np.int64), 'L': ('<u4', np.int64),
+    'q': ('<i8', np.int64), 'Q': ('<u8', np.int64),
+    'e': ('<f2', np.float64), 'f': ('<f4', np.float64), 'd': ('<f8', np.float64),
+    '?': ('?', np.bool_), 'c': ('S1', 'S1'),
+}
+
+# bytes per chunk for the CRC and for decode_chunks
+CHUNK_SIZE = 1 << 24
+
 # extract null-terminated string
 def _get_name(data, idx):
     endIdx = idx
@@ -38,18 +54,16 @@ def _get_name(data, idx):
         endIdx = endIdx + 1
     return data[idx:endIdx].decode("utf-8"), endIdx + 1
 
-def decode(filename):
-    # read file as binary
-    with open(filename, 'rb') as f:
-        data = f.read()
-
+def _read_header(data):
     # check magic header
     if data[0] != 0xBC:
         print("Unsupported format!")
         return
 
-    # check CRC
-    crc = crc32(data[0:-4])
+    # check CRC, chunk by chunk to not copy the whole file
+    crc = 0
+    for start in range(0, len(data) - 4, CHUNK_SIZE):
+        crc = crc32(data[start:min(start + CHUNK_SIZE, len(data) - 4)], crc)
     expected_crc, = struct.unpack('I', data[-4:])
     if crc != expected_crc:
         print("WARNING: CRC does not match!")
@@ -60,7 +74,6 @@ def decode(filename):
         print("Unsupported version!", version)
         return
 
-    result = dict()
     event_by_id = dict()
 
     # read header with data types
@@ -69,51 +82,94 @@ def decode(filename):
         event_id, = struct.unpack('H', data[idx:idx+2])
         idx += 2
         event_name, idx = _get_name(data, idx)
-        result[event_name] = dict()
-        result[event_name]["timestamp"] = []
         num_variables, = struct.unpack('H', data[idx:idx+2])
         idx += 2
-        fmtStr = "<"
+        # records are the event id, the timestamp, and the variables
+        fields = [('event_id', '<u2'), ('timestamp', '<u4' if version == 1 else '<u8')]
         variables = []
         for _ in range(num_variables):
             var_name_and_type, idx = _get_name(data, idx)
             var_name = var_name_and_type[0:-3]
             var_type = var_name_and_type[-2]
-            result[event_name][var_name] = []
-            fmtStr += var_type
-            variables.append(var_name)
+            fields.append(('v{}'.format(len(variables)), NUMPY_TYPES[var_type][0]))
+            variables.append((var_name, NUMPY_TYPES[var_type][1]))
         event_by_id[event_id] = {
             'name': event_name,
-            'fmtStr': fmtStr,
-            'numBytes': struct.calcsize(fmtStr),
+            'dtype': np.dtype(fields),
             'variables': variables,
             }
 
-    while idx < len(data) - 4:
-        if version == 1:
-            event_id, timestamp, = struct.unpack('<HI', data[idx:idx+6])
-            idx += 6
-        elif version == 2:
-            event_id, timestamp, = struct.unpack('<HQ', data[idx:idx+10])
-            timestamp = timestamp / 1000.0
-            idx += 10
-        event = event_by_id[event_id]
-        fmtStr = event['fmtStr']
-        eventData = struct.unpack(fmtStr, data[idx:idx+event['numBytes']])
-        idx += event['numBytes']
-        for v,d in zip(event['variables'], eventData):
-            result[event['name']][v].append(d)
-        result[event['name']]["timestamp"].append(timestamp)
-
-    # remove keys that had no data
-    for event_name in list(result.keys()):
-        if len(result[event_name]['timestamp']) == 0:
-            del result[event_name]
-
-    # convert to numpy arrays
-    for event_name in result.keys():
-        for var_name in result[event_name]:
-            result[event_name][var_name] = np.array(result[event_name][var_name])
+    return version, event_by_id, idx
+
+def _decode_records(data, version, event_by_id, idx, chunk_size):
+    # Records have different sizes, so their boundaries can only be found one after
+    # another. This loop only reads the event ids; the records of each event type are
+    # then decoded at once from views of the file that start at every byte.
+    steps = {event_id: event['dtype'].itemsize for event_id, event in event_by_id.items()}
+    end = len(data) - 4
+
+    def view(dtype):
+        return np.ndarray(shape=(max(len(data) - dtype.itemsize + 1, 0),), dtype=dtype,
+                          buffer=data, strides=(1,))
+    event_ids = view(np.dtype('<u2'))
+    records_by_id = {event_id: view(event['dtype']) for event_id, event in event_by_id.items()}
+
+    while idx < end:
+        stop = min(idx + chunk_size, end)
+        starts = []
+        append = starts.append
+        while idx < stop:
+            append(idx)
+            idx += steps[data[idx] | (data[idx + 1] << 8)]
+        if idx > end:
+            raise ValueError("Incomplete record at the end of the log")
+
+        starts = np.array(starts, dtype=np.int64)
+        ids = event_ids[starts]
+        result = dict()
+        for event_id, event in event_by_id.items():
+            records = records_by_id[event_id][starts[ids == event_id]]
+            if len(records) == 0:
+                continue
+            timestamp = records['timestamp']
+            if version == 1:
+                timestamp = timestamp.astype(np.int64)
+            else:
+                timestamp = timestamp / 1000.0
+            decoded = {"timestamp": timestamp}
+            for k, (var_name, var_type) in enumerate(event['variables']):
+                decoded[var_name] = records['v{}'.format(k)].astype(var_type)
+            result[event['name']] = decoded
+        yield result
+
+def decode_chunks(filename, chunk_size=CHUNK_SIZE):
+    """
+    Decode a log file part by part, e.g., if it is larger than the memory.
+
+    Yields one dict in the format of decode() per chunk_size bytes of records.
+    Events without records in the part are omitted.
+    """
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header = _read_header(data)
+        if header is None:
+            return
+        yield from _decode_records(data, *header, chunk_size)
+
+def decode(filename):
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header = _read_header(data)
+        if header is None:
+            return
+        chunks = list(_decode_records(data, *header, CHUNK_SIZE))
+
+    # concatenate the chunks, with the events in the order of the header
+    result = dict()
+    for event in header[1].values():
+        parts = [chunk[event['name']] for chunk in chunks if event['name'] in chunk]
+        if len(parts) == 0:
+            continue
+        result[event['name']] = {
+            var_name: np.concatenate([part[var_name] for part in parts]) for var_name in parts[0]}
 
     return result
 
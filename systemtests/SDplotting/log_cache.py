@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Cache for decoded and processed uSD logs, such that reports can be regenerated
+without decoding the log and fitting the additional data again.
+
+Each entry is an uncompressed .npz file with one column per event and variable,
+named "<event>:<variable>". Entries are keyed by the hash of the log file and
+of the settings that change the processed data, so changing only the figure
+settings reuses the cache.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# bump if the processing changes in a way that invalidates the cached data
+CACHE_VERSION = 1
+
+# settings that are used by plot.process_data and plot.add_data
+DATA_SETTINGS = ["event_name", "convert_units", "start_time", "end_time", "additional_data"]
+
+SEPARATOR = ":"
+
+
+def cache_path(cache_dir, log_path, settings):
+    h = hashlib.sha256()
+    with open(log_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    relevant = {key: settings.get(key) for key in DATA_SETTINGS}
+    h.update(json.dumps([CACHE_VERSION, relevant], sort_keys=True, default=str).encode())
+    return os.path.join(cache_dir, "{}_{}.npz".format(os.path.basename(log_path), h.hexdigest()[:16]))
+
+
+def load(path):
+    if not os.path.exists(path):
+        return None
+
+    data = dict()
+    with np.load(path, allow_pickle=False) as f:
+        # the order of the files is the order in which they were stored
+        for column in f.files:
+            event, var = column.split(SEPARATOR, 1)
+            data.setdefault(event, dict())[var] = f[column]
+    return data
+
+
+def store(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    columns = {event + SEPARATOR + var: values
+               for event, variables in data.items() for var, values in variables.items()}
+    # write to a temporary file first, so that an interrupted run leaves no broken entry
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, path)
@@ -15,6 +15,7 @@ import numpy as np
 
 
 import SDplotting.data_helper
+import SDplotting.log_cache
 
 
 def file_guard(pdf_path):
@@ -105,19 +106,46 @@ def process_data(data, settings):
 
 def add_data(data, settings):
     event = settings["event_name"]
+    events = event if type(event) == list else [event]
     print("...adding data")
     
     for info in settings["additional_data"]:
         # print(f"found target: {info['target']}")
-        dict_new = data_helper.DataHelper.generate_data(data, event, info)
-        data[event].update(dict_new)
-        print(f">>> added data: {info['type']} -> {list(dict_new.keys())}")
+        # add the data to every event that has the source
+        for one_event in events:
+            if info.get("source") is not None and info["source"] not in data[one_event]:
+                continue
+            dict_new = SDplotting.data_helper.DataHelper.generate_data(data, one_event, info)
+            data[one_event].update(dict_new)
+            print(f">>> added data: {info['type']} -> {list(dict_new.keys())}")
         # print(f">>> data shape: {data_new.shape}")
 
     print("...done adding data")
 
 
-def create_figures(data_usd, settings, logfile=None, out=None, ros2_ws=None, experiment=None):
+def load_data(path, settings):
+    # decoding and fitting are slow, so the processed data is cached
+    cache_dir = settings.get("cache_dir", None)
+    cache_path = None
+    if cache_dir:
+        cache_path = SDplotting.log_cache.cache_path(cache_dir, path, settings)
+        data = SDplotting.log_cache.load(cache_path)
+        if data is not None:
+            print(f"...using cached data {cache_path}")
+            return data
+
+    data = SDplotting.cfusdlog.decode(path)
+    data = process_data(data, settings)
+    if settings.get("additional_data", None):
+        add_data(data, settings)
+
+    if cache_path is not None:
+        SDplotting.log_cache.store(cache_path, data)
+        print(f"...cached data in {cache_path}")
+    return data
+
+
+def create_figures(data_processed, settings, logfile=None, out=None, ros2_ws=None, experiment=None):
     debug_all = False
     debug = False
     debug_figure_number = 20 # Residual Torques
@@ -133,8 +161,6 @@ def create_figures(data_usd, settings, logfile=None, out=None, ros2_ws=None, exp
     
     print("log file: {}".format(log_path))
 
-    data_processed = process_data(data_usd, settings)
-
     # create a PDF to save the figures
     if out!= None:
         pdf_path = out
@@ -310,17 +336,17 @@ def plot_SD_data(logfile=None, output = None, experiment=None, ros2_ws = None):
         settings["data_file"] = experiment
         settings["info_file"] = "info_" + experiment + ".csv"
 
-    # decode binary log data
+    # decode and process binary log data
     if logfile != None :
         path = logfile
     else:   #choose default path given in settings.yaml
         path = os.path.join(settings["data_dir"], settings['data_file'])
     print(f"Processing {path}...")
-    data_usd = SDplotting.cfusdlog.decode(path)
+    data_processed = load_data(path, settings)
 
     # create the figures
     print("...creating figures")
-    create_figures(data_usd, settings, out=output, ros2_ws=ros2_ws, experiment=experiment)
+    create_figures(data_processed, settings, logfile=path, out=output, ros2_ws=ros2_ws, experiment=experiment)
     print("...done creating figures")
 
     
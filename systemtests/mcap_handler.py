@@ -3,13 +3,44 @@ from rclpy.serialization import deserialize_message
 from rosidl_runtime_py.utilities import get_message
 from std_msgs.msg import String
 import rosbag2_py
-import csv
+import numpy as np
+
+class CsvTrajectoryWriter:
+    '''Writes (t, x, y, z) rows to a .csv file, collected in a preallocated numpy array and written chunk by chunk'''
+    def __init__(self, outputfile:str, chunk_size:int):
+        self.f = open(outputfile, 'w+')
+        self.f.write("# t, x, y, z\n")
+        self.rows = np.empty((chunk_size, 4))
+        self.n = 0
+
+    def append(self, t, translation):
+        row = self.rows[self.n]
+        row[0] = t
+        row[1] = translation.x
+        row[2] = translation.y
+        row[3] = translation.z
+        self.n += 1
+        if self.n == len(self.rows):
+            self.flush()
+
+    def flush(self):
+        np.savetxt(self.f, self.rows[:self.n], fmt="%.17g", delimiter=",")
+        self.n = 0
+
+    def close(self, takeoff_time):
+        self.flush()
+        #write the "takeoff command" time as a comment on the last line
+        self.f.write(f"### takeoff time : {takeoff_time}\n")
+        self.f.close()
+
 
 class McapHandler:
     def __init__(self):
         self.takeoff_time = None
 
-    def read_messages(self, input_bag: str):
+    def read_messages(self, input_bag: str, topics:list = None):
+        '''Yields (topic, msg, timestamp) of all messages, or only of the given topics. The topics are filtered by the
+        storage, so other messages are neither read nor deserialized'''
         reader = rosbag2_py.SequentialReader()
         reader.open(
             rosbag2_py.StorageOptions(uri=input_bag, storage_id="mcap"),
@@ -17,56 +48,82 @@ class McapHandler:
                 input_serialization_format="cdr", output_serialization_format="cdr"
             ),
         )
-        topic_types = reader.get_all_topics_and_types()
-
-        def typename(topic_name):
-            for topic_type in topic_types:
-                if topic_type.name == topic_name:
-                    return topic_type.type
-            raise ValueError(f"topic {topic_name} not in bag")
+        if topics is not None:
+            reader.set_filter(rosbag2_py.StorageFilter(topics=topics))
+        typenames = {topic_type.name: topic_type.type for topic_type in reader.get_all_topics_and_types()}
+        msg_types = {}  # message class per topic
 
         while reader.has_next():
             topic, data, timestamp = reader.read_next()
-            msg_type = get_message(typename(topic))
+            msg_type = msg_types.get(topic)
+            if msg_type is None:
+                msg_type = msg_types[topic] = get_message(typenames[topic])
             msg = deserialize_message(data, msg_type)
             yield topic, msg, timestamp
         del reader
-    
-    def write_mcap_to_csv(self, inputbag:str, outputfile:str):
+
+    def convert(self, inputbag:str, output_for_frame, chunk_size:int = 4096):
+        '''Writes the /tf positions of each robot (i.e. child frame) to the .csv file given by output_for_frame(frame),
+        or skips the robot if that returns None. The time starts at 0.0 with the first transform in the bag, and
+        the takeoff time from /rosout is written as a comment on the last line'''
+        t_start_bag = None #this is the timestamp of the first transform we read in the bag (doesn't mean it's exactly the start time of the bag but close enough ?)
+        takeoff_stamp = None
+        writers = {}
+        for topic, msg, timestamp in self.read_messages(inputbag, topics=["/tf", "/rosout"]):
+            if topic == "/tf":
+                for transform in msg.transforms:
+                    stamp = transform.header.stamp.sec + transform.header.stamp.nanosec * 10**(-9)
+                    if t_start_bag is None:
+                        t_start_bag = stamp
+                    writer = writers.get(transform.child_frame_id)
+                    if writer is None:
+                        outputfile = output_for_frame(transform.child_frame_id)
+                        writer = CsvTrajectoryWriter(outputfile, chunk_size) if outputfile is not None else False
+                        writers[transform.child_frame_id] = writer
+                    if writer:
+                        writer.append(stamp - t_start_bag, transform.transform.translation)
+            if topic == "/rosout":
+                if msg.name == "crazyflie_server" and msg.function == "takeoff":
+                    takeoff_stamp = msg.stamp.sec + msg.stamp.nanosec * 10**(-9)
+                #the takeoff message in simulation has a sligthly different name than IRL, so we need this to record the sim takeoff time
+                #BUT for some unknown reason the sim tests seem to work perfectly without even recording takeoff and adjusting the offset
+                #so I will leave this commented here just in case the sim tests have to be worked on
+                # if msg.name == "crazyflie_server" and msg.function == "_takeoff_callback":
+                #     takeoff_stamp = msg.stamp.sec + msg.stamp.nanosec * 10**(-9)
+
+        if takeoff_stamp is not None and t_start_bag is not None:
+            self.takeoff_time = takeoff_stamp - t_start_bag
+        for writer in writers.values():
+            if writer:
+                writer.close(self.takeoff_time)
+        return [frame for frame, writer in writers.items() if writer]
+
+    def write_mcap_to_csv(self, inputbag:str, outputfile:str, frame:str = None):
         '''A method which translates an .mcap rosbag file format to a .csv file. 
         Also modifies the timestamp to start at 0.0 instead of the wall time.
-        Only written to translate the /tf topic but could easily be extended to other topics'''
-        t_start_bag = None #this is the timestamp of the first message we read in the bag (doesn't mean it's exactly the start time of the bag but close enough ?)
+        Only translates the positions of one robot (by default the first one in /tf) from the /tf topic'''
+        def output_for_frame(child_frame):
+            nonlocal frame
+            if frame is None:
+                frame = child_frame
+            return outputfile if child_frame == frame else None
+
         try:
             print("Translating .mcap to .csv")
-            f = open(outputfile, 'w+')
-            writer = csv.writer(f)
-            writer.writerow(["# t"," x"," y"," z"])
-            for topic, msg, timestamp in self.read_messages(inputbag):
-                if topic =="/tf":
-                    if t_start_bag == None:
-                        t_start_bag = msg.transforms[0].header.stamp.sec + msg.transforms[0].header.stamp.nanosec *10**(-9) 
-                    t = msg.transforms[0].header.stamp.sec + msg.transforms[0].header.stamp.nanosec *10**(-9) -t_start_bag
-                    writer.writerow([t, msg.transforms[0].transform.translation.x, msg.transforms[0].transform.translation.y, msg.transforms[0].transform.translation.z])
-                if topic == "/rosout":  #and t_start_bag != None :
-                    if msg.name == "crazyflie_server" and msg.function == "takeoff":
-                        t = msg.stamp.sec + msg.stamp.nanosec *10**(-9) - t_start_bag
-                        self.takeoff_time = t
-                    #the takeoff message in simulation has a sligthly different name than IRL, so we need this to record the sim takeoff time
-                    #BUT for some unknown reason the sim tests seem to work perfectly without even recording takeoff and adjusting the offset
-                    #so I will leave this commented here just in case the sim tests have to be worked on
-                    # if msg.name == "crazyflie_server" and msg.function == "_takeoff_callback":
-                    #     t = msg.stamp.sec + msg.stamp.nanosec *10**(-9)
-                    #     self.takeoff_time = t
-                    #     print(f"takeoff at {self.takeoff_time}")
-
-            #write the "takeoff command" time as a comment on the last line
-            writer.writerow([f"### takeoff time : {self.takeoff_time}"])
-            f.close()
+            self.convert(inputbag, output_for_frame)
         except FileNotFoundError:
             print(f"McapHandler : file {outputfile} not found")
             exit(1)
 
+    def write_mcap_to_csvs(self, inputbag:str, outputdir:str):
+        '''Like write_mcap_to_csv, but for all robots in /tf, written to <outputdir>/<robot>.csv'''
+        try:
+            print("Translating .mcap to .csv")
+            return self.convert(inputbag, lambda frame: str(Path(outputdir) / f"{frame}.csv"))
+        except FileNotFoundError:
+            print(f"McapHandler : directory {outputdir} not found")
+            exit(1)
+
 
 
 
@@ -77,8 +134,12 @@ if __name__ == "__main__":
     from argparse import ArgumentParser, Namespace
     parser = ArgumentParser(description="Translates the /tf topic of an .mcap rosbag file format to a .csv file")
     parser.add_argument("inputbag", type=str, help="The .mcap rosbag file to be translated")
-    parser.add_argument("outputfile", type=str, help="Output csv file that has to be created/overwritten")
+    parser.add_argument("outputfile", type=str, help="Output csv file that has to be created/overwritten, or the output directory with --all")
+    parser.add_argument("--all", action="store_true", help="Translate all robots in /tf, each to <outputfile>/<robot>.csv")
     args:Namespace = parser.parse_args()
 
     translator =  McapHandler()
-    translator.write_mcap_to_csv(args.inputbag,args.outputfile)
\ No newline at end of file
+    if args.all:
+        translator.write_mcap_to_csvs(args.inputbag,args.outputfile)
+    else:
+        translator.write_mcap_to_csv(args.inputbag,args.outputfile)
\ No newline at end of file
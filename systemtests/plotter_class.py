@@ -8,6 +8,64 @@ from crazyflie_py.uav_trajectory import Trajectory
 from pathlib import Path
 
 
+def read_rosbag_csv(rosbag_csvfile:str) -> tuple:
+    '''Reads a .csv file written by McapHandler and returns (data, takeoff_time) where data is the (t,x,y,z) array and
+    takeoff_time is the time of the "takeoff" command written as comment on the last line (None if there was no takeoff)'''
+    rosbag_data = np.loadtxt(rosbag_csvfile, delimiter=",")
+    with open(rosbag_csvfile) as f:
+        lastline = f.readlines()[-1] #get last line of csv file, where the takeoff time is written as comment
+    try:
+        takeoff_time = float(lastline[lastline.find(":") + 1 :])  #get the "takeoff" time from last line of csv
+    except ValueError: #if no takeoff was issued, there will be a "None" in the lastline which will produce value error when converting to float
+        takeoff_time = None
+    return rosbag_data, takeoff_time
+
+
+def in_order(times) -> np.ndarray:
+    '''Returns a boolean mask of the timestamps which are larger than all the timestamps before them'''
+    previous_max = np.maximum.accumulate(np.concatenate(([-1], times[:-1])))
+    return times > previous_max
+
+
+def trajectory_errors(trajectory:Trajectory, times, positions) -> tuple:
+    '''Evaluates the ideal trajectory at all the given times at once and returns (ideal_positions, euclidian_dist, matched).
+    The samples can be from several robots, concatenated. Samples whose time is outside of the ideal trajectory are not matched
+    and are compared to the default (0,0,0) ideal position'''
+    times = np.asarray(times, dtype=float)
+    matched = (times >= 0) & (times <= trajectory.duration)
+    ideal_positions = np.zeros((len(times), 3))
+    if np.any(matched):
+        ideal_positions[matched] = trajectory.compile().eval_many(times[matched]).pos
+    euclidian_dist = np.linalg.norm(ideal_positions - positions, axis=1)
+    return ideal_positions, euclidian_dist, matched
+
+
+def error_statistics(euclidian_dist, epsilon:float, robots=None) -> dict:
+    '''Returns the number of samples, the mean, median and max error and the number and percentage of samples whose error > epsilon.
+    If robots (the robot index 0..N-1 of each sample) is given, the statistics are arrays with one entry per robot'''
+    euclidian_dist = np.asarray(euclidian_dist)
+    per_robot = robots is not None
+    if not per_robot:
+        robots = np.zeros(len(euclidian_dist), dtype=int)
+
+    n = np.bincount(robots)
+    ends = np.cumsum(n)
+    starts = ends - n
+    sorted_dist = euclidian_dist[np.lexsort((euclidian_dist, robots))]
+    deviations = np.bincount(robots, weights=euclidian_dist > epsilon).astype(int)
+    stats = {
+        "samples": n,
+        "mean": np.bincount(robots, weights=euclidian_dist) / n,
+        "median": 0.5 * (sorted_dist[starts + (n - 1) // 2] + sorted_dist[starts + n // 2]),
+        "max": sorted_dist[ends - 1],
+        "deviations": deviations,
+        "percentage": deviations / n * 100,
+    }
+    if not per_robot:
+        stats = {key: value[0] for key, value in stats.items()}
+    return stats
+
+
 class Plotter:
 
     def __init__(self, sim_backend = False):
@@ -65,7 +123,7 @@ class Plotter:
 
 
         #get rosbag data
-        rosbag_data = np.loadtxt(rosbag_csvfile, delimiter=",")
+        rosbag_data, takeoff_time = read_rosbag_csv(rosbag_csvfile)
         
         self.bag_times = np.array(rosbag_data[:,0])
         self.bag_x = np.array(rosbag_data[:,1])
@@ -80,47 +138,53 @@ class Plotter:
         #since the rosbag doesn't start at a reliable time, we need to adjust the ideal time array and the real one so that they aren't offset. For this we compare the time where the "takeoff" command was
         # given to the crazyflie with the time of takeoff in the desired trajectory. With this we have the time-delay which we need to correct the offset (NB : empirically modified by 0.15 seconds this 
         #time-delay because that seems to be the delay between receiving the takeoff command and actually flying off)
-        with open(rosbag_csvfile) as f:
-                lines = f.readlines()
-                lastline = lines[-1] #get last line of csv file, where the takeoff time is written as comment
-                try:
-                    self.takeoff_time = float(lastline[lastline.find(":") + 1 :])  #get the "takeoff" time from last line of csv
-                except ValueError: #if no takeoff was issued, there will be a "None" in the lastline which will produce value error when converting to float
-                    print("Warning : No takeoff written in the lastline of the rosbag csv file : offset cannot be corrected.")
-                    self.takeoff_time = 0
-        offset1 = (self.ideal_takeoff - self.takeoff_time) - 0.15
+        delay = self.delay(takeoff_time)
+        # if self.test_name == "fig8" and self.SIM:
+        #     delay = self.DELAY_CONST_FIG8
+        # elif self.test_name == "mt" and self.SIM:
+        #     delay = self.DELAY_CONST_MT
 
 
         #####calculate ideal trajectory points corresponding to the times of recorded points 
+        #for all recorded datapoints who cannot be matched to a corresponding ideal position we assume the drone is on its ground start position (ie those datapoints are before takeoff or after landing)
+        bag_positions = np.column_stack((self.bag_x, self.bag_y, self.bag_z))
+        ideal_positions, self.euclidian_dist, matched = trajectory_errors(self.ideal_traj_csv, self.bag_times + delay, bag_positions)
+        self.ideal_traj_x, self.ideal_traj_y, self.ideal_traj_z = ideal_positions.T
+        self.deviation = np.flatnonzero(self.euclidian_dist > self.EPSILON)
+            
+        self.no_match_warning(np.flatnonzero(~matched))
 
-        self.ideal_traj_x = np.empty([bag_arrays_size])
-        self.ideal_traj_y = np.empty([bag_arrays_size])
-        self.ideal_traj_z = np.empty([bag_arrays_size])
-        self.euclidian_dist = np.empty([bag_arrays_size])
 
-        no_match_in_idealcsv=[]
+    def delay(self, takeoff_time) -> float:
+        '''Returns the time offset between the recorded and the ideal trajectory, given the takeoff time of the recording'''
+        if takeoff_time is None:
+            print("Warning : No takeoff written in the lastline of the rosbag csv file : offset cannot be corrected.")
+            takeoff_time = 0
+        self.takeoff_time = takeoff_time
+        return (self.ideal_takeoff - takeoff_time) - 0.15
 
-        delay = offset1
-        # if self.test_name == "fig8" and self.SIM:
-        #     delay = self.DELAY_CONST_FIG8
-        # elif self.test_name == "mt" and self.SIM:
-        #     delay = self.DELAY_CONST_MT
-        
-        for i in range(bag_arrays_size):  
-            try:
-                pos = self.ideal_traj_csv.eval(self.bag_times[i] + delay).pos
-            except AssertionError: 
-                no_match_in_idealcsv.append(i)
-                pos = [0,0,0]  #for all recorded datapoints who cannot be matched to a corresponding ideal position we assume the drone is on its ground start position (ie those datapoints are before takeoff or after landing)
-               
-            self.ideal_traj_x[i], self.ideal_traj_y[i], self.ideal_traj_z[i]= pos[0], pos[1], pos[2]
-
-            self.euclidian_dist[i] = np.linalg.norm([self.ideal_traj_x[i]-self.bag_x[i], 
-                                                self.ideal_traj_y[i]-self.bag_y[i], self.ideal_traj_z[i]-self.bag_z[i]])
-            if self.euclidian_dist[i] > self.EPSILON:
-                self.deviation.append(i)
-            
-        self.no_match_warning(no_match_in_idealcsv)
+
+    def compare_robots(self, ideal_csvfile:str, rosbag_csvfiles:list) -> dict:
+        '''Compares the recorded trajectories of several robots which all flew the same ideal trajectory (e.g. the .csv files
+        written by McapHandler.write_mcap_to_csvs) and returns the error statistics (see error_statistics) with one entry per robot'''
+        ideal_traj = Trajectory()
+        ideal_traj.loadcsv(os.path.join(os.path.dirname(os.path.abspath(__file__)),ideal_csvfile))
+
+        times, positions, robots = [], [], []
+        for robot, rosbag_csvfile in enumerate(rosbag_csvfiles):
+            rosbag_data, takeoff_time = read_rosbag_csv(rosbag_csvfile)
+            rosbag_data = rosbag_data[in_order(rosbag_data[:,0])]
+            times.append(rosbag_data[:,0] + self.delay(takeoff_time))
+            positions.append(rosbag_data[:,1:4])
+            robots.append(np.full(len(rosbag_data), robot))
+
+        robots = np.concatenate(robots)
+        _, euclidian_dist, _ = trajectory_errors(ideal_traj, np.concatenate(times), np.concatenate(positions))
+        stats = error_statistics(euclidian_dist, self.EPSILON, robots)
+        for robot, rosbag_csvfile in enumerate(rosbag_csvfiles):
+            print(f"{rosbag_csvfile} : {stats['percentage'][robot]:.4f}% of datapoints > EPSILON, average error : {stats['mean'][robot]:.6f} [m], "
+                  f"median error : {stats['median'][robot]:.6f} [m], max error : {stats['max'][robot]:.6f} [m]")
+        return stats
 
 
     def no_match_warning(self, unmatched_values:list):
@@ -131,20 +195,16 @@ class Plotter:
         if no_match_arr.size == 0:
             return
         
-        split_index_arr = []
-
-        for i in range(no_match_arr.size - 1):                    #find indexes which are not consecutive
-            if(no_match_arr[i+1] != no_match_arr[i]+1):
-                split_index_arr.append(i+1)
+        split_index_arr = np.flatnonzero(np.diff(no_match_arr) != 1) + 1   #find indexes which are not consecutive
 
         banana_split = np.split(no_match_arr, split_index_arr)     #split array into sub-array of consecutive indexes -> each sub-array is a timerange for which ideal positions weren't able to calculated
         print(f"{len(no_match_arr)} recorded positions weren't able to be matched with a specified ideal position and were given the default (0,0,0) ideal position instead.")
         print("Probable reason : their timestamp is before the start of the ideal trajectory or after its end.")
         if len(banana_split)==2:
             timerange1_start = self.bag_times[banana_split[0][0]]
-            timerange1_end= self.bag_times[banana_split[0][1]]
+            timerange1_end= self.bag_times[banana_split[0][-1]]
             timerange2_start = self.bag_times[banana_split[1][0]]
-            timerange2_end = self.bag_times[banana_split[1][1]]
+            timerange2_end = self.bag_times[banana_split[1][-1]]
             print(f"These datapoints correspond to the time ranges [{timerange1_start} , {timerange1_end}] and [{timerange2_start} , {timerange2_end}]")
 
 
@@ -160,20 +220,15 @@ class Plotter:
         #and only concerns a very small percentage of datapoints (10-40 over about 1800 total), so it is not a big deal. We do not know if this bug stems from the Rosbag recording, from how /tf behaves or from the radio
 
         #Since we use a lineplot, we need to get rid of these datapoints that are in an order that doesn't make sense so that the plot can be readable
-        self.nonsensical = [] #list of indexes of datapoints who arrived too late, meaning their timestamp doesn't follow the ones before
-        time = -1
-        for index,t in enumerate(self.bag_times):
-            if t > time:
-                time = t
-            else:
-                self.nonsensical.append(index)
+        keep = in_order(self.bag_times)
+        self.nonsensical = np.flatnonzero(~keep) #indexes of datapoints who arrived too late, meaning their timestamp doesn't follow the ones before
 
 
-        if self.nonsensical: #if self.nonsensical is not empty
-            self.bag_times = np.delete(self.bag_times, self.nonsensical)
-            self.bag_x = np.delete(self.bag_x, self.nonsensical)
-            self.bag_y = np.delete(self.bag_y, self.nonsensical)
-            self.bag_z = np.delete(self.bag_z, self.nonsensical)
+        if self.nonsensical.size: #if self.nonsensical is not empty
+            self.bag_times = self.bag_times[keep]
+            self.bag_x = self.bag_x[keep]
+            self.bag_y = self.bag_y[keep]
+            self.bag_z = self.bag_z[keep]
             print(f"{len(self.nonsensical)} datapoints were ignored because because their timestamp wasn't in the good order (delayed message problem). They go from index {self.nonsensical[0]} to {self.nonsensical[-1]}")
 
         assert len(self.bag_times) == len(self.bag_x) == len(self.bag_y) == len(self.bag_z), "Plotter : self.bag_* aren't the same size after adjusting arrays"